@@ -69,3 +69,38 @@ BEGIN
         CREATE INDEX IF NOT EXISTS idx_parquet_import_tracking_end_timestamp ON ${POSTGRES_SCHEMA}.parquet_import_tracking(end_timestamp);
     END IF;
 END $$;
+
+-- the lookups on startup (newest completed incremental, newest full) use the idx_parquet_import_tracking_latest_* indexes
+-- they are built CONCURRENTLY by the next two migrations. postgres only allows that as the only statement in a query
+-- a build that was interrupted leaves an invalid index behind that IF NOT EXISTS would skip. drop it so that it is built again
+DO $$
+DECLARE
+    index_name TEXT;
+BEGIN
+    FOR index_name IN
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON i.indexrelid = c.oid
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE n.nspname = '${POSTGRES_SCHEMA}'
+          AND c.relname IN ('idx_parquet_import_tracking_latest_completed', 'idx_parquet_import_tracking_latest_full')
+          AND NOT i.indisvalid
+    LOOP
+        EXECUTE format('DROP INDEX %I.%I', '${POSTGRES_SCHEMA}', index_name);
+    END LOOP;
+END $$;
+
+-- old completed incrementals are removed by the maintenance command. this keeps a count of what was removed
+CREATE TABLE IF NOT EXISTS ${POSTGRES_SCHEMA}.parquet_import_tracking_summary (
+    table_name VARCHAR NOT NULL,
+    file_type VARCHAR NOT NULL,
+    file_version VARCHAR NOT NULL,
+    file_duration_s INT NOT NULL,
+    backfill BOOLEAN NOT NULL,
+    num_files BIGINT NOT NULL DEFAULT 0,
+    num_empty BIGINT NOT NULL DEFAULT 0,
+    first_end_timestamp TIMESTAMP,
+    last_end_timestamp TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, file_type, file_version, file_duration_s, backfill)
+);
@@ -0,0 +1,6 @@
+-- finds the newest completed incremental of a table on startup. scanned backwards and stops at the first row
+-- tracking tables can be large. CONCURRENTLY doesn't block the importers that are writing to them. this must be the only statement in this file
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parquet_import_tracking_latest_completed
+ON ${POSTGRES_SCHEMA}.parquet_import_tracking (table_name, file_type, file_version, file_duration_s, backfill, end_timestamp DESC)
+INCLUDE (file_name)
+WHERE completed IS TRUE;
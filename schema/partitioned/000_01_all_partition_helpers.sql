@@ -0,0 +1,106 @@
+-- Helpers for the opt-in partitioned tables (see POSTGRES_PARTITIONED_TABLES)
+
+-- Creates one range partition per month on `parent_table` from `first_month` through `last_month`
+-- Postgres refuses to create a partition while the DEFAULT partition holds rows for its range.
+-- Those rows are moved into the new partition with the DEFAULT partition detached, all in one transaction.
+CREATE OR REPLACE FUNCTION ${POSTGRES_SCHEMA}.create_monthly_partitions(
+    parent_table TEXT,
+    first_month DATE,
+    last_month DATE
+) RETURNS VOID AS $$
+DECLARE
+    parent_oid REGCLASS := (quote_ident('${POSTGRES_SCHEMA}') || '.' || quote_ident(parent_table))::regclass;
+    partition_column TEXT;
+    default_name TEXT;
+    default_has_rows BOOLEAN;
+    partition_name TEXT;
+    month_start DATE := date_trunc('month', first_month)::date;
+    month_end DATE;
+BEGIN
+    SELECT a.attname INTO partition_column
+    FROM pg_partitioned_table pt
+    JOIN pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+    WHERE pt.partrelid = parent_oid;
+
+    SELECT child.relname INTO default_name
+    FROM pg_inherits
+    JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+    WHERE pg_inherits.inhparent = parent_oid
+      AND pg_get_expr(child.relpartbound, child.oid) = 'DEFAULT';
+
+    WHILE month_start <= last_month LOOP
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := parent_table || '_' || to_char(month_start, 'YYYY_MM');
+
+        IF to_regclass(quote_ident('${POSTGRES_SCHEMA}') || '.' || quote_ident(partition_name)) IS NULL THEN
+            default_has_rows := false;
+
+            IF default_name IS NOT NULL THEN
+                EXECUTE format(
+                    'SELECT EXISTS (SELECT 1 FROM %I.%I WHERE %I >= $1 AND %I < $2)',
+                    '${POSTGRES_SCHEMA}', default_name, partition_column, partition_column
+                ) INTO default_has_rows USING month_start, month_end;
+            END IF;
+
+            IF default_has_rows THEN
+                EXECUTE format(
+                    'ALTER TABLE %I.%I DETACH PARTITION %I.%I',
+                    '${POSTGRES_SCHEMA}', parent_table, '${POSTGRES_SCHEMA}', default_name
+                );
+            END IF;
+
+            EXECUTE format(
+                'CREATE TABLE %I.%I PARTITION OF %I.%I FOR VALUES FROM (%L) TO (%L)',
+                '${POSTGRES_SCHEMA}', partition_name, '${POSTGRES_SCHEMA}', parent_table, month_start, month_end
+            );
+
+            IF default_has_rows THEN
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM %I.%I WHERE %I >= $1 AND %I < $2 RETURNING *) INSERT INTO %I.%I SELECT * FROM moved',
+                    '${POSTGRES_SCHEMA}', default_name, partition_column, partition_column, '${POSTGRES_SCHEMA}', partition_name
+                ) USING month_start, month_end;
+
+                EXECUTE format(
+                    'ALTER TABLE %I.%I ATTACH PARTITION %I.%I DEFAULT',
+                    '${POSTGRES_SCHEMA}', parent_table, '${POSTGRES_SCHEMA}', default_name
+                );
+
+                RAISE NOTICE 'moved rows from % into %', default_name, partition_name;
+            END IF;
+        END IF;
+
+        month_start := month_end;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detaches the monthly partitions of `parent_table` that end before `older_than`.
+-- The detached tables are kept so that they can be archived or dropped by hand.
+CREATE OR REPLACE FUNCTION ${POSTGRES_SCHEMA}.detach_monthly_partitions(
+    parent_table TEXT,
+    older_than DATE
+) RETURNS SETOF TEXT AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        JOIN pg_namespace ns ON parent.relnamespace = ns.oid
+        WHERE ns.nspname = '${POSTGRES_SCHEMA}'
+          AND parent.relname = parent_table
+          AND child.relname ~ ('^' || parent_table || '_[0-9]{4}_[0-9]{2}$')
+          AND (to_date(right(child.relname, 7), 'YYYY_MM') + INTERVAL '1 month') <= older_than
+        ORDER BY child.relname
+    LOOP
+        EXECUTE 'ALTER TABLE '
+            || quote_ident('${POSTGRES_SCHEMA}') || '.' || quote_ident(parent_table)
+            || ' DETACH PARTITION '
+            || quote_ident('${POSTGRES_SCHEMA}') || '.' || quote_ident(partition_name);
+
+        RETURN NEXT partition_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,70 @@
+-- NOTE! This is the partitioned version of ../025_00_public-postgres_nindexer_casts.sql
+-- It is only used when "casts" is in POSTGRES_PARTITIONED_TABLES.
+-- The primary key must include the partition key, so upserts conflict on (id, "timestamp").
+
+DO $$
+BEGIN
+    -- An existing unpartitioned table cannot be converted in place
+    IF EXISTS (
+        SELECT 1
+        FROM pg_class c
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE c.relname = 'casts'
+          AND n.nspname = '${POSTGRES_SCHEMA}'
+          AND c.relkind <> 'p'
+    ) THEN
+        RAISE EXCEPTION '${POSTGRES_SCHEMA}.casts already exists and is not partitioned. Rename or drop it before enabling partitioning.';
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS ${POSTGRES_SCHEMA}.casts
+(
+    id uuid NOT NULL,
+    created_at timestamp without time zone NOT NULL,
+    updated_at timestamp without time zone NOT NULL,
+    deleted_at timestamp without time zone,
+    "timestamp" timestamp without time zone NOT NULL,
+    fid bigint NOT NULL,
+    hash bytea NOT NULL,
+    text text COLLATE pg_catalog."default" NOT NULL,
+    parent_hash bytea,
+    parent_fid bigint,
+    parent_url text COLLATE pg_catalog."default",
+    root_parent_hash bytea NOT NULL,
+    root_parent_url text COLLATE pg_catalog."default",
+    embedded_urls text[] COLLATE pg_catalog."default",
+    embedded_casts bytea[],
+    mentions bigint[],
+    mentions_positions smallint[],
+    ticker_mentions text[] COLLATE pg_catalog."default",
+    ticker_mentions_positions smallint[],
+    channel_mentions text[] COLLATE pg_catalog."default",
+    channel_mentions_positions smallint[],
+    embedded_casts_fids bigint[],
+    embeds jsonb,
+    creator_app_fid bigint,
+    deleter_app_fid bigint,
+    PRIMARY KEY (id, "timestamp")
+) PARTITION BY RANGE ("timestamp");
+
+-- catches anything outside of the monthly partitions. this should stay empty
+CREATE TABLE IF NOT EXISTS ${POSTGRES_SCHEMA}.casts_default
+PARTITION OF ${POSTGRES_SCHEMA}.casts DEFAULT;
+
+-- this runs on every start, so there are always a few months of partitions ready
+SELECT ${POSTGRES_SCHEMA}.create_monthly_partitions(
+    'casts',
+    DATE '2020-01-01',
+    (now() + INTERVAL '3 months')::date
+);
+
+DO $$
+BEGIN
+    -- Create the index if the table is empty
+    IF NOT EXISTS (SELECT 1 FROM ${POSTGRES_SCHEMA}.casts LIMIT 1) THEN
+        CREATE INDEX IF NOT EXISTS idx_casts_upsert
+        ON ${POSTGRES_SCHEMA}.casts (id, updated_at);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS casts_hash ON ${POSTGRES_SCHEMA}.casts ("hash");
@@ -0,0 +1,60 @@
+-- NOTE! This is the partitioned version of ../026_00_public-postgres_nindexer_reactions.sql
+-- It is only used when "reactions" is in POSTGRES_PARTITIONED_TABLES.
+-- The primary key must include the partition key, so upserts conflict on (id, "timestamp").
+
+DO $$
+BEGIN
+    -- An existing unpartitioned table cannot be converted in place
+    IF EXISTS (
+        SELECT 1
+        FROM pg_class c
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE c.relname = 'reactions'
+          AND n.nspname = '${POSTGRES_SCHEMA}'
+          AND c.relkind <> 'p'
+    ) THEN
+        RAISE EXCEPTION '${POSTGRES_SCHEMA}.reactions already exists and is not partitioned. Rename or drop it before enabling partitioning.';
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS ${POSTGRES_SCHEMA}.reactions
+(
+    id uuid NOT NULL,
+    created_at timestamp without time zone NOT NULL,
+    updated_at timestamp without time zone NOT NULL,
+    deleted_at timestamp without time zone,
+    "timestamp" timestamp without time zone NOT NULL,
+    reaction_type smallint NOT NULL,
+    fid bigint NOT NULL,
+    target_hash bytea,
+    target_fid bigint,
+    target_url text COLLATE pg_catalog."default",
+    creator_app_fid bigint,
+    deleter_app_fid bigint,
+    PRIMARY KEY (id, "timestamp")
+) PARTITION BY RANGE ("timestamp");
+
+-- catches anything outside of the monthly partitions. this should stay empty
+CREATE TABLE IF NOT EXISTS ${POSTGRES_SCHEMA}.reactions_default
+PARTITION OF ${POSTGRES_SCHEMA}.reactions DEFAULT;
+
+-- this runs on every start, so there are always a few months of partitions ready
+SELECT ${POSTGRES_SCHEMA}.create_monthly_partitions(
+    'reactions',
+    DATE '2020-01-01',
+    (now() + INTERVAL '3 months')::date
+);
+
+DO $$
+BEGIN
+    -- Create the index if the table is empty
+    IF NOT EXISTS (SELECT 1 FROM ${POSTGRES_SCHEMA}.reactions LIMIT 1) THEN
+        CREATE INDEX IF NOT EXISTS idx_reactions_upsert
+        ON ${POSTGRES_SCHEMA}.reactions (id, updated_at);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS reactions_fid ON ${POSTGRES_SCHEMA}.reactions (fid);
+CREATE INDEX IF NOT EXISTS reactions_target_fid ON ${POSTGRES_SCHEMA}.reactions (target_fid);
+CREATE INDEX IF NOT EXISTS reactions_target_hash ON ${POSTGRES_SCHEMA}.reactions (target_hash);
+CREATE INDEX IF NOT EXISTS reactions_timestamp_not_deleted ON ${POSTGRES_SCHEMA}.reactions ("timestamp") WHERE deleted_at IS NULL;
@@ -0,0 +1,214 @@
+"""
+Planning and importing the files of a backfill.
+
+Used by the backfill command and by the importer when a table's filters change.
+"""
+from datetime import UTC, datetime
+from pathlib import Path
+import time
+
+from sqlalchemy import select
+
+from .db import (
+    _tracking_backend,
+    import_parquet,
+    mark_completed,
+    read_parquet_metadata,
+)
+from .logger import LOGGER
+from .s3 import (
+    download_incremental,
+    download_known_full,
+    list_full_exports,
+    list_incrementals,
+    parse_parquet_filename,
+)
+from .settings import Settings
+
+
+def window_dt(timestamp: int) -> datetime:
+    """updated_at is stored without a timezone. the window has to be naive utc too"""
+    return datetime.fromtimestamp(timestamp, UTC).replace(tzinfo=None)
+
+
+def plan_backfill(
+    s3_client,
+    settings: Settings,
+    table,
+    start_timestamp: int,
+    end_timestamp: int,
+) -> list[tuple[str, dict, int, int]]:
+    """
+    The s3 objects to import for a table as (file_type, s3_object, window_start,
+    window_end), oldest first.
+
+    Incrementals cover most of the range. If the range starts before the oldest
+    incremental, the oldest full export that ends after that point covers the gap.
+    """
+    max_files = (end_timestamp - start_timestamp) // settings.incremental_duration + 1
+
+    incrementals = list_incrementals(
+        s3_client,
+        settings,
+        table,
+        start_timestamp,
+        end_timestamp,
+        max_files,
+    )
+
+    plan = []
+
+    # incrementals only hold rows that changed during their own span
+    covered_from = min(incrementals) if incrementals else end_timestamp
+
+    if covered_from > start_timestamp:
+        full_exports = list_full_exports(s3_client, settings, table)
+
+        covering = [
+            s3_object
+            for s3_object in full_exports
+            if parse_parquet_filename(s3_object["Key"])["end_timestamp"] >= covered_from
+        ]
+
+        if covering:
+            plan.append(("full", covering[0], start_timestamp, covered_from))
+        elif full_exports:
+            LOGGER.warning(
+                "no full export covers the start of the backfill. using the latest",
+                extra={"table": table.name, "covered_from": covered_from},
+            )
+            plan.append(("full", full_exports[-1], start_timestamp, covered_from))
+        else:
+            LOGGER.warning(
+                "no full export found. "
+                "rows from before the oldest incremental will be missing",
+                extra={"table": table.name, "covered_from": covered_from},
+            )
+
+    num_missing = max_files - 1 - len(incrementals)
+    if incrementals and num_missing > 0:
+        LOGGER.warning(
+            "incrementals are missing from the backfill range",
+            extra={"table": table.name, "num_missing": num_missing},
+        )
+
+    for incremental_start in sorted(incrementals):
+        plan.append(
+            (
+                "incremental",
+                incrementals[incremental_start],
+                start_timestamp,
+                end_timestamp,
+            ),
+        )
+
+    return plan
+
+
+def completed_backfill_files(
+    db_engine,
+    parquet_import_tracking,
+    table_name: str,
+    settings: Settings,
+) -> set[str]:
+    """Files in this backfill's directory that finished importing on an earlier run"""
+    if _tracking_backend(settings) is not None:
+        # import_parquet still resumes each file from the graph's tracking
+        return set()
+
+    t = parquet_import_tracking
+
+    with db_engine.connect() as conn:
+        rows = conn.execute(
+            select(t.c.file_name)
+            .where(t.c.table_name == table_name)
+            .where(t.c.backfill.is_(True))
+            .where(t.c.completed.is_(True))
+            .where(t.c.file_name.startswith(str(settings.target_dir()))),
+        ).fetchall()
+
+    return {row.file_name for row in rows}
+
+
+def local_backfill_path(settings: Settings, file_type: str, s3_object: dict) -> str:
+    """Where download_known_full or download_incremental puts an s3 object"""
+    name = Path(s3_object["Key"]).name
+
+    if file_type == "incremental" and s3_object["Size"] == 0:
+        name = Path(name).with_suffix(".empty").name
+
+    return str(Path(settings.target_dir(), name))
+
+
+def backfill_file(
+    db_engine,
+    download_threadpool,
+    s3_client,
+    table,
+    parquet_import_tracking,
+    row_group_executor,
+    row_filters,
+    settings: Settings,
+    f_shutdown,
+    progress_callbacks,
+    file_type: str,
+    s3_object: dict,
+    window_start: int,
+    window_end: int,
+) -> dict:
+    """Download and import one file. Returns stats for the throughput logs"""
+    start = time.time()
+
+    if file_type == "full":
+        local_file = download_known_full(
+            download_threadpool,
+            s3_client,
+            settings,
+            Path(s3_object["Key"]).name,
+            progress_callbacks["full_bytes"],
+            row_filters=row_filters,
+        )
+    else:
+        local_file = download_incremental(
+            download_threadpool,
+            s3_client,
+            settings,
+            table,
+            parse_parquet_filename(s3_object["Key"])["start_timestamp"],
+            progress_callbacks["incremental_bytes"],
+            progress_callbacks["empty_steps"],
+            s3_object=s3_object,
+            row_filters=row_filters,
+        )
+
+    import_parquet(
+        db_engine,
+        table,
+        local_file,
+        file_type,
+        progress_callbacks["steps"],
+        progress_callbacks["empty_steps"],
+        parquet_import_tracking,
+        row_group_executor,
+        row_filters,
+        settings,
+        f_shutdown,
+        backfill=True,
+        backfill_start_timestamp=window_dt(window_start),
+        backfill_end_timestamp=window_dt(window_end),
+    )
+
+    mark_completed(db_engine, parquet_import_tracking, [local_file], settings=settings)
+
+    if str(local_file).endswith(".empty"):
+        num_rows = 0
+    else:
+        num_rows = read_parquet_metadata(local_file).num_rows
+
+    return {
+        "table": table.name,
+        "file_name": str(local_file),
+        "num_rows": num_rows,
+        "num_bytes": s3_object["Size"],
+        "seconds": time.time() - start,
+    }
@@ -1,13 +1,33 @@
 # TODO: take a /Users/bryan/neynar/neynar_parquet_exporter/data/v3/public-postgres/nindexer-casts-0-1744320248.parquet
+"""
+Re-import rows that were updated in a time range. Useful after adding a new filter.
+
+One known full export:
+
+    PARQUET_FILE=nindexer-casts-0-1744320248.parquet START_TIMESTAMP=... python -m
+    neynar_parquet_importer.cli.backfill
+
+Every file for some tables (TABLES, FILTER_FILE and the rest of the settings are the
+same as the importer's):
+
+    START_TIMESTAMP=... END_TIMESTAMP=... python -m neynar_parquet_importer.cli.backfill
+
+The incrementals in the range are imported FILE_WORKERS at a time. If the range starts
+before the oldest incremental, the full export that covers that gap is imported first.
+Files are downloaded under `{LOCAL_INPUT_DIR}/backfill/{start}-{end}` so they get their
+own `backfill=True` tracking rows. Running the same range again skips the files that
+already completed.
+"""
+from concurrent import futures
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
-from datetime import datetime
 import logging
 import os
 from os import PathLike
 from pathlib import Path
 import time
 import dotenv
+import orjson
 from rich.progress import (
     Progress,
     MofNCompleteColumn,
@@ -16,12 +36,266 @@ from rich.progress import (
 )
 from ipdb import launch_ipdb_on_exception
 
-from neynar_parquet_importer.db import get_tables, import_parquet, init_db, mark_completed
+from neynar_parquet_importer.backfill import (
+    backfill_file,
+    completed_backfill_files,
+    local_backfill_path,
+    plan_backfill,
+    window_dt,
+)
+from neynar_parquet_importer.database.factory import DatabaseFactory
+from neynar_parquet_importer.db import (
+    get_non_postgres_tables,
+    get_tables,
+    import_parquet,
+    init_db,
+    mark_completed,
+)
+from neynar_parquet_importer.logger import LOGGER
+from neynar_parquet_importer.metering import get_meter
 from neynar_parquet_importer.progress import ProgressCallback
-from neynar_parquet_importer.s3 import parse_parquet_filename, download_known_full, get_s3_client
+from neynar_parquet_importer.s3 import (
+    parse_parquet_filename,
+    download_known_full,
+    get_s3_client,
+)
 from neynar_parquet_importer.settings import SHUTDOWN_EVENT, CuMode, Settings
 
 
+def main_tables(
+    settings: Settings,
+    table_names: list[str],
+    start_timestamp: int,
+    end_timestamp: int,
+):
+    """
+    Backfill every full and incremental file for the tables in [start_timestamp,
+    end_timestamp]
+    """
+    # a separate directory means separate tracking rows. the live importer's rows for
+    # the same files aren't touched
+    settings = settings.model_copy(
+        update={
+            "local_input_dir": settings.local_input_dir
+            / "backfill"
+            / f"{start_timestamp}-{end_timestamp}",
+        },
+    )
+
+    with ExitStack() as stack:
+        shutdown_executor = row_group_executor = file_executor = None
+        try:
+            # graph backends are shared by all the row group workers. close them after
+            # the executors finish
+            stack.callback(DatabaseFactory.close_all)
+
+            # send the last row counts and CU after the row group workers are done
+            stack.callback(get_meter(settings).flush)
+
+            if settings.non_postgres_backend():
+                db_engine = None
+                tables = get_non_postgres_tables(table_names)
+            else:
+                db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+
+                tables = get_tables(settings.postgres_schema, db_engine, table_names)
+
+            missing = [
+                table_name for table_name in table_names if table_name not in tables
+            ]
+            if missing:
+                raise KeyError(
+                    f"Tables not found in schema {settings.postgres_schema}",
+                    missing,
+                )
+            parquet_import_tracking = tables["parquet_import_tracking"]
+
+            steps_progress = Progress(
+                *Progress.get_default_columns(),
+                MofNCompleteColumn(),
+            )
+            bytes_progress = Progress(
+                *Progress.get_default_columns(),
+                DownloadColumn(),
+                TransferSpeedColumn(),
+            )
+            # the logs report progress. the bars are only needed by the download and
+            # import helpers
+            progress_callbacks = {
+                "steps": ProgressCallback(steps_progress, "steps", 0, enabled=False),
+                "empty_steps": ProgressCallback(
+                    steps_progress,
+                    "empty",
+                    0,
+                    enabled=False,
+                ),
+                "full_bytes": ProgressCallback(
+                    bytes_progress,
+                    "full_bytes",
+                    0,
+                    enabled=False,
+                ),
+                "incremental_bytes": ProgressCallback(
+                    bytes_progress,
+                    "incremental_bytes",
+                    0,
+                    enabled=False,
+                ),
+            }
+
+            row_group_executor = stack.enter_context(
+                ThreadPoolExecutor(
+                    max_workers=settings.row_workers,
+                    thread_name_prefix="BackfillRows",
+                ),
+            )
+            file_executor = stack.enter_context(
+                ThreadPoolExecutor(
+                    max_workers=settings.file_workers,
+                    thread_name_prefix="BackfillFiles",
+                ),
+            )
+            download_threadpool = stack.enter_context(
+                ThreadPoolExecutor(
+                    max_workers=settings.download_workers,
+                    thread_name_prefix="BackfillDownload",
+                ),
+            )
+            shutdown_executor = stack.enter_context(
+                ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix="Shutdown",
+                ),
+            )
+
+            f_shutdown = shutdown_executor.submit(SHUTDOWN_EVENT.wait)
+
+            filter_file = settings.filter_file
+            if filter_file:
+                with filter_file.open("r") as f:
+                    row_filters = orjson.loads(f.read())
+            else:
+                row_filters = {}
+
+            s3_client = get_s3_client(settings)
+
+            plan = []
+            for table_name in table_names:
+                table = tables[table_name]
+
+                table_plan = plan_backfill(
+                    s3_client,
+                    settings,
+                    table,
+                    start_timestamp,
+                    end_timestamp,
+                )
+
+                completed = completed_backfill_files(
+                    db_engine,
+                    parquet_import_tracking,
+                    table_name,
+                    settings,
+                )
+
+                num_completed = 0
+                for file_type, s3_object, window_start, window_end in table_plan:
+                    if local_backfill_path(settings, file_type, s3_object) in completed:
+                        num_completed += 1
+                        continue
+
+                    plan.append((table, file_type, s3_object, window_start, window_end))
+
+                LOGGER.info(
+                    "planned backfill",
+                    extra={
+                        "table": table_name,
+                        "num_files": len(table_plan),
+                        "num_completed": num_completed,
+                    },
+                )
+
+            num_files = len(plan)
+            num_done = num_rows = num_bytes = 0
+            started_at = time.time()
+
+            def log_done(stats: dict):
+                nonlocal num_done, num_rows, num_bytes
+
+                num_done += 1
+                num_rows += stats["num_rows"]
+                num_bytes += stats["num_bytes"]
+                elapsed_s = max(time.time() - started_at, 1e-3)
+
+                LOGGER.info(
+                    "backfilled %s/%s",
+                    f"{num_done:_}",
+                    f"{num_files:_}",
+                    extra={
+                        **stats,
+                        "rows_per_s": num_rows / elapsed_s,
+                        "bytes_per_s": num_bytes / elapsed_s,
+                    },
+                )
+
+            # a month of 1 second files is millions of futures. only keep a few queued
+            # per worker
+            max_pending = settings.file_workers * 2
+            pending = set()
+
+            for table, file_type, s3_object, window_start, window_end in plan:
+                if len(pending) >= max_pending:
+                    done, pending = futures.wait(
+                        pending,
+                        return_when=futures.FIRST_COMPLETED,
+                    )
+                    for f in done:
+                        log_done(f.result())
+
+                pending.add(
+                    file_executor.submit(
+                        backfill_file,
+                        db_engine,
+                        download_threadpool,
+                        s3_client,
+                        table,
+                        parquet_import_tracking,
+                        row_group_executor,
+                        row_filters.get(
+                            f"{settings.parquet_s3_schema}.{table.name}",
+                            None,
+                        ),
+                        settings,
+                        f_shutdown,
+                        progress_callbacks,
+                        file_type,
+                        s3_object,
+                        window_start,
+                        window_end,
+                    ),
+                )
+
+            for f in futures.as_completed(pending):
+                log_done(f.result())
+
+            LOGGER.info(
+                "backfill complete",
+                extra={
+                    "tables": table_names,
+                    "num_files": num_files,
+                    "num_rows": num_rows,
+                    "num_bytes": num_bytes,
+                    "seconds": time.time() - started_at,
+                },
+            )
+        finally:
+            SHUTDOWN_EVENT.set()
+
+            for executor in (file_executor, row_group_executor, shutdown_executor):
+                if executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+
+
 def main(
     settings: Settings,
     parquet_file: PathLike,
@@ -39,9 +313,21 @@ def main(
                 table_name,
             ]
 
-            db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+            # graph backends are shared by all the row group workers. close them after
+            # the executors finish
+            stack.callback(DatabaseFactory.close_all)
 
-            tables = get_tables(settings.postgres_schema, db_engine, [])
+            # send the last row counts and CU after the row group workers are done
+            stack.callback(get_meter(settings).flush)
+
+            if settings.non_postgres_backend():
+                # import tracking is stored in the graph. postgres isn't needed at all
+                db_engine = None
+                tables = get_non_postgres_tables(table_names)
+            else:
+                db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+
+                tables = get_tables(settings.postgres_schema, db_engine, [])
 
             try:
                 table = tables[table_name]
@@ -97,8 +383,15 @@ def main(
             # TODO: move this to a helper
             f_shutdown = shutdown_executor.submit(SHUTDOWN_EVENT.wait)
 
-            # TODO: load filters from an optional file
-            row_filters = []
+            filter_file = settings.filter_file
+            if filter_file:
+                with filter_file.open("r") as f:
+                    row_filters = orjson.loads(f.read()).get(
+                        f"{settings.parquet_s3_schema}.{table_name}",
+                        None,
+                    )
+            else:
+                row_filters = None
 
             s3_client = get_s3_client(settings)
 
@@ -109,6 +402,7 @@ def main(
                 settings,
                 parquet_file,
                 progress_callback_full_bytes,
+                row_filters=row_filters,
             )
 
             if end_timestamp == 0:
@@ -127,11 +421,16 @@ def main(
                 settings,
                 f_shutdown,
                 backfill=True,  # should backfill
-                backfill_start_timestamp=datetime.fromtimestamp(start_timestamp),
-                backfill_end_timestamp=datetime.fromtimestamp(end_timestamp),
+                backfill_start_timestamp=window_dt(start_timestamp),
+                backfill_end_timestamp=window_dt(end_timestamp),
             )
 
-            mark_completed(db_engine, parquet_import_tracking, [full_filename])
+            mark_completed(
+                db_engine,
+                parquet_import_tracking,
+                [full_filename],
+                settings=settings,
+            )
             logging.info("", extra={"x": x})
 
             # TODO: how should we handle "mark completed?"
@@ -159,7 +458,7 @@ if __name__ == "__main__":
     settings.initialize()
 
     # TODO: more pydantic?
-    parquet_file = Path(os.environ["PARQUET_FILE"])
+    parquet_file = os.environ.get("PARQUET_FILE", None)
     start_timestamp = os.environ.get("START_TIMESTAMP", None)
     end_timestamp = int(os.environ.get("END_TIMESTAMP", 0))
     if start_timestamp is None:
@@ -172,8 +471,26 @@ if __name__ == "__main__":
     # if not parquet_file.exists():
     #    raise ValueError(f"Parquet file {parquet_file} does not exist")
 
+    if parquet_file:
+        run = main
+        args = (settings, Path(parquet_file))
+    else:
+        table_names = [t for t in settings.tables.split(",") if t]
+        if not table_names:
+            raise ValueError("No PARQUET_FILE or TABLES set")
+
+        if end_timestamp == 0:
+            end_timestamp = int(time.time())
+
+        run = main_tables
+        args = (settings, table_names)
+
     if settings.interactive_debug:
         with launch_ipdb_on_exception():
-            main(settings, parquet_file, start_timestamp=int(start_timestamp), end_timestamp=end_timestamp)
+            run(
+                *args,
+                start_timestamp=int(start_timestamp),
+                end_timestamp=end_timestamp,
+            )
     else:
-        main(settings, parquet_file, start_timestamp=int(start_timestamp), end_timestamp=end_timestamp)
+        run(*args, start_timestamp=int(start_timestamp), end_timestamp=end_timestamp)
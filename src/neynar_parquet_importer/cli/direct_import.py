@@ -1,54 +1,178 @@
 # TODO: take a /Users/bryan/neynar/neynar_parquet_exporter/data/v3/public-postgres/nindexer-casts-0-1744320248.parquet
+"""
+Import local parquet files without s3. Useful for seeding a dev database or restoring a
+snapshot.
+
+    PARQUET_FILE=./data/parquet/v3/public-postgres python -m
+    neynar_parquet_importer.cli.direct_import
+
+PARQUET_FILE can be one file, a directory or a glob. Each table's files are imported
+oldest first (full exports before incrementals).
+Tables are imported in parallel. Files are marked completed in the tracking table, so
+the importer picks up where they end.
+"""
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
-import logging
+import glob
 import os
 from pathlib import Path
+import time
 import dotenv
+import orjson
 from rich.progress import (
     Progress,
     MofNCompleteColumn,
 )
 from ipdb import launch_ipdb_on_exception
 
-from neynar_parquet_importer.db import get_tables, import_parquet, init_db
+from neynar_parquet_importer.database.factory import DatabaseFactory
+from neynar_parquet_importer.db import (
+    get_non_postgres_tables,
+    get_tables,
+    import_parquet,
+    init_db,
+    mark_completed,
+    read_parquet_metadata,
+)
+from neynar_parquet_importer.logger import LOGGER
+from neynar_parquet_importer.metering import get_meter
 from neynar_parquet_importer.progress import ProgressCallback
 from neynar_parquet_importer.s3 import parse_parquet_filename
 from neynar_parquet_importer.settings import SHUTDOWN_EVENT, Settings
 
 
-def main(parquet_file: Path, settings: Settings):
-    # TODO: how can we load a single file? how should we handle the tracking table?
+def find_parquet_files(parquet_path: str | Path) -> dict[str, list[Path]]:
+    """
+    The files in a file, directory or glob grouped by table. Each table's files are
+    sorted by their timestamps
+    """
+    parquet_path = str(parquet_path)
+
+    if os.path.isdir(parquet_path):
+        paths = [
+            *Path(parquet_path).glob("*.parquet"),
+            *Path(parquet_path).glob("*.empty"),
+        ]
+    elif glob.has_magic(parquet_path):
+        paths = [Path(p) for p in glob.glob(parquet_path)]
+    elif os.path.exists(parquet_path):
+        paths = [Path(parquet_path)]
+    else:
+        paths = []
+
+    files = {}
+    for path in paths:
+        parsed_filename = parse_parquet_filename(path)
+
+        files.setdefault(parsed_filename["table_name"], []).append(
+            (
+                parsed_filename["start_timestamp"],
+                parsed_filename["end_timestamp"],
+                path,
+            ),
+        )
+
+    return {
+        table_name: [path for _, _, path in sorted(table_files)]
+        for table_name, table_files in files.items()
+    }
+
+
+def import_table_files(
+    db_engine,
+    table,
+    parquet_import_tracking,
+    files: list[Path],
+    row_group_executor,
+    row_filters,
+    settings: Settings,
+    f_shutdown,
+    progress_callback,
+    empty_callback,
+) -> int:
+    """Import one table's files in order. Returns the number of rows read"""
+    num_rows = 0
+
+    for parquet_file in files:
+        parsed_filename = parse_parquet_filename(parquet_file)
+
+        if parsed_filename["start_timestamp"] > 0:
+            file_type = "incremental"
+        else:
+            file_type = "full"
+
+        import_parquet(
+            db_engine,
+            table,
+            parquet_file,
+            file_type,
+            progress_callback,
+            empty_callback,
+            parquet_import_tracking,
+            row_group_executor,
+            row_filters,
+            settings,
+            f_shutdown,
+            backfill_start_timestamp=None,
+            backfill_end_timestamp=None,
+        )
+
+        mark_completed(
+            db_engine,
+            parquet_import_tracking,
+            [parquet_file],
+            settings=settings,
+        )
+
+        if parquet_file.suffix != ".empty":
+            num_rows += read_parquet_metadata(parquet_file).num_rows
+
+    LOGGER.info(
+        "imported table",
+        extra={"table": table.name, "num_files": len(files), "num_rows": num_rows},
+    )
+
+    return num_rows
+
+
+def main(parquet_path: str | Path, settings: Settings):
+    files = find_parquet_files(parquet_path)
+
+    if not files:
+        raise ValueError(f"No parquet files found in {parquet_path}")
+
+    table_names = list(files)
 
     with ExitStack() as stack:
-        shutdown_executor = row_group_executor = None
+        shutdown_executor = table_executor = None
+        row_group_executors = {}
         try:
-            parsed_filename = parse_parquet_filename(parquet_file)
-
-            table_name = parsed_filename["table_name"]
+            # graph backends are shared by all the row group workers. close them after
+            # the executors finish
+            stack.callback(DatabaseFactory.close_all)
 
-            table_names = [
-                table_name,
-            ]
+            # send the last row counts and CU after the row group workers are done
+            stack.callback(get_meter(settings).flush)
 
-            db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+            if settings.non_postgres_backend():
+                # import tracking is stored in the graph. postgres isn't needed at all
+                db_engine = None
+                tables = get_non_postgres_tables(table_names)
+            else:
+                db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
 
-            tables = get_tables(settings.postgres_schema, db_engine, [])
+                tables = get_tables(settings.postgres_schema, db_engine, [])
 
-            try:
-                table = tables[table_name]
-            except KeyError:
+            missing = [
+                table_name for table_name in table_names if table_name not in tables
+            ]
+            if missing:
                 raise KeyError(
-                    f"Table {table_name} not found in schema {settings.postgres_schema}",
-                    tables.keys(),
+                    f"Tables not found in schema {settings.postgres_schema}",
+                    missing,
                 )
             parquet_import_tracking = tables["parquet_import_tracking"]
 
-            if parsed_filename["start_timestamp"] > 0:
-                file_type = "incremental"
-            else:
-                file_type = "full"
-
             # TODO: finish the progress bars
             steps_progress = Progress(
                 *Progress.get_default_columns(),
@@ -60,12 +184,22 @@ def main(parquet_file: Path, settings: Settings):
             )
             empty_callback = ProgressCallback(steps_progress, "empty", 0, enabled=False)
 
-            row_group_executor = stack.enter_context(
+            # one worker per table keeps each table's files in order
+            table_executor = stack.enter_context(
                 ThreadPoolExecutor(
-                    max_workers=settings.row_workers,
-                    thread_name_prefix=f"{table_name}Rows",
+                    max_workers=len(table_names),
+                    thread_name_prefix="Tables",
                 )
             )
+            row_group_executors = {
+                table_name: stack.enter_context(
+                    ThreadPoolExecutor(
+                        max_workers=settings.row_workers,
+                        thread_name_prefix=f"{table_name}Rows",
+                    ),
+                )
+                for table_name in table_names
+            }
             shutdown_executor = stack.enter_context(
                 ThreadPoolExecutor(
                     max_workers=1,
@@ -76,40 +210,58 @@ def main(parquet_file: Path, settings: Settings):
             # TODO: move this to a helper
             f_shutdown = shutdown_executor.submit(SHUTDOWN_EVENT.wait)
 
-            # TODO: load filters from an optional file
-            row_filters = []
-
-            x = import_parquet(
-                db_engine,
-                table,
-                parquet_file,
-                file_type,
-                progress_callback,
-                empty_callback,
-                parquet_import_tracking,
-                row_group_executor,
-                row_filters,
-                settings,
-                f_shutdown,
-                backfill_start_timestamp=None,
-                backfill_end_timestamp=None,
-            )
+            filter_file = settings.filter_file
+            if filter_file:
+                with filter_file.open("r") as f:
+                    row_filters = orjson.loads(f.read())
+            else:
+                row_filters = {}
 
-            logging.info("", extra={"x": x})
+            started_at = time.time()
 
-            # TODO: how should we handle "mark completed?"
+            fs = [
+                table_executor.submit(
+                    import_table_files,
+                    db_engine,
+                    tables[table_name],
+                    parquet_import_tracking,
+                    table_files,
+                    row_group_executors[table_name],
+                    row_filters.get(f"{settings.parquet_s3_schema}.{table_name}", None),
+                    settings,
+                    f_shutdown,
+                    progress_callback,
+                    empty_callback,
+                )
+                for table_name, table_files in files.items()
+            ]
+
+            num_rows = sum(f.result() for f in fs)
+
+            elapsed_s = max(time.time() - started_at, 1e-3)
+
+            LOGGER.info(
+                "direct import complete",
+                extra={
+                    "tables": table_names,
+                    "num_files": sum(
+                        len(table_files) for table_files in files.values()
+                    ),
+                    "num_rows": num_rows,
+                    "seconds": elapsed_s,
+                    "rows_per_s": num_rows / elapsed_s,
+                },
+            )
         finally:
             SHUTDOWN_EVENT.set()
 
-            if row_group_executor:
-                row_group_executor.shutdown(wait=False, cancel_futures=True)
-            else:
-                logging.error("Row group executor is None")
-
-            if shutdown_executor:
-                shutdown_executor.shutdown(wait=False, cancel_futures=True)
-            else:
-                logging.error("Shutdown executor is None")
+            for executor in (
+                table_executor,
+                *row_group_executors.values(),
+                shutdown_executor,
+            ):
+                if executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == "__main__":
@@ -120,13 +272,11 @@ if __name__ == "__main__":
     settings.initialize()
 
     # TODO: more pydantic?
-    parquet_file = Path(os.environ["PARQUET_FILE"])
-
-    if not parquet_file.exists():
-        raise ValueError(f"Parquet file {parquet_file} does not exist")
+    # a file, a directory or a glob
+    parquet_path = os.environ["PARQUET_FILE"]
 
     if settings.interactive_debug:
         with launch_ipdb_on_exception():
-            main(parquet_file, settings)
+            main(parquet_path, settings)
     else:
-        main(parquet_file, settings)
+        main(parquet_path, settings)
@@ -0,0 +1,64 @@
+"""
+Maintenance for the parquet_import_tracking table. Safe to run while the importer is
+running (for example from cron).
+
+    python -m neynar_parquet_importer.cli.maintenance
+
+- runs of empty incrementals are merged into range rows
+- all but the newest TRACKING_RETENTION_FILES completed incrementals of each table are
+  removed and counted in parquet_import_tracking_summary
+- the table is analyzed so that the startup lookups keep using the latest_* indexes
+"""
+import logging
+import os
+import dotenv
+from ipdb import launch_ipdb_on_exception
+
+from neynar_parquet_importer.db import get_tables, init_db
+from neynar_parquet_importer.main import ALL_TABLES
+from neynar_parquet_importer.settings import Settings
+from neynar_parquet_importer.tracking_maintenance import run_tracking_maintenance
+
+
+def main(settings: Settings):
+    if settings.non_postgres_backend():
+        raise ValueError(
+            "tracking maintenance only works with IMPORT_TRACKING_BACKEND=postgresql",
+        )
+
+    table_names = [t for t in settings.tables.split(",") if t]
+    if not table_names:
+        # the same tables the importer uses when TABLES isn't set
+        table_names = list(
+            ALL_TABLES[
+                (settings.parquet_s3_database, settings.parquet_s3_schema)
+            ].keys(),
+        )
+
+    # this also creates the indexes and the summary table on installs that don't have
+    # them yet
+    db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+
+    tables = get_tables(
+        settings.postgres_schema,
+        db_engine,
+        table_names + ["parquet_import_tracking_summary"],
+    )
+
+    run_tracking_maintenance(db_engine, tables, table_names, settings)
+
+    logging.info("tracking maintenance complete", extra={"tables": table_names})
+
+
+if __name__ == "__main__":
+    dotenv.load_dotenv(os.getenv("ENV_FILE", ".env"))
+
+    settings = Settings()
+
+    settings.initialize()
+
+    if settings.interactive_debug:
+        with launch_ipdb_on_exception():
+            main(settings)
+    else:
+        main(settings)
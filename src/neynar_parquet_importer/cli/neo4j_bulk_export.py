@@ -0,0 +1,103 @@
+"""
+Convert full parquet exports into neo4j-admin import files.
+
+    PARQUET_FILES=profiles.parquet,follows.parquet OUTPUT_DIR=neo4j-import python -m
+    neynar_parquet_importer.cli.neo4j_bulk_export
+    cd neo4j-import && neo4j-admin database import full @import.args
+
+Then start the importer as usual and incrementals continue from each export's
+end_timestamp.
+"""
+from datetime import UTC, datetime
+import logging
+import os
+from pathlib import Path
+import dotenv
+from ipdb import launch_ipdb_on_exception
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from neynar_parquet_importer.database.neo4j_bulk import Neo4jBulkExporter
+from neynar_parquet_importer.db import execute_with_retry, get_tables, init_db
+from neynar_parquet_importer.settings import Settings
+
+
+def record_postgres_tracking(exporter: Neo4jBulkExporter, settings: Settings):
+    """
+    When tracking isn't stored in the graph, the exported files are marked completed
+    in parquet_import_tracking instead
+    """
+    table_names = sorted({row["table_name"] for row in exporter.tracking_rows})
+
+    db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+    parquet_import_tracking = get_tables(settings.postgres_schema, db_engine, [])[
+        "parquet_import_tracking"
+    ]
+
+    for row in exporter.tracking_rows:
+        stmt = pg_insert(parquet_import_tracking).values(
+            table_name=row["table_name"],
+            file_name=row["file_name"],
+            file_type=row["file_type"],
+            file_version=row["file_version"],
+            file_duration_s=row["file_duration_s"],
+            end_timestamp=datetime.fromtimestamp(row["end_timestamp"], UTC),
+            is_empty=row["is_empty"],
+            last_row_group_imported=row["last_row_group"],
+            total_row_groups=row["total_row_groups"],
+            backfill=row["backfill"],
+            completed=True,
+        )
+
+        execute_with_retry(
+            db_engine,
+            stmt.on_conflict_do_update(
+                index_elements=["file_name"],
+                set_={
+                    "completed": True,
+                    "last_row_group_imported": row["last_row_group"],
+                },
+            ),
+        )
+
+
+def main(parquet_files: list[Path], output_dir: Path, settings: Settings):
+    exporter = Neo4jBulkExporter(output_dir, settings)
+
+    # file order doesn't matter. rows for the same node are merged by their updated_at
+    for parquet_file in parquet_files:
+        exporter.export_file(parquet_file)
+
+    args = exporter.finish()
+
+    if not settings.non_postgres_backend():
+        record_postgres_tracking(exporter, settings)
+
+    logging.info(
+        "neo4j-admin import files are ready",
+        extra={
+            "output_dir": str(output_dir),
+            "command": f"neo4j-admin {' '.join(args[:3])} @import.args",
+        },
+    )
+
+
+if __name__ == "__main__":
+    dotenv.load_dotenv(os.getenv("ENV_FILE", ".env"))
+
+    settings = Settings()
+
+    settings.initialize()
+
+    # TODO: more pydantic?
+    parquet_files = [Path(f) for f in os.environ["PARQUET_FILES"].split(",") if f]
+    output_dir = Path(os.environ.get("OUTPUT_DIR", "neo4j-import"))
+
+    for parquet_file in parquet_files:
+        if not parquet_file.exists():
+            raise ValueError(f"Parquet file {parquet_file} does not exist")
+
+    if settings.interactive_debug:
+        with launch_ipdb_on_exception():
+            main(parquet_files, output_dir, settings)
+    else:
+        main(parquet_files, output_dir, settings)
@@ -1,8 +1,17 @@
 from abc import ABC, abstractmethod
+import glob
+import re
 from typing import Any, Dict, List, Optional, Union
 from pathlib import Path
 from dataclasses import dataclass
 
+import pyarrow as pa
+
+# Import for type annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from ..settings import Settings
+
 @dataclass
 class ImportOperation:
     """Represents a single database operation (node creation, relationship, etc.)"""
@@ -12,19 +21,141 @@ class ImportOperation:
     metadata: Optional[Dict[str, Any]] = None  # Additional context for the operation
 
 
+@dataclass
+class ColumnarOperation:
+    """
+    A batch of nodes or relationships stored as parallel columns instead of one
+    ImportOperation per row
+    """
+    operation_type: str  # "create_node" or "create_relationship"
+    entity_type: str     # "User", "FOLLOWS", etc.
+    # property name -> values. every list is the same length
+    columns: Dict[str, List[Any]]
+    metadata: Optional[Dict[str, Any]] = None  # Additional context for the operation
+    
+    def __len__(self) -> int:
+        for values in self.columns.values():
+            return len(values)
+        return 0
+    
+    def slice(self, start: int, end: int) -> 'ColumnarOperation':
+        """A smaller operation with rows [start, end)"""
+        return ColumnarOperation(
+            operation_type=self.operation_type,
+            entity_type=self.entity_type,
+            columns={name: values[start:end] for name, values in self.columns.items()},
+            metadata=self.metadata,
+        )
+    
+    def take(self, indices: List[int]) -> 'ColumnarOperation':
+        """A smaller operation with only the given rows, in the given order"""
+        return ColumnarOperation(
+            operation_type=self.operation_type,
+            entity_type=self.entity_type,
+            columns={
+                name: [values[i] for i in indices]
+                for name, values in self.columns.items()
+            },
+            metadata=self.metadata,
+        )
+    
+    def to_import_operations(self) -> List[ImportOperation]:
+        """
+        Convert back to one ImportOperation per row for backends without
+        columnar support
+        """
+        names = list(self.columns.keys())
+        return [
+            ImportOperation(
+                operation_type=self.operation_type,
+                entity_type=self.entity_type,
+                properties=dict(zip(names, values)),
+                metadata=self.metadata,
+            )
+            for values in zip(*self.columns.values())
+        ]
+
+
+def schema_primary_keys(table_name: str, settings: 'Settings') -> List[str]:
+    """
+    The primary key from the table's postgres migration in schema/. The mirror uses
+    the same keys
+    """
+    pattern = (
+        f"schema/*_{settings.parquet_s3_database}_{settings.parquet_s3_schema}"
+        f"_{table_name}.sql"
+    )
+
+    for filename in sorted(glob.glob(pattern)):
+        with open(filename, "r") as f:
+            migration = f.read()
+
+        # CONSTRAINT fids_pkey PRIMARY KEY (fid)
+        m = re.search(r"PRIMARY KEY\s*\(([^)]+)\)", migration, re.IGNORECASE)
+        if m:
+            return [name.strip().strip('"') for name in m.group(1).split(",")]
+
+        # id uuid NOT NULL PRIMARY KEY,
+        m = re.search(
+            r"^\s*(\w+)\s+[^,\n]*PRIMARY KEY",
+            migration,
+            re.IGNORECASE | re.MULTILINE,
+        )
+        if m:
+            return [m.group(1)]
+
+    raise ValueError(f"No primary key found for {table_name}", pattern)
+
+
 class DatabaseBackend(ABC):
     """Abstract base class for database backends (PostgreSQL, Neo4j, etc.)"""
     
+    # backends that set this get the filtered Arrow batch in import_arrow instead of
+    # transformed operations
+    accepts_arrow = False
+    
     @abstractmethod
     def init_db(self, uri: str, tables: List[str], settings: 'Settings') -> Any:
         """Initialize database connection and apply schema migrations"""
         pass
     
+    def ensure_schema(self, tables: List[str], settings: 'Settings') -> None:
+        """
+        Apply schema for tables that were not passed to init_db. Must be cheap
+        when there is nothing to do
+        """
+        pass
+    
     @abstractmethod
     def import_operations(self, operations: List[ImportOperation]) -> None:
         """Import a batch of database operations with appropriate semantics"""
         pass
+
+    def import_columnar(
+        self,
+        operations: List[ColumnarOperation],
+        table_name: Optional[str] = None,
+    ) -> None:
+        """
+        Import columnar operations. Backends that can bind whole columns as
+        parameters should override this
+
+        table_name is the parquet table the operations came from. Backends can
+        use it for per-table tuning.
+        """
+        self.import_operations(
+            [op for columnar in operations for op in columnar.to_import_operations()],
+        )
     
+    def import_arrow(self, table_name: str, batch: pa.Table) -> None:
+        """
+        Import a whole Arrow batch of one table. Only called when accepts_arrow
+        is set
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support Arrow batches",
+        )
+
     @abstractmethod
     def check_import_progress(self, table_name: str, file_name: str) -> Optional[int]:
         """Check last imported row group for a file"""
@@ -35,6 +166,64 @@ class DatabaseBackend(ABC):
         """Mark files as completed in tracking system"""
         pass
     
+    # Import tracking. Only needed by backends that can replace the postgres
+    # parquet_import_tracking table
+    # (see the IMPORT_TRACKING_BACKEND setting)
+    
+    def start_file_import(
+        self,
+        table_name: str,
+        file_name: str,
+        file_type: str,
+        end_timestamp: int,
+        is_empty: bool,
+        total_row_groups: int,
+        backfill: bool,
+        settings: 'Settings',
+    ) -> Optional[int]:
+        """
+        Create the tracking entry for a file if it doesn't exist. Returns the
+        last imported row group (None if nothing is imported)
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support import tracking",
+        )
+
+    def update_import_progress(
+        self,
+        table_name: str,
+        file_name: str,
+        row_group: int,
+    ) -> None:
+        """
+        Record that a row group is imported. This may be buffered until
+        flush_import_progress
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support import tracking",
+        )
+
+    def flush_import_progress(self) -> None:
+        """Write any buffered progress updates"""
+        pass
+    
+    def get_latest_import(
+        self,
+        table_name: str,
+        file_type: str,
+        backfill: bool,
+        completed_only: bool,
+        settings: 'Settings',
+    ) -> Optional[Dict[str, Any]]:
+        """Get the tracking entry with the newest end_timestamp.
+
+        Returns a dict with file_name, completed, last_row_group_imported, and
+        total_row_groups.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support import tracking",
+        )
+
     @abstractmethod
     def close(self) -> None:
         """Clean up database connections"""
@@ -0,0 +1,351 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import pyarrow as pa
+
+from .base import DatabaseBackend, ImportOperation, schema_primary_keys
+from ..settings import Settings
+
+
+TRACKING_TABLE = "parquet_import_tracking"
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class DuckDBBackend(DatabaseBackend):
+    """
+    A local DuckDB mirror. Arrow batches are merged in one statement each and import
+    tracking is kept in the same file
+    """
+
+    # import_arrow gets the filtered batch directly. no transformer or per-row objects
+    accepts_arrow = True
+
+    def __init__(self):
+        self.conn: Optional[duckdb.DuckDBPyConnection] = None
+        self.settings: Optional[Settings] = None
+        # table name -> primary key columns. tables are created from the first batch
+        # that arrives
+        self.primary_keys: Dict[str, List[str]] = {}
+        self.columns: Dict[str, List[str]] = {}
+        self._table_locks: Dict[str, threading.Lock] = {}
+        self._schema_lock = threading.Lock()
+        self._tracking_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def init_db(self, uri: str, tables: List[str], settings: Settings) -> Any:
+        """Open the database file and create the tracking table
+
+        This should only be called once per process (see DatabaseFactory.get_backend).
+        Every worker uses its own cursor on the shared connection.
+        """
+        if self.conn is not None:
+            self.ensure_schema(tables, settings)
+            return self.conn
+
+        self.settings = settings
+
+        Path(settings.duckdb_path).parent.mkdir(parents=True, exist_ok=True)
+
+        config = {}
+        if settings.duckdb_memory_limit:
+            config["memory_limit"] = settings.duckdb_memory_limit
+
+        self.conn = duckdb.connect(str(settings.duckdb_path), config=config)
+
+        self.conn.execute(
+            f"""
+            CREATE SEQUENCE IF NOT EXISTS {TRACKING_TABLE}_id_seq;
+            CREATE TABLE IF NOT EXISTS {TRACKING_TABLE} (
+                id BIGINT PRIMARY KEY DEFAULT nextval('{TRACKING_TABLE}_id_seq'),
+                table_name VARCHAR NOT NULL,
+                file_name VARCHAR NOT NULL UNIQUE,
+                file_type VARCHAR NOT NULL,
+                file_version VARCHAR NOT NULL,
+                file_duration_s INTEGER NOT NULL,
+                end_timestamp TIMESTAMPTZ NOT NULL,
+                is_empty BOOLEAN NOT NULL,
+                last_row_group_imported INTEGER,
+                total_row_groups INTEGER NOT NULL,
+                backfill BOOLEAN NOT NULL DEFAULT false,
+                completed BOOLEAN NOT NULL DEFAULT false,
+                imported_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp
+            );
+            """,
+        )
+
+        self.ensure_schema(tables, settings)
+
+        return self.conn
+
+    def ensure_schema(self, tables: List[str], settings: Settings) -> None:
+        """
+        Look up the primary keys of tables that haven't been seen yet. The
+        tables themselves are created from their first batch
+        """
+        with self._schema_lock:
+            for table_name in tables:
+                if table_name in self.primary_keys:
+                    continue
+
+                self.primary_keys[table_name] = schema_primary_keys(
+                    table_name,
+                    settings,
+                )
+                self._table_locks[table_name] = threading.Lock()
+
+    def _ensure_table(self, cursor, table_name: str, batch: pa.Table) -> List[str]:
+        """
+        Create the table (or add new columns) to fit the batch. Returns the
+        table's columns
+        """
+        columns = self.columns.get(table_name)
+
+        if columns is None:
+            primary_key = ", ".join(
+                quote(name) for name in self.primary_keys[table_name]
+            )
+
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote(table_name)} "
+                "AS SELECT * FROM batch LIMIT 0",
+            )
+
+            has_primary_key = cursor.execute(
+                "SELECT count(*) FROM duckdb_constraints() "
+                "WHERE table_name = ? AND constraint_type = 'PRIMARY KEY'",
+                [table_name],
+            ).fetchone()[0]
+            if not has_primary_key:
+                cursor.execute(
+                    f"ALTER TABLE {quote(table_name)} ADD PRIMARY KEY ({primary_key})",
+                )
+
+            columns = [
+                row[0]
+                for row in cursor.execute(f"DESCRIBE {quote(table_name)}").fetchall()
+            ]
+
+        new_columns = [name for name in batch.column_names if name not in columns]
+        if new_columns:
+            types = {
+                row[0]: row[1]
+                for row in cursor.execute("DESCRIBE SELECT * FROM batch").fetchall()
+            }
+            for name in new_columns:
+                self.logger.info(
+                    "adding column",
+                    extra={"table": table_name, "column": name},
+                )
+                cursor.execute(
+                    f"ALTER TABLE {quote(table_name)} "
+                    f"ADD COLUMN {quote(name)} {types[name]}",
+                )
+            columns = columns + new_columns
+
+        self.columns[table_name] = columns
+
+        return columns
+
+    def import_arrow(self, table_name: str, batch: pa.Table) -> None:
+        """
+        Merge an Arrow batch into the table. Rows only replace rows with an
+        older (or equal) updated_at
+
+        The batch is scanned in place by DuckDB. It is not copied into python objects.
+        """
+        if batch.num_rows == 0:
+            return
+
+        # primary keys aren't known to the placeholder tables, so the import path can't
+        # dedupe them
+        from ..db import dedupe_primary_keys
+
+        primary_key = self.primary_keys[table_name]
+        batch = dedupe_primary_keys(batch, primary_key)
+
+        # one writer per table. DuckDB aborts concurrent updates of the same rows
+        # instead of waiting
+        with self._table_locks[table_name]:
+            cursor = self.conn.cursor()
+            try:
+                cursor.register("batch", batch)
+
+                self._ensure_table(cursor, table_name, batch)
+
+                names = ", ".join(quote(name) for name in batch.column_names)
+                updates = ", ".join(
+                    f"{quote(name)} = excluded.{quote(name)}"
+                    for name in batch.column_names
+                    if name not in primary_key
+                )
+
+                sql = (
+                    f"INSERT INTO {quote(table_name)} ({names}) "
+                    f"SELECT {names} FROM batch "
+                    f"ON CONFLICT ({', '.join(quote(name) for name in primary_key)}) "
+                )
+                if not updates:
+                    sql += "DO NOTHING"
+                elif "updated_at" in batch.column_names:
+                    sql += (
+                        f"DO UPDATE SET {updates} "
+                        f"WHERE excluded.updated_at >= {quote(table_name)}.updated_at"
+                    )
+                else:
+                    sql += f"DO UPDATE SET {updates}"
+
+                cursor.execute(sql)
+            finally:
+                cursor.close()
+
+    def import_operations(self, operations: List[ImportOperation]) -> None:
+        """
+        Upserts grouped by table. Only used by callers that don't have Arrow
+        batches
+        """
+        rows_by_table: Dict[str, List[Dict[str, Any]]] = {}
+        for op in operations:
+            rows_by_table.setdefault(op.entity_type, []).append(op.properties)
+
+        for table_name, rows in rows_by_table.items():
+            self.import_arrow(table_name, pa.Table.from_pylist(rows))
+
+    def _tracking_execute(self, sql: str, parameters=None):
+        with self._tracking_lock:
+            cursor = self.conn.cursor()
+            try:
+                return cursor.execute(sql, parameters).fetchall()
+            finally:
+                cursor.close()
+
+    def check_import_progress(self, table_name: str, file_name: str) -> Optional[int]:
+        """Check last imported row group for a file"""
+        rows = self._tracking_execute(
+            f"SELECT last_row_group_imported FROM {TRACKING_TABLE} "
+            "WHERE table_name = ? AND file_name = ?",
+            [table_name, file_name],
+        )
+        return rows[0][0] if rows else None
+
+    def start_file_import(
+        self,
+        table_name: str,
+        file_name: str,
+        file_type: str,
+        end_timestamp: int,
+        is_empty: bool,
+        total_row_groups: int,
+        backfill: bool,
+        settings: Settings,
+    ) -> Optional[int]:
+        """
+        Create the tracking row for a file if it doesn't exist. Returns the last
+        imported row group
+        """
+        rows = self._tracking_execute(
+            f"""
+            INSERT INTO {TRACKING_TABLE}
+                (table_name, file_name, file_type, file_version, file_duration_s,
+                 end_timestamp, is_empty, total_row_groups, backfill)
+            VALUES (?, ?, ?, ?, ?, to_timestamp(?), ?, ?, ?)
+            ON CONFLICT (file_name) DO UPDATE
+            SET last_row_group_imported = {TRACKING_TABLE}.last_row_group_imported
+            RETURNING last_row_group_imported
+            """,
+            [
+                table_name,
+                file_name,
+                file_type,
+                settings.npe_version,
+                settings.incremental_duration,
+                end_timestamp,
+                is_empty,
+                total_row_groups,
+                backfill,
+            ],
+        )
+        return rows[0][0] if rows else None
+
+    def update_import_progress(
+        self,
+        table_name: str,
+        file_name: str,
+        row_group: int,
+    ) -> None:
+        """The database is local so this is written right away"""
+        self._tracking_execute(
+            f"UPDATE {TRACKING_TABLE} SET last_row_group_imported = ? "
+            "WHERE file_name = ?",
+            [row_group, file_name],
+        )
+
+    def get_latest_import(
+        self,
+        table_name: str,
+        file_type: str,
+        backfill: bool,
+        completed_only: bool,
+        settings: Settings,
+    ) -> Optional[Dict[str, Any]]:
+        """Get the tracking row with the newest end_timestamp"""
+        sql = f"""
+            SELECT file_name, completed, last_row_group_imported, total_row_groups
+            FROM {TRACKING_TABLE}
+            WHERE table_name = ? AND file_type = ? AND file_version = ?
+            AND file_duration_s = ? AND backfill = ?
+        """
+        if completed_only:
+            sql += " AND completed"
+        sql += " ORDER BY end_timestamp DESC LIMIT 1"
+
+        rows = self._tracking_execute(
+            sql,
+            [
+                table_name,
+                file_type,
+                settings.npe_version,
+                settings.incremental_duration,
+                backfill,
+            ],
+        )
+        if not rows:
+            return None
+
+        file_name, completed, last_row_group_imported, total_row_groups = rows[0]
+        return {
+            "file_name": file_name,
+            "completed": completed,
+            "last_row_group_imported": last_row_group_imported,
+            "total_row_groups": total_row_groups,
+        }
+
+    def mark_completed(self, file_names: List[str], table_name: str) -> None:
+        """Mark files as completed in tracking system"""
+        if not file_names:
+            return
+
+        self._tracking_execute(
+            f"UPDATE {TRACKING_TABLE} SET completed = true "
+            "WHERE table_name = ? AND list_contains(?, file_name)",
+            [table_name, list(file_names)],
+        )
+
+    def close(self) -> None:
+        """Checkpoint and close the database file"""
+        if self.conn is None:
+            return
+
+        try:
+            self.conn.execute("CHECKPOINT")
+            self.conn.close()
+        except Exception as e:
+            self.logger.error(f"Error during DuckDB cleanup: {e}")
+        finally:
+            self.conn = None
+            self.columns.clear()
@@ -1,11 +1,17 @@
-from typing import Type
+import threading
+from typing import Dict, List
 from .base import DatabaseBackend
 from ..transformers.base import DataTransformer
 
 
 class DatabaseFactory:
     """Factory for creating appropriate database backend based on settings"""
-    
+
+    # long-lived instances shared by every row group worker in this process
+    _backends: Dict[str, DatabaseBackend] = {}
+    _transformers: Dict[str, DataTransformer] = {}
+    _lock = threading.Lock()
+
     @staticmethod
     def create_backend(settings) -> DatabaseBackend:
         """Create database backend based on configuration"""
@@ -22,13 +28,27 @@ class DatabaseFactory:
                 raise ImportError(
                     f"Neo4j dependencies not available. Install with: pip install neo4j>=5.15.0"
                 ) from e
+        elif settings.database_backend == "duckdb":
+            try:
+                from .duckdb import DuckDBBackend
+                return DuckDBBackend()
+            except ImportError as e:
+                raise ImportError(
+                    "DuckDB dependencies not available. "
+                    "Install with: uv sync --extra duckdb",
+                ) from e
+        elif settings.database_backend == "parquet":
+            from .parquet_mirror import ParquetMirrorBackend
+            return ParquetMirrorBackend()
         else:
             raise ValueError(f"Unsupported database backend: {settings.database_backend}")
-    
+
     @staticmethod
     def create_transformer(settings) -> DataTransformer:
         """Create appropriate transformer for the backend"""
-        if settings.database_backend == "postgresql":
+        if settings.database_backend in ("postgresql", "duckdb", "parquet"):
+            # duckdb and parquet import the Arrow batches directly. see
+            # DatabaseBackend.import_arrow
             from ..transformers.base import PassthroughTransformer
             return PassthroughTransformer()
         elif settings.database_backend == "neo4j":
@@ -37,3 +57,48 @@ class DatabaseFactory:
             return StreamingGraphTransformer(chunk_size=getattr(settings, 'transform_chunk_size', 100))
         else:
             raise ValueError(f"No transformer for backend: {settings.database_backend}")
+
+    @classmethod
+    def get_backend(cls, settings, tables: List[str]) -> DatabaseBackend:
+        """
+        Get the shared backend for this process. It is created and initialized
+        on first use.
+
+        The schema for `tables` is only applied the first time each table is seen.
+        """
+        with cls._lock:
+            backend = cls._backends.get(settings.database_backend)
+            if backend is None:
+                backend = cls.create_backend(settings)
+                # Neo4j and DuckDB don't use the URI parameter, they use settings
+                backend.init_db(None, tables, settings)
+                cls._backends[settings.database_backend] = backend
+            else:
+                backend.ensure_schema(tables, settings)
+
+            return backend
+
+    @classmethod
+    def get_transformer(cls, settings) -> DataTransformer:
+        """
+        Get the shared transformer for this process. Transformers are stateless
+        so sharing is safe
+        """
+        with cls._lock:
+            transformer = cls._transformers.get(settings.database_backend)
+            if transformer is None:
+                transformer = cls.create_transformer(settings)
+                cls._transformers[settings.database_backend] = transformer
+
+            return transformer
+
+    @classmethod
+    def close_all(cls) -> None:
+        """Close every shared backend. Call this once at shutdown"""
+        with cls._lock:
+            backends = list(cls._backends.values())
+            cls._backends.clear()
+            cls._transformers.clear()
+
+        for backend in backends:
+            backend.close()
@@ -1,20 +1,112 @@
-from typing import Any, List, Optional
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Set, Tuple
 from neo4j import GraphDatabase, Driver
 from neo4j.exceptions import Neo4jError
 from tenacity import retry, stop_after_attempt, wait_exponential_jitter
 import logging
 import gc
+import threading
+import time
 
-from .base import DatabaseBackend, ImportOperation
-from .unified_performance import create_performance_manager
+from .base import ColumnarOperation, DatabaseBackend, ImportOperation
+from .unified_performance import create_performance_manager, get_performance_manager
 from ..settings import Settings
 
 
+def node_primary_key(op: ColumnarOperation) -> str:
+    """The property that identifies a node (and is used by MERGE)"""
+    if op.entity_type == "User":
+        return "fid"
+    elif op.entity_type == "Address":
+        return "address"
+    
+    metadata = op.metadata or {}
+    return metadata.get("primary_key") or (
+        "id" if "id" in op.columns else list(op.columns.keys())[0]
+    )
+
+
+def endpoint_columns(op: ColumnarOperation) -> Tuple[str, str]:
+    """The source and target columns of a relationship operation"""
+    metadata = op.metadata or {}
+    return (
+        f"source_{metadata.get('source_key', 'fid')}",
+        f"target_{metadata.get('target_key', 'fid')}",
+    )
+
+
+class KnownNodeCache:
+    """
+    LRU of node keys that are known to exist. Lets the endpoint pass skip nodes that
+    were already created
+
+    The importer never deletes nodes, so a cached key stays correct unless something
+    else deletes the node.
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def missing(self, node_type: str, key: str, values: List[Any]) -> List[Any]:
+        """Unique, sorted, non-null values that aren't known to exist yet"""
+        unique = {value for value in values if value is not None}
+        
+        if self.max_size > 0:
+            with self._lock:
+                unique = {
+                    value
+                    for value in unique
+                    if (node_type, key, value) not in self._keys
+                }
+
+        return sorted(unique)
+    
+    def add(self, node_type: str, key: str, values: List[Any]) -> None:
+        """
+        Remember that these nodes exist. Only call this after the transaction
+        that created them commits
+        """
+        if self.max_size <= 0:
+            return
+        
+        with self._lock:
+            for value in values:
+                if value is None:
+                    continue
+                cache_key = (node_type, key, value)
+                self._keys[cache_key] = None
+                self._keys.move_to_end(cache_key)
+            
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+
 class Neo4jBackend(DatabaseBackend):
     """Neo4j implementation with native Neo4j progress tracking and performance optimization"""
     
     def __init__(self):
         self.driver: Optional[Driver] = None
+        self.database: Optional[str] = None
+        self.schema_tables: Set[str] = set()
+        self.schema_created = False
+        self._schema_lock = threading.Lock()
+        
+        # buffered ImportTracking progress. (table_name, file_name) -> last row group
+        self._pending_progress = {}
+        self._progress_lock = threading.Lock()
+        self._last_progress_flush = 0.0
+        self.tracking_flush_s = 2.0
+        
+        # relationship import. see import_columnar
+        self.relationship_mode = "match"
+        self.node_cache = KnownNodeCache(0)
+        self._edge_locks: List[threading.Lock] = [threading.Lock()]
         self.schema_manager: Optional['Neo4jSchemaManager'] = None
         self.query_builder: Optional['CypherQueryBuilder'] = None
         self.logger = logging.getLogger(__name__)
@@ -23,18 +115,39 @@ class Neo4jBackend(DatabaseBackend):
         self.unified_performance = create_performance_manager("neo4j")
     
     def init_db(self, uri: str, tables: List[str], settings: Settings) -> Any:
-        """Initialize database connection and apply schema migrations"""
+        """Initialize database connection and apply schema migrations
+        
+        This should only be called once per process (see DatabaseFactory.get_backend).
+        The driver is thread-safe and shared by all the row group workers.
+        """
+        if self.driver is not None:
+            self.ensure_schema(tables, settings)
+            return self.driver
+        
         try:
+            # every Neo4j write in the process shares one adaptive controller
+            self.unified_performance = get_performance_manager("neo4j", settings)
+            
             # Start performance monitoring
             self.unified_performance.start_monitoring()
             
-            # Create Neo4j driver
+            # Create Neo4j driver. The connection pool bounds how many sessions can run
+            # at once
             self.driver = GraphDatabase.driver(
                 settings.neo4j_uri,
                 auth=(settings.neo4j_user, settings.neo4j_password),
-                database=settings.neo4j_database
+                max_connection_pool_size=settings.neo4j_max_connections,
             )
+            self.database = settings.neo4j_database
+            self.tracking_flush_s = settings.neo4j_tracking_flush_s
             
+            self.relationship_mode = settings.neo4j_relationship_mode
+            self.node_cache = KnownNodeCache(settings.neo4j_node_cache_size)
+            self._edge_locks = [
+                threading.Lock()
+                for _ in range(max(1, settings.neo4j_relationship_stripes))
+            ]
+
             # Test connection
             self.driver.verify_connectivity()
             
@@ -42,11 +155,11 @@ class Neo4jBackend(DatabaseBackend):
             from .neo4j_schema import Neo4jSchemaManager
             from .neo4j_queries import CypherQueryBuilder
             
-            self.schema_manager = Neo4jSchemaManager(self.driver)
+            self.schema_manager = Neo4jSchemaManager(self.driver, self.database)
             self.query_builder = CypherQueryBuilder()
             
             # Apply schema migrations for requested tables
-            self.schema_manager.create_schema(tables, settings)
+            self.ensure_schema(tables, settings)
             
             return self.driver
             
@@ -57,6 +170,17 @@ class Neo4jBackend(DatabaseBackend):
             self.logger.error(f"Unexpected error initializing Neo4j: {e}")
             raise
     
+    def ensure_schema(self, tables: List[str], settings: Settings) -> None:
+        """Create constraints and indexes for tables that haven't been seen yet"""
+        with self._schema_lock:
+            new_tables = [t for t in tables if t not in self.schema_tables]
+            if not new_tables and self.schema_created:
+                return
+            
+            self.schema_manager.create_schema(new_tables, settings)
+            self.schema_tables.update(new_tables)
+            self.schema_created = True
+    
     @retry(
         stop=stop_after_attempt(5),
         wait=wait_exponential_jitter(initial=1, max=60),
@@ -81,7 +205,7 @@ class Neo4jBackend(DatabaseBackend):
                 node_operations = [op for op in operations if op.operation_type == "create_node"]
                 relationship_operations = [op for op in operations if op.operation_type == "create_relationship"]
                 
-                with self.driver.session() as session:
+                with self.driver.session(database=self.database) as session:
                     with session.begin_transaction() as tx:
                         # Process node operations first
                         if node_operations:
@@ -106,6 +230,261 @@ class Neo4jBackend(DatabaseBackend):
             self.logger.error(f"Unexpected error during import: {e}")
             raise
     
+    @retry(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential_jitter(initial=1, max=60),
+        reraise=True,
+    )
+    def import_columnar(
+        self,
+        operations: List[ColumnarOperation],
+        table_name: Optional[str] = None,
+    ) -> None:
+        """
+        Import columnar operations. Each column is bound as one list parameter
+        for UNWIND
+
+        In "match" mode, relationships are written in up to three steps:
+        1. nodes and any relationship endpoints that aren't in the node cache
+           are MERGEd in one transaction
+        2. edges are sorted by (source, target) and partitioned by target into stripes
+        3. each stripe is written in its own transaction with MATCH for both
+           endpoints, holding that stripe's lock
+
+        Only one worker at a time writes edges to any target node and every
+        transaction locks sources in order.
+        This is what keeps concurrent row groups from deadlocking on popular targets.
+        Everything is a MERGE, so a retry after a partial import is safe.
+
+        Chunks are sized by the adaptive controller for table_name and their
+        latency is fed back to it.
+        """
+        if not operations:
+            return
+        
+        if not self.driver or not self.query_builder:
+            raise RuntimeError("Neo4j backend not initialized")
+        
+        control_key = table_name or "*"
+        start_time = time.time()
+        
+        try:
+            with self.unified_performance.batch_timer():
+                # Check memory pressure before processing
+                memory_check = self.unified_performance.check_memory_pressure()
+                if memory_check['should_pause']:
+                    gc.collect()
+                
+                batch_size = self.unified_performance.batch_size(control_key)
+                num_rows = 0
+                num_chunks = 0
+
+                node_operations = [
+                    op for op in operations if op.operation_type == "create_node"
+                ]
+                relationship_operations = [
+                    op for op in operations if op.operation_type != "create_node"
+                ]
+
+                if self.relationship_mode == "match":
+                    endpoints = self._missing_endpoints(relationship_operations)
+                else:
+                    endpoints = {}
+                
+                with self.driver.session(database=self.database) as session:
+                    # Process node operations first so relationships can find them
+                    if node_operations or endpoints:
+                        with session.begin_transaction() as tx:
+                            for op in node_operations:
+                                query = self._build_columnar_query(op)
+                                
+                                for start in range(0, len(op), batch_size):
+                                    tx.run(
+                                        query,
+                                        op.slice(start, start + batch_size).columns,
+                                    )
+                                    num_chunks += 1
+                                
+                                num_rows += len(op)
+                            
+                            for (node_type, key), keys in endpoints.items():
+                                query = self.query_builder.build_endpoint_merge_query(
+                                    node_type,
+                                    key,
+                                )
+
+                                for start in range(0, len(keys), batch_size):
+                                    tx.run(query, keys=keys[start:start + batch_size])
+                                    num_chunks += 1
+                            
+                            tx.commit()
+                        
+                        for op in node_operations:
+                            primary_key = node_primary_key(op)
+                            self.node_cache.add(
+                                op.entity_type,
+                                primary_key,
+                                op.columns.get(primary_key, []),
+                            )
+                        for (node_type, key), keys in endpoints.items():
+                            self.node_cache.add(node_type, key, keys)
+                    
+                    for op in relationship_operations:
+                        query = self._build_columnar_query(op)
+                        
+                        if self.relationship_mode == "match":
+                            partitions = [
+                                (self._edge_locks[stripe], stripe_op)
+                                for stripe, stripe_op in self._partition_relationships(
+                                    op,
+                                )
+                            ]
+                        else:
+                            partitions = [(nullcontext(), op)]
+                        
+                        for lock, partition in partitions:
+                            with lock:
+                                with session.begin_transaction() as tx:
+                                    for start in range(0, len(partition), batch_size):
+                                        tx.run(
+                                            query,
+                                            partition.slice(
+                                                start,
+                                                start + batch_size,
+                                            ).columns,
+                                        )
+                                        num_chunks += 1
+                                    
+                                    tx.commit()
+                        
+                        num_rows += len(op)
+                
+                self.unified_performance.record_operations(num_rows)
+                
+                # the controller's SLO is per write. use the average chunk
+                self.unified_performance.record_batch(
+                    control_key,
+                    (time.time() - start_time) / max(1, num_chunks),
+                )
+
+        except Neo4jError as e:
+            self.unified_performance.record_error()
+            self.unified_performance.record_batch(
+                control_key,
+                time.time() - start_time,
+                error=True,
+            )
+            self.logger.error(f"Neo4j error during columnar import: {e}")
+            raise
+        except Exception as e:
+            self.unified_performance.record_error()
+            self.unified_performance.record_batch(
+                control_key,
+                time.time() - start_time,
+                error=True,
+            )
+            self.logger.error(f"Unexpected error during columnar import: {e}")
+            raise
+
+    def _missing_endpoints(
+        self,
+        operations: List[ColumnarOperation],
+    ) -> Dict[Tuple[str, str], List[Any]]:
+        """
+        (node type, key) -> sorted keys of relationship endpoints that might not
+        exist yet
+        """
+        values_by_node = {}
+        for op in operations:
+            metadata = op.metadata or {}
+            source_column, target_column = endpoint_columns(op)
+
+            source = (
+                metadata.get("source_node_type", "User"),
+                metadata.get("source_key", "fid"),
+            )
+            target = (
+                metadata.get("target_node_type", "User"),
+                metadata.get("target_key", "fid"),
+            )
+
+            values_by_node.setdefault(source, []).extend(
+                op.columns.get(source_column, []),
+            )
+            values_by_node.setdefault(target, []).extend(
+                op.columns.get(target_column, []),
+            )
+
+        endpoints = {}
+        for (node_type, key), values in values_by_node.items():
+            missing = self.node_cache.missing(node_type, key, values)
+            if missing:
+                endpoints[(node_type, key)] = missing
+        
+        return endpoints
+
+    def _partition_relationships(
+        self,
+        op: ColumnarOperation,
+    ) -> List[Tuple[int, ColumnarOperation]]:
+        """Sort edges by (source, target) and split them into stripes by target
+        
+        Edges with a null endpoint are dropped. MATCH would skip them anyway.
+        """
+        source_column, target_column = endpoint_columns(op)
+        sources = op.columns[source_column]
+        targets = op.columns[target_column]
+        num_stripes = len(self._edge_locks)
+        
+        order = sorted(
+            (
+                i
+                for i in range(len(op))
+                if sources[i] is not None and targets[i] is not None
+            ),
+            key=lambda i: (sources[i], targets[i]),
+        )
+        
+        indices_by_stripe = {}
+        for i in order:
+            indices_by_stripe.setdefault(hash(targets[i]) % num_stripes, []).append(i)
+
+        return [
+            (stripe, op.take(indices))
+            for stripe, indices in sorted(indices_by_stripe.items())
+        ]
+
+    def _build_columnar_query(self, op: ColumnarOperation) -> str:
+        column_names = list(op.columns.keys())
+        metadata = op.metadata or {}
+        
+        if op.operation_type == "create_node":
+            return self.query_builder.build_columnar_node_merge_query(
+                op.entity_type,
+                column_names,
+                node_primary_key(op),
+            )
+        elif op.operation_type == "create_relationship":
+            source_column, target_column = endpoint_columns(op)
+            
+            if self.relationship_mode == "match":
+                build_query = self.query_builder.build_columnar_relationship_match_query
+            else:
+                build_query = self.query_builder.build_columnar_relationship_merge_query
+            
+            return build_query(
+                op.entity_type,
+                column_names,
+                metadata.get('source_node_type', 'User'),
+                metadata.get('target_node_type', 'User'),
+                metadata.get('source_key', 'fid'),
+                metadata.get('target_key', 'fid'),
+                source_column,
+                target_column,
+            )
+        else:
+            raise ValueError(f"Unsupported columnar operation: {op.operation_type}")
+    
     def _process_node_operations_optimized(self, tx, operations: List[ImportOperation]) -> None:
         """Process node creation operations with performance optimization"""
         import time
@@ -175,7 +554,7 @@ class Neo4jBackend(DatabaseBackend):
             return None
         
         try:
-            with self.driver.session() as session:
+            with self.driver.session(database=self.database) as session:
                 # Check if import tracking node exists
                 query = """
                 MATCH (t:ImportTracking {table_name: $table_name, file_name: $file_name})
@@ -189,13 +568,111 @@ class Neo4jBackend(DatabaseBackend):
             self.logger.error(f"Error checking import progress: {e}")
             return None
     
+    def start_file_import(
+        self,
+        table_name: str,
+        file_name: str,
+        file_type: str,
+        end_timestamp: int,
+        is_empty: bool,
+        total_row_groups: int,
+        backfill: bool,
+        settings: Settings,
+    ) -> Optional[int]:
+        """
+        Create the ImportTracking node for a file if it doesn't exist. Returns
+        the last imported row group
+        """
+        # a resumed file might still have progress sitting in the buffer
+        self.flush_import_progress()
+        
+        with self.driver.session(database=self.database) as session:
+            record = session.run(
+                self.query_builder.build_start_import_query(),
+                table_name=table_name,
+                file_name=file_name,
+                file_type=file_type,
+                file_version=settings.npe_version,
+                file_duration_s=settings.incremental_duration,
+                end_timestamp=end_timestamp,
+                is_empty=is_empty,
+                total_row_groups=total_row_groups,
+                backfill=backfill,
+            ).single()
+        
+        return record['last_row_group'] if record else None
+
+    def update_import_progress(
+        self,
+        table_name: str,
+        file_name: str,
+        row_group: int,
+    ) -> None:
+        """
+        Buffer a progress update. They are written together every
+        neo4j_tracking_flush_s seconds
+        
+        Losing buffered progress is safe. The row groups are imported again with MERGE.
+        """
+        with self._progress_lock:
+            self._pending_progress[(table_name, file_name)] = row_group
+            due = time.time() - self._last_progress_flush >= self.tracking_flush_s
+        
+        if due:
+            self.flush_import_progress()
+    
+    def flush_import_progress(self) -> None:
+        """Write all buffered progress updates in one query"""
+        with self._progress_lock:
+            pending = self._pending_progress
+            self._pending_progress = {}
+            self._last_progress_flush = time.time()
+        
+        if not pending or not self.driver:
+            return
+        
+        progress = [
+            {'table_name': table_name, 'file_name': file_name, 'row_group': row_group}
+            for (table_name, file_name), row_group in pending.items()
+        ]
+        
+        with self.driver.session(database=self.database) as session:
+            session.run(
+                self.query_builder.build_import_progress_query(),
+                progress=progress,
+            ).consume()
+
+    def get_latest_import(
+        self,
+        table_name: str,
+        file_type: str,
+        backfill: bool,
+        completed_only: bool,
+        settings: Settings,
+    ) -> Optional[dict]:
+        """Get the newest ImportTracking node of a type for a table"""
+        with self.driver.session(database=self.database) as session:
+            record = session.run(
+                self.query_builder.build_latest_import_query(completed_only),
+                table_name=table_name,
+                file_type=file_type,
+                file_version=settings.npe_version,
+                file_duration_s=settings.incremental_duration,
+                backfill=backfill,
+            ).single()
+        
+        return record.data() if record else None
+    
     def mark_completed(self, file_names: List[str], table_name: str) -> None:
         """Mark files as completed in tracking system"""
         if not self.driver or not file_names:
             return
         
+        # completed files should never be missing their last row group
+        self.flush_import_progress()
+        
         try:
-            with self.driver.session() as session:
+            with self.driver.session(database=self.database) as session:
                 query = """
                 UNWIND $file_names as file_name
                 MERGE (t:ImportTracking {table_name: $table_name, file_name: file_name})
@@ -219,9 +696,14 @@ class Neo4jBackend(DatabaseBackend):
             # Stop unified performance monitoring
             self.unified_performance.stop_monitoring()
             
+            # don't lose any progress
+            self.flush_import_progress()
+            
             if self.driver:
                 self.driver.close()
                 self.driver = None
+                self.schema_tables.clear()
+                self.schema_created = False
                 
         except Exception as e:
             self.logger.error(f"Error during Neo4j cleanup: {e}")
@@ -0,0 +1,478 @@
+"""
+Offline initial load for Neo4j.
+
+Loading a full export through `UNWIND ... MERGE` transactions is far too slow for big
+tables like follows.
+Instead, full exports are converted into CSV files for `neo4j-admin database import
+full`.
+Row groups are streamed through the same graph transformers that the online import uses.
+
+neo4j-admin can't MERGE, so every node must be written exactly once:
+- nodes are staged on disk in sqlite and written when the export finishes. Rows for the
+  same key are merged like `SET n += props`, in updated_at order. The newest value of
+  each property wins
+- relationship endpoints that never appear as a node of their own get a stub node with
+  only their key
+
+An ImportTracking node is written for every file so that incremental imports continue
+from the export's end_timestamp.
+"""
+import csv
+import json
+import logging
+import os
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .base import ColumnarOperation
+from .neo4j import endpoint_columns, node_primary_key
+from ..s3 import parse_parquet_filename
+from ..settings import Settings
+from ..transformers.base import GraphTransformer
+
+
+# neo4j-admin types. bool has to be checked before int
+_CSV_TYPES = [
+    (bool, "boolean"),
+    (int, "long"),
+    (float, "double"),
+    (Decimal, "double"),
+    (datetime, "datetime"),
+    (date, "date"),
+]
+
+
+def csv_type(value: Any) -> str:
+    """The neo4j-admin header type for a python value"""
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            if item is not None:
+                return csv_type(item) + "[]"
+        return "string[]"
+
+    for python_type, neo4j_type in _CSV_TYPES:
+        if isinstance(value, python_type):
+            return neo4j_type
+
+    return "string"
+
+
+def arrow_csv_type(arrow_type: pa.DataType) -> str:
+    """
+    The neo4j-admin header type for a parquet column. Used when a column had no
+    values to look at
+    """
+    if pa.types.is_boolean(arrow_type):
+        return "boolean"
+    if pa.types.is_integer(arrow_type):
+        return "long"
+    if pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+        return "double"
+    if pa.types.is_timestamp(arrow_type):
+        return "datetime"
+    if pa.types.is_date(arrow_type):
+        return "date"
+    return "string"
+
+
+def csv_value(value: Any) -> Any:
+    """
+    Format a python value the way neo4j-admin reads it. None stays None so that the
+    field is left empty (null)
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return ";".join("" if item is None else str(csv_value(item)) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def observe_types(
+    property_types: Dict[str, str],
+    columns: Dict[str, List[Any]],
+    schema: Optional[pa.Schema],
+) -> None:
+    """Set the header type of columns that don't have one yet from their first value"""
+    for name, column_values in columns.items():
+        if name in property_types:
+            continue
+
+        for value in column_values:
+            if value is not None:
+                property_types[name] = csv_type(value)
+                break
+        else:
+            # every value was null. the parquet column (if there is one with this name)
+            # still knows the type
+            if schema is not None and name in schema.names:
+                property_types[name] = arrow_csv_type(schema.field(name).type)
+
+
+class _CsvOutput:
+    """
+    One data file. The header goes in a separate file because column types are only
+    known once a value is seen
+    """
+
+    def __init__(self, path: Path, id_columns: List[str], property_names: List[str]):
+        self.path = path
+        self.id_columns = id_columns
+        self.property_names = property_names
+        self.property_types: Dict[str, str] = {}
+        self.num_rows = 0
+
+        self.file = open(path, "w", newline="")
+        # unquoted empty fields are null. quoted empty fields are empty strings
+        self.writer = csv.writer(self.file, quoting=csv.QUOTE_STRINGS)
+
+    @property
+    def header_path(self) -> Path:
+        return self.path.with_name(self.path.stem + ".header.csv")
+
+    def write(
+        self,
+        ids: List[List[Any]],
+        columns: Dict[str, List[Any]],
+        indices,
+        schema: Optional[pa.Schema] = None,
+    ) -> None:
+        values = [columns[name] for name in self.property_names]
+
+        observe_types(self.property_types, columns, schema)
+
+        for i in indices:
+            self.writer.writerow(
+                [csv_value(id_values[i]) for id_values in ids]
+                + [csv_value(column_values[i]) for column_values in values],
+            )
+            self.num_rows += 1
+
+    def write_formatted(self, row: List[Any]) -> None:
+        """A row of values that already went through csv_value"""
+        self.writer.writerow(row)
+        self.num_rows += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+        with open(self.header_path, "w", newline="") as f:
+            csv.writer(f).writerow(
+                self.id_columns
+                + [
+                    f"{name}:{self.property_types.get(name, 'string')}"
+                    for name in self.property_names
+                ],
+            )
+
+
+class Neo4jBulkExporter:
+    """Convert full parquet exports into neo4j-admin import files"""
+
+    def __init__(self, output_dir: Path, settings: Settings):
+        self.output_dir = Path(output_dir)
+        self.settings = settings
+        self.transformer = GraphTransformer()
+        self.logger = logging.getLogger(__name__)
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        # node keys live on disk. there are far too many follows endpoints to keep in
+        # memory
+        self.keys_path = self.output_dir / "keys.sqlite"
+        self.keys_db = sqlite3.connect(self.keys_path)
+        self.keys_db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE IF NOT EXISTS nodes (
+                label TEXT, key, updated_at TEXT, props TEXT, PRIMARY KEY (label, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS endpoints (
+                label TEXT, key, PRIMARY KEY (label, key)
+            ) WITHOUT ROWID;
+        """)
+
+        # (kind, entity type, columns) -> output
+        self.outputs: Dict[Tuple[str, str, Tuple[str, ...]], _CsvOutput] = {}
+        # label -> key property of its stub nodes
+        self.endpoint_keys: Dict[str, str] = {}
+        self.tracking_rows: List[dict] = []
+        # label -> {property name: header type}. every property that any file wrote for
+        # the label, in the order they were seen
+        self.node_properties: Dict[str, Dict[str, Optional[str]]] = {}
+        self.node_types: Dict[str, Dict[str, str]] = {}
+        self.num_node_rows = 0
+        # schema of the file that is being exported
+        self.schema: Optional[pa.Schema] = None
+
+    def export_file(self, parquet_file: Path) -> None:
+        """Stream every row group of a full export through the graph transformers"""
+        parsed_filename = parse_parquet_filename(parquet_file)
+        table_name = parsed_filename["table_name"]
+
+        parquet = pq.ParquetFile(parquet_file)
+        self.schema = parquet.schema_arrow
+
+        for row_group in range(parquet.num_row_groups):
+            batch = parquet.read_row_group(row_group)
+
+            for op in self.transformer.transform_batch(table_name, batch):
+                self.write_operation(op)
+
+        self.logger.info(
+            f"Exported {parquet_file} ({parquet.num_row_groups} row groups)",
+        )
+
+        self.tracking_rows.append({
+            "table_name": table_name,
+            "file_name": str(parquet_file),
+            "file_type": "full",
+            "file_version": self.settings.npe_version,
+            "file_duration_s": self.settings.incremental_duration,
+            "end_timestamp": parsed_filename["end_timestamp"],
+            "is_empty": False,
+            "total_row_groups": parquet.num_row_groups,
+            "last_row_group": parquet.num_row_groups - 1,
+            "backfill": False,
+            "completed": True,
+        })
+
+    def write_operation(self, op: ColumnarOperation) -> None:
+        if not len(op):
+            return
+
+        if op.operation_type == "create_node":
+            self._write_nodes(op)
+        elif op.operation_type == "create_relationship":
+            self._write_relationships(op)
+        else:
+            raise ValueError(f"Unsupported columnar operation: {op.operation_type}")
+
+    def _output(
+        self,
+        kind: str,
+        entity_type: str,
+        id_columns: List[str],
+        property_names: List[str],
+    ) -> _CsvOutput:
+        output_key = (kind, entity_type, tuple(property_names))
+        output = self.outputs.get(output_key)
+        if output is None:
+            num_files = sum(1 for k in self.outputs if k[:2] == (kind, entity_type))
+            path = self.output_dir / f"{kind}-{entity_type}-{num_files}.csv"
+            output = _CsvOutput(path, id_columns, property_names)
+            self.outputs[output_key] = output
+        return output
+
+    def _write_nodes(self, op: ColumnarOperation) -> None:
+        """
+        Stage the rows. They are merged with earlier rows for the same key and
+        written in finish
+        """
+        primary_key = node_primary_key(op)
+        keys = op.columns[primary_key]
+
+        properties = self.node_properties.setdefault(op.entity_type, {})
+        for name in op.columns:
+            properties.setdefault(name, None)
+        observe_types(
+            self.node_types.setdefault(op.entity_type, {}),
+            op.columns,
+            self.schema,
+        )
+
+        names = list(op.columns.keys())
+        values = [op.columns[name] for name in names]
+        updated_at = op.columns.get("updated_at")
+
+        rows = []
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            rows.append(
+                (
+                    op.entity_type,
+                    key,
+                    # isoformat strings sort like the datetimes. rows without one lose
+                    # to rows with one
+                    ""
+                    if updated_at is None or updated_at[i] is None
+                    else csv_value(updated_at[i]),
+                    json.dumps(
+                        {
+                            name: csv_value(column_values[i])
+                            for name, column_values in zip(names, values)
+                        },
+                    ),
+                ),
+            )
+
+        self.num_node_rows += len(rows)
+
+        # like SET n += props in updated_at order. ties go to the row that was exported
+        # last
+        # json_patch drops properties that are null in the newer row, the same as
+        # setting them to null in neo4j
+        self.keys_db.executemany(
+            """
+            INSERT INTO nodes (label, key, updated_at, props) VALUES (?, ?, ?, ?)
+            ON CONFLICT (label, key) DO UPDATE SET
+                props = CASE
+                    WHEN excluded.updated_at >= nodes.updated_at
+                    THEN json_patch(nodes.props, excluded.props)
+                    ELSE json_patch(excluded.props, nodes.props)
+                END,
+                updated_at = max(nodes.updated_at, excluded.updated_at)
+            """,
+            rows,
+        )
+
+    def _write_staged_nodes(self) -> int:
+        """
+        Write the merged nodes. One file per label with every property any file
+        had. Returns how many nodes were written
+        """
+        num_nodes = 0
+
+        for label, properties in self.node_properties.items():
+            names = list(properties)
+
+            output = self._output("nodes", label, [f":ID({label})"], names)
+            output.property_types.update(self.node_types[label])
+
+            cursor = self.keys_db.execute(
+                "SELECT key, props FROM nodes WHERE label = ? ORDER BY key",
+                (label,),
+            )
+            for key, props in cursor:
+                props = json.loads(props)
+                output.write_formatted(
+                    [csv_value(key)] + [props.get(name) for name in names],
+                )
+
+            num_nodes += output.num_rows
+
+        return num_nodes
+
+    def _write_relationships(self, op: ColumnarOperation) -> None:
+        metadata = op.metadata or {}
+        source_column, target_column = endpoint_columns(op)
+        source_type = metadata.get('source_node_type', 'User')
+        target_type = metadata.get('target_node_type', 'User')
+
+        sources = op.columns[source_column]
+        targets = op.columns[target_column]
+
+        # remember every endpoint so that stub nodes can be written for the ones that
+        # never show up as nodes
+        for node_type, key, values in (
+            (source_type, metadata.get('source_key', 'fid'), sources),
+            (target_type, metadata.get('target_key', 'fid'), targets),
+        ):
+            self.endpoint_keys[node_type] = key
+            self.keys_db.executemany(
+                "INSERT OR IGNORE INTO endpoints VALUES (?, ?)",
+                ((node_type, value) for value in values if value is not None),
+            )
+
+        property_names = [
+            name for name in op.columns if name not in (source_column, target_column)
+        ]
+        output = self._output(
+            "relationships",
+            op.entity_type,
+            [f":START_ID({source_type})", f":END_ID({target_type})"],
+            property_names,
+        )
+        output.write(
+            [sources, targets],
+            op.columns,
+            [
+                i
+                for i in range(len(op))
+                if sources[i] is not None and targets[i] is not None
+            ],
+            self.schema,
+        )
+
+    def _write_stub_nodes(self) -> None:
+        for label, key in self.endpoint_keys.items():
+            stub_keys = [
+                stub_key
+                for (stub_key,) in self.keys_db.execute(
+                    "SELECT key FROM endpoints WHERE label = ? AND NOT EXISTS "
+                    "(SELECT 1 FROM nodes WHERE nodes.label = endpoints.label "
+                    "AND nodes.key = endpoints.key) "
+                    "ORDER BY key",
+                    (label,),
+                )
+            ]
+            if not stub_keys:
+                continue
+
+            output = self._output("nodes", label, [f":ID({label})"], [key])
+            output.write([stub_keys], {key: stub_keys}, range(len(stub_keys)))
+
+    def _write_tracking(self) -> None:
+        if not self.tracking_rows:
+            return
+
+        output = self._output(
+            "nodes",
+            "ImportTracking",
+            [":ID(ImportTracking)"],
+            list(self.tracking_rows[0].keys()),
+        )
+        columns = {
+            name: [row[name] for row in self.tracking_rows]
+            for name in output.property_names
+        }
+        output.write([columns["file_name"]], columns, range(len(self.tracking_rows)))
+
+    def finish(self) -> List[str]:
+        """
+        Write the nodes, stub nodes and headers. Returns the neo4j-admin
+        arguments (relative to output_dir)
+        """
+        num_nodes = self._write_staged_nodes()
+        self._write_stub_nodes()
+        self._write_tracking()
+
+        args = [
+            "database",
+            "import",
+            "full",
+            "--overwrite-destination",
+            "--multiline-fields=true",
+        ]
+        for (kind, entity_type, _), output in self.outputs.items():
+            output.close()
+            args.append(f"--{kind}={entity_type}={output.header_path.name},{output.path.name}")
+        args.append(self.settings.neo4j_database)
+
+        with open(self.output_dir / "import.args", "w") as f:
+            f.write("\n".join(args[3:]) + "\n")
+
+        self.keys_db.close()
+        os.remove(self.keys_path)
+
+        if self.num_node_rows > num_nodes:
+            self.logger.info(
+                f"Merged {self.num_node_rows - num_nodes} duplicate node rows. "
+                "The newest value of each property was kept",
+            )
+
+        return args
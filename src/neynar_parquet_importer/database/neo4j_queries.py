@@ -96,12 +96,160 @@ class CypherQueryBuilder:
             query += f"SET {set_clause}"
         
         return query.strip()
+
+    def build_columnar_node_merge_query(
+        self,
+        entity_type: str,
+        column_names: List[str],
+        primary_key: str,
+    ) -> str:
+        """
+        Build a MERGE query for nodes whose properties are passed as parallel
+        lists (one parameter per column)
+        """
+        set_clause = ", ".join(
+            f"n.{name} = ${name}[i]" for name in column_names if name != primary_key
+        )
+        
+        query = f"""
+        UNWIND range(0, size(${primary_key}) - 1) AS i
+        MERGE (n:{entity_type} {{{primary_key}: ${primary_key}[i]}})
+        """
+        
+        if set_clause:
+            query += f"SET {set_clause}"
+        
+        return query.strip()
+    
+    def build_columnar_relationship_merge_query(
+        self,
+        relationship_type: str,
+        column_names: List[str],
+        source_node_type: str,
+        target_node_type: str,
+        source_key: str,
+        target_key: str,
+        source_column: str,
+        target_column: str,
+    ) -> str:
+        """
+        Build a MERGE query for relationships whose properties are passed as
+        parallel lists
+        """
+        set_clause = ", ".join(
+            f"r.{name} = ${name}[i]"
+            for name in column_names
+            if name not in (source_column, target_column)
+        )
+        
+        query = f"""
+        UNWIND range(0, size(${source_column}) - 1) AS i
+        MERGE (source:{source_node_type} {{{source_key}: ${source_column}[i]}})
+        MERGE (target:{target_node_type} {{{target_key}: ${target_column}[i]}})
+        MERGE (source)-[r:{relationship_type}]->(target)
+        """
+        
+        if set_clause:
+            query += f"SET {set_clause}"
+        
+        return query.strip()
+    
+    def build_endpoint_merge_query(self, node_type: str, key: str) -> str:
+        """
+        Build a MERGE query that only makes sure nodes exist. Expects $keys to
+        be unique and sorted
+        """
+        return f"""
+        UNWIND $keys AS key
+        MERGE (n:{node_type} {{{key}: key}})
+        """.strip()
+    
+    def build_columnar_relationship_match_query(
+        self,
+        relationship_type: str,
+        column_names: List[str],
+        source_node_type: str,
+        target_node_type: str,
+        source_key: str,
+        target_key: str,
+        source_column: str,
+        target_column: str,
+    ) -> str:
+        """Build a MERGE query for relationships between nodes that already exist
+
+        MATCH only needs a read of the index. The endpoints must be created
+        first (see build_endpoint_merge_query).
+        """
+        set_clause = ", ".join(
+            f"r.{name} = ${name}[i]"
+            for name in column_names
+            if name not in (source_column, target_column)
+        )
+        
+        query = f"""
+        UNWIND range(0, size(${source_column}) - 1) AS i
+        MATCH (source:{source_node_type} {{{source_key}: ${source_column}[i]}})
+        MATCH (target:{target_node_type} {{{target_key}: ${target_column}[i]}})
+        MERGE (source)-[r:{relationship_type}]->(target)
+        """
+        
+        if set_clause:
+            query += f"SET {set_clause}"
+        
+        return query.strip()
     
-    def build_import_progress_query(self, table_name: str, file_name: str, row_group: int) -> str:
-        """Build query to update import progress tracking"""
+    def build_import_progress_query(self) -> str:
+        """Build query to update import progress tracking for many files at once
+        
+        Expects $progress to be a list of {table_name, file_name, row_group}.
+        Row groups are imported in order, so progress never goes backwards.
+        """
+        return """
+        UNWIND $progress AS p
+        MERGE (t:ImportTracking {table_name: p.table_name, file_name: p.file_name})
+        SET t.last_row_group = CASE
+                WHEN t.last_row_group IS NULL OR t.last_row_group < p.row_group
+                THEN p.row_group
+                ELSE t.last_row_group
+            END,
+            t.updated_at = datetime()
+        """
+    
+    def build_start_import_query(self) -> str:
+        """Build query to create the tracking node for a file and return its progress"""
         return """
         MERGE (t:ImportTracking {table_name: $table_name, file_name: $file_name})
-        SET t.last_row_group = $row_group, t.updated_at = datetime()
+        ON CREATE SET
+            t.file_type = $file_type,
+            t.file_version = $file_version,
+            t.file_duration_s = $file_duration_s,
+            t.end_timestamp = $end_timestamp,
+            t.is_empty = $is_empty,
+            t.total_row_groups = $total_row_groups,
+            t.backfill = $backfill,
+            t.completed = false,
+            t.created_at = datetime()
+        RETURN t.last_row_group AS last_row_group
+        """
+    
+    def build_latest_import_query(self, completed_only: bool) -> str:
+        """Build query to find the newest tracked file of a type"""
+        completed_clause = "AND t.completed = true" if completed_only else ""
+        
+        return f"""
+        MATCH (t:ImportTracking)
+        WHERE t.table_name = $table_name
+          AND t.file_type = $file_type
+          AND t.file_version = $file_version
+          AND t.file_duration_s = $file_duration_s
+          AND t.backfill = $backfill
+          {completed_clause}
+        RETURN t.file_name AS file_name,
+            coalesce(t.completed, false) AS completed,
+            t.last_row_group AS last_row_group_imported,
+            t.total_row_groups AS total_row_groups
+        ORDER BY t.end_timestamp DESC
+        LIMIT 1
         """
     
     def build_count_query(self, entity_type: str) -> str:
@@ -1,4 +1,4 @@
-from typing import List, Set
+from typing import List, Optional, Set
 from neo4j import Driver
 from neo4j.exceptions import Neo4jError
 import logging
@@ -9,8 +9,9 @@ from ..settings import Settings
 class Neo4jSchemaManager:
     """Manages Neo4j schema creation and migration"""
     
-    def __init__(self, driver: Driver):
+    def __init__(self, driver: Driver, database: Optional[str] = None):
         self.driver = driver
+        self.database = database
         self.logger = logging.getLogger(__name__)
     
     def create_schema(self, tables: List[str], settings: Settings):
@@ -19,7 +20,7 @@ class Neo4jSchemaManager:
             table_set = set(tables)
             self.logger.info(f"Creating Neo4j schema for tables: {tables}")
             
-            with self.driver.session() as session:
+            with self.driver.session(database=self.database) as session:
                 # Core constraints (always needed for import tracking)
                 self._create_import_tracking_constraints(session)
                 
@@ -62,7 +63,11 @@ class Neo4jSchemaManager:
     def _create_import_tracking_constraints(self, session):
         """Create constraints for import tracking"""
         constraints = [
-            "CREATE CONSTRAINT import_tracking_unique IF NOT EXISTS FOR (t:ImportTracking) REQUIRE (t.table_name, t.file_name) IS UNIQUE"
+            "CREATE CONSTRAINT import_tracking_unique IF NOT EXISTS "
+            "FOR (t:ImportTracking) REQUIRE (t.table_name, t.file_name) IS UNIQUE",
+            # Resuming looks up the newest file of a type for each table
+            "CREATE INDEX import_tracking_latest IF NOT EXISTS "
+            "FOR (t:ImportTracking) ON (t.table_name, t.file_type, t.end_timestamp)",
         ]
         
         for constraint in constraints:
@@ -70,7 +75,10 @@ class Neo4jSchemaManager:
                 session.run(constraint)
                 self.logger.debug(f"Created constraint: {constraint}")
             except Neo4jError as e:
-                if "equivalent constraint already exists" in str(e).lower():
+                if (
+                    "equivalent constraint already exists" in str(e).lower()
+                    or "equivalent index already exists" in str(e).lower()
+                ):
                     self.logger.debug(f"Constraint already exists: {constraint}")
                 else:
                     raise
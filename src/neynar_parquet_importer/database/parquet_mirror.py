@@ -0,0 +1,389 @@
+"""
+A local parquet dataset instead of a database.
+
+Rows are written to `{PARQUET_MIRROR_DIR}/{table}/day={YYYY-MM-DD}/` (the day of their
+updated_at).
+Every row group becomes a small `part-*` file. A background thread merges small files of
+the same day into large `compacted-*` files.
+Merged files are deduplicated (the newest updated_at wins) and sorted by primary key.
+
+`{table}/_manifest.json` lists the live files. It is replaced atomically, so readers
+that only open the files it lists always see a consistent snapshot.
+Files that compaction replaced are deleted PARQUET_MIRROR_RETAIN_S seconds later so that
+slow readers can finish.
+A row can still be in more than one file (in different days or before compaction).
+`read_snapshot` keeps the newest version.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .base import DatabaseBackend, ImportOperation, schema_primary_keys
+from ..settings import Settings
+
+
+MANIFEST_NAME = "_manifest.json"
+
+
+def read_manifest(table_dir: Path) -> Dict[str, Any]:
+    try:
+        with open(table_dir / MANIFEST_NAME, "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return {"version": 0, "files": [], "removed": []}
+
+
+def write_manifest(table_dir: Path, manifest: Dict[str, Any]) -> None:
+    """
+    Write to a temporary file and rename it over the old manifest. Readers see
+    either the old or the new one
+    """
+    tmp_path = table_dir / f"{MANIFEST_NAME}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(manifest))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, table_dir / MANIFEST_NAME)
+
+
+def write_parquet_file(table_dir: Path, day: str, prefix: str, table: pa.Table) -> str:
+    """
+    Write a new file into a day's partition. Returns its path relative to table_dir
+    """
+    relative_path = (
+        f"day={day}/{prefix}-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+    )
+
+    final_path = table_dir / relative_path
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # readers never see a partially written file
+    tmp_path = final_path.with_suffix(".tmp")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, final_path)
+
+    return relative_path
+
+
+def storage_column(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Compute kernels don't support extension types like arrow.uuid. Their storage
+    works fine
+    """
+    if isinstance(column.type, pa.BaseExtensionType):
+        return pa.chunked_array(
+            [chunk.storage for chunk in column.chunks],
+            column.type.storage_type,
+        )
+    return column
+
+
+def sort_by_primary_key(table: pa.Table, primary_key: List[str]) -> pa.Table:
+    keys = [name for name in primary_key if name in table.column_names]
+    if not keys:
+        return table
+
+    indices = pc.sort_indices(
+        pa.table({name: storage_column(table.column(name)) for name in keys}),
+        sort_keys=[(name, "ascending") for name in keys],
+    )
+    return table.take(indices)
+
+
+def split_by_day(batch: pa.Table) -> Dict[str, pa.Table]:
+    """
+    Split a batch into one table per day of updated_at. Tables without updated_at
+    (and rows where it is null) use today's date
+    """
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+
+    if "updated_at" not in batch.column_names:
+        return {today: batch}
+
+    days = pc.cast(batch.column("updated_at"), pa.date32())
+
+    day_batches = {
+        day.as_py().isoformat(): batch.filter(pc.equal(days, day))
+        for day in pc.unique(days)
+        if day.is_valid
+    }
+
+    if days.null_count:
+        null_batch = batch.filter(pc.is_null(days))
+        if today in day_batches:
+            null_batch = pa.concat_tables([day_batches[today], null_batch])
+        day_batches[today] = null_batch
+
+    return day_batches
+
+
+def read_snapshot(
+    mirror_dir: Path,
+    table_name: str,
+    primary_key: List[str],
+) -> pa.Table:
+    """
+    Read every file in the table's manifest and keep the newest version of each row
+    """
+    from ..db import dedupe_primary_keys
+
+    table_dir = Path(mirror_dir) / table_name
+    manifest = read_manifest(table_dir)
+
+    if not manifest["files"]:
+        return pa.table({})
+
+    table = pa.concat_tables(
+        [pq.read_table(table_dir / entry["path"]) for entry in manifest["files"]],
+        promote_options="default",
+    )
+
+    return dedupe_primary_keys(table, primary_key)
+
+
+class ParquetMirrorBackend(DatabaseBackend):
+    """
+    Writes Arrow batches into a day-partitioned parquet dataset and compacts it in
+    the background
+    """
+
+    # import_arrow gets the filtered batch directly. no transformer or per-row objects
+    accepts_arrow = True
+
+    def __init__(self):
+        self.settings: Optional[Settings] = None
+        self.mirror_dir: Optional[Path] = None
+        self.primary_keys: Dict[str, List[str]] = {}
+        self.manifests: Dict[str, Dict[str, Any]] = {}
+        # guards the manifest of each table. files are written outside of it
+        self._table_locks: Dict[str, threading.Lock] = {}
+        self._schema_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._compact_thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger(__name__)
+
+    def init_db(self, uri: str, tables: List[str], settings: Settings) -> Any:
+        """Load the manifests and start compacting
+
+        This should only be called once per process (see DatabaseFactory.get_backend).
+        """
+        if self.mirror_dir is not None:
+            self.ensure_schema(tables, settings)
+            return self.mirror_dir
+
+        self.settings = settings
+        self.mirror_dir = Path(settings.parquet_mirror_dir)
+        self.mirror_dir.mkdir(parents=True, exist_ok=True)
+
+        self.ensure_schema(tables, settings)
+
+        if settings.parquet_mirror_compact_s > 0:
+            self._stop.clear()
+            self._compact_thread = threading.Thread(
+                target=self._compact_loop,
+                name="ParquetMirrorCompact",
+                daemon=True,
+            )
+            self._compact_thread.start()
+
+        return self.mirror_dir
+
+    def ensure_schema(self, tables: List[str], settings: Settings) -> None:
+        """
+        Look up the primary keys and load the manifests of tables that haven't
+        been seen yet
+        """
+        with self._schema_lock:
+            for table_name in tables:
+                if table_name in self.primary_keys:
+                    continue
+
+                (self.mirror_dir / table_name).mkdir(parents=True, exist_ok=True)
+
+                self.primary_keys[table_name] = schema_primary_keys(
+                    table_name,
+                    settings,
+                )
+                self.manifests[table_name] = read_manifest(self.mirror_dir / table_name)
+                self._table_locks[table_name] = threading.Lock()
+
+    def import_arrow(self, table_name: str, batch: pa.Table) -> None:
+        """Write the batch as one small file per day and add them to the manifest"""
+        if batch.num_rows == 0:
+            return
+
+        from ..db import dedupe_primary_keys
+
+        batch = dedupe_primary_keys(batch, self.primary_keys[table_name])
+
+        table_dir = self.mirror_dir / table_name
+
+        entries = [
+            {
+                "path": write_parquet_file(table_dir, day, "part", day_batch),
+                "day": day,
+                "num_rows": day_batch.num_rows,
+            }
+            for day, day_batch in split_by_day(batch).items()
+        ]
+
+        with self._table_locks[table_name]:
+            manifest = self.manifests[table_name]
+            manifest["files"].extend(entries)
+            manifest["version"] += 1
+            write_manifest(table_dir, manifest)
+
+    def import_operations(self, operations: List[ImportOperation]) -> None:
+        """Rows grouped by table. Only used by callers that don't have Arrow batches"""
+        rows_by_table: Dict[str, List[Dict[str, Any]]] = {}
+        for op in operations:
+            rows_by_table.setdefault(op.entity_type, []).append(op.properties)
+
+        for table_name, rows in rows_by_table.items():
+            self.import_arrow(table_name, pa.Table.from_pylist(rows))
+
+    def compact(self, table_name: str) -> int:
+        """
+        Merge the small files of each day that has at least
+        PARQUET_MIRROR_COMPACT_MIN_FILES of them. Returns how many files were
+        replaced
+        """
+        from ..db import dedupe_primary_keys
+
+        settings = self.settings
+        table_dir = self.mirror_dir / table_name
+        primary_key = self.primary_keys[table_name]
+
+        # files that reached the target size are left alone. that keeps rewrites of the
+        # current day cheap
+        with self._table_locks[table_name]:
+            small_files: Dict[str, List[Dict[str, Any]]] = {}
+            for entry in self.manifests[table_name]["files"]:
+                if entry["num_rows"] < settings.parquet_mirror_target_rows:
+                    small_files.setdefault(entry["day"], []).append(entry)
+
+        num_replaced = 0
+
+        for day, entries in sorted(small_files.items()):
+            if len(entries) < settings.parquet_mirror_compact_min_files:
+                continue
+
+            merged = pa.concat_tables(
+                [pq.read_table(table_dir / entry["path"]) for entry in entries],
+                promote_options="default",
+            )
+            merged = sort_by_primary_key(
+                dedupe_primary_keys(merged, primary_key),
+                primary_key,
+            )
+
+            compacted = {
+                "path": write_parquet_file(table_dir, day, "compacted", merged),
+                "day": day,
+                "num_rows": merged.num_rows,
+            }
+
+            replaced = {entry["path"] for entry in entries}
+
+            # only compaction removes files, so every replaced file is still in the
+            # manifest
+            with self._table_locks[table_name]:
+                manifest = self.manifests[table_name]
+                manifest["files"] = [
+                    entry
+                    for entry in manifest["files"]
+                    if entry["path"] not in replaced
+                ] + [compacted]
+                manifest["removed"].extend(
+                    {"path": path, "removed_at": time.time()}
+                    for path in sorted(replaced)
+                )
+                manifest["version"] += 1
+                write_manifest(table_dir, manifest)
+
+            num_replaced += len(entries)
+
+            self.logger.info(
+                "compacted parquet mirror",
+                extra={
+                    "table": table_name,
+                    "day": day,
+                    "num_files": len(entries),
+                    "num_rows": merged.num_rows,
+                },
+            )
+
+        self._delete_removed(table_name)
+
+        return num_replaced
+
+    def _delete_removed(self, table_name: str) -> None:
+        """
+        Delete replaced files once readers of older manifests have had time to
+        finish
+        """
+        table_dir = self.mirror_dir / table_name
+        cutoff = time.time() - self.settings.parquet_mirror_retain_s
+
+        with self._table_locks[table_name]:
+            manifest = self.manifests[table_name]
+
+            expired = [
+                entry for entry in manifest["removed"] if entry["removed_at"] <= cutoff
+            ]
+            if not expired:
+                return
+
+            manifest["removed"] = [
+                entry for entry in manifest["removed"] if entry["removed_at"] > cutoff
+            ]
+            manifest["version"] += 1
+            write_manifest(table_dir, manifest)
+
+        for entry in expired:
+            try:
+                os.remove(table_dir / entry["path"])
+            except FileNotFoundError:
+                pass
+
+    def _compact_loop(self) -> None:
+        while not self._stop.wait(self.settings.parquet_mirror_compact_s):
+            for table_name in list(self.primary_keys):
+                try:
+                    self.compact(table_name)
+                except Exception:
+                    # the next round tries again. the manifest is never left half
+                    # updated
+                    self.logger.exception(
+                        "failed to compact parquet mirror",
+                        extra={"table": table_name},
+                    )
+
+    def check_import_progress(self, table_name: str, file_name: str) -> Optional[int]:
+        """Import tracking stays in postgres (IMPORT_TRACKING_BACKEND=postgresql)"""
+        return None
+
+    def mark_completed(self, file_names: List[str], table_name: str) -> None:
+        """Import tracking stays in postgres (IMPORT_TRACKING_BACKEND=postgresql)"""
+        pass
+
+    def close(self) -> None:
+        """Stop compacting. Everything imported is already in the manifests"""
+        self._stop.set()
+
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+            self._compact_thread = None
+
+        self.mirror_dir = None
+        self.primary_keys.clear()
+        self.manifests.clear()
@@ -6,13 +6,19 @@ system calls and provide consistent memory management across backends.
 """
 
 import logging
+import math
+import threading
 import time
 import psutil
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Any, Union
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Any
 from contextlib import contextmanager
 from enum import Enum
 
+from ..metering import get_meter
+
+
 # Import for type annotations
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -21,6 +27,9 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+BATCH_TIMES_WINDOW = 1000
+
+
 class MonitoringLevel(Enum):
     """Performance monitoring levels"""
     DISABLED = "disabled"      # No monitoring (PostgreSQL default)
@@ -36,15 +45,14 @@ class UnifiedMetrics:
     total_time: float = 0.0
     memory_used_mb: float = 0.0
     peak_memory_mb: float = 0.0
-    batch_times: List[float] = None
+    # only recent batches are kept. a long import would otherwise grow this forever
+    batch_times: Deque[float] = field(
+        default_factory=lambda: deque(maxlen=BATCH_TIMES_WINDOW),
+    )
     errors_count: int = 0
     backend_type: str = "unknown"
     monitoring_level: MonitoringLevel = MonitoringLevel.DISABLED
     
-    def __post_init__(self):
-        if self.batch_times is None:
-            self.batch_times = []
-    
     @property
     def operations_per_second(self) -> float:
         """Calculate operations per second"""
@@ -53,6 +61,60 @@ class UnifiedMetrics:
         return self.operations_count / self.total_time
 
 
+class AdjustableSemaphore:
+    """A semaphore whose limit can change while it is in use
+
+    Lowering the limit never interrupts holders. New acquires wait until enough
+    slots are released.
+    """
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._condition = threading.Condition()
+    
+    @property
+    def active(self) -> int:
+        return self._active
+    
+    def set_limit(self, limit: int):
+        with self._condition:
+            self.limit = max(1, limit)
+            self._condition.notify_all()
+    
+    def acquire(self, shutdown_event: Optional[threading.Event] = None):
+        with self._condition:
+            while self._active >= self.limit:
+                if shutdown_event is not None and shutdown_event.is_set():
+                    from ..settings import ShuttingDown
+
+                    raise ShuttingDown(
+                        "shutting down while waiting for a row group slot",
+                    )
+                # wake up now and then to check for shutdown
+                self._condition.wait(1)
+            self._active += 1
+    
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+
+def _no_slot():
+    pass
+
+
+@dataclass
+class TableControl:
+    """Adaptive state for one table"""
+    batch_size: int
+    concurrency: int
+    slots: AdjustableSemaphore
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
 class UnifiedPerformanceManager:
     """
     Single performance manager for all database backends.
@@ -60,9 +122,15 @@ class UnifiedPerformanceManager:
     Eliminates redundant psutil calls and provides configurable monitoring levels.
     """
     
-    def __init__(self, backend_type: str, monitoring_level: MonitoringLevel = MonitoringLevel.STANDARD):
+    def __init__(
+        self,
+        backend_type: str,
+        monitoring_level: MonitoringLevel = MonitoringLevel.STANDARD,
+        settings: Optional['Settings'] = None,
+    ):
         self.backend_type = backend_type
         self.monitoring_level = monitoring_level
+        self.settings = settings
         self.metrics = UnifiedMetrics(backend_type=backend_type, monitoring_level=monitoring_level)
         
         # Single psutil.Process instance (eliminates redundancy)
@@ -82,6 +150,38 @@ class UnifiedPerformanceManager:
         self.batch_size_limits = (100, 10000)
         self.current_batch_size = 1000
         
+        # Adaptive control. see record_batch
+        self.adaptive = False
+        self.latency_slo_s = 2.0
+        self.latency_slo_overrides: Dict[str, float] = {}
+        self.decision_window = 10
+        self.max_concurrency = 1
+        self._tables: Dict[str, TableControl] = {}
+        self._lock = threading.Lock()
+        
+        if settings is not None:
+            self._memory_check_interval = settings.memory_cache_duration
+            self._memory_check_frequency = max(1, settings.memory_check_frequency)
+            self.max_memory_mb = settings.adaptive_max_rss_mb
+            self.batch_size_limits = (
+                min(self.batch_size_limits[0], settings.adaptive_max_batch_size),
+                settings.adaptive_max_batch_size,
+            )
+            if backend_type == "neo4j":
+                self.current_batch_size = settings.batch_size_neo4j
+            else:
+                # postgres statements start as large as they are allowed to be
+                self.current_batch_size = settings.adaptive_max_batch_size
+
+            self.adaptive = (
+                settings.adaptive_control
+                and monitoring_level != MonitoringLevel.DISABLED
+            )
+            self.latency_slo_s = settings.adaptive_latency_slo_s
+            self.latency_slo_overrides = settings.latency_slo_overrides()
+            self.decision_window = max(1, settings.adaptive_window)
+            self.max_concurrency = max(1, settings.row_workers)
+        
         self.start_time: Optional[float] = None
         
     def start_monitoring(self):
@@ -178,23 +278,143 @@ class UnifiedPerformanceManager:
         self.metrics.errors_count += 1
     
     def adjust_batch_size(self, batch_time: float) -> int:
-        """Simple, conservative batch size adjustment"""
-        if self.monitoring_level == MonitoringLevel.DISABLED:
+        """
+        Feed one batch latency into the controller for writes that aren't tied
+        to a table
+        """
+        self.record_batch("*", batch_time)
+        return self.batch_size("*")
+    
+    def _table_control(self, table_name: str) -> TableControl:
+        with self._lock:
+            control = self._tables.get(table_name)
+            if control is None:
+                control = TableControl(
+                    batch_size=self.current_batch_size,
+                    concurrency=self.max_concurrency,
+                    slots=AdjustableSemaphore(self.max_concurrency),
+                )
+                self._tables[table_name] = control
+            return control
+    
+    def latency_slo(self, table_name: str) -> float:
+        return self.latency_slo_overrides.get(table_name, self.latency_slo_s)
+    
+    def batch_size(self, table_name: str) -> int:
+        """How many rows to send in one write for this table"""
+        if not self.adaptive:
             return self.current_batch_size
+        return self._table_control(table_name).batch_size
+    
+    def acquire_row_group_slot(
+        self,
+        table_name: str,
+        shutdown_event: Optional[threading.Event] = None,
+    ) -> Callable[[], None]:
+        """
+        Limit how many row groups of a table are written at once. The limit
+        shrinks under errors and memory pressure.
+
+        Call this before the row group is submitted and call the returned function
+        when it is done. Waiting then holds up the table's own file worker instead
+        of a row group worker that other tables need
+        """
+        if not self.adaptive:
+            return _no_slot
         
-        # Only adjust if consistently slow (> 3 seconds per batch)
-        if len(self.metrics.batch_times) >= 5:
-            recent_avg = sum(self.metrics.batch_times[-5:]) / 5
-            memory_check = self.check_memory_pressure()
+        slots = self._table_control(table_name).slots
+        slots.acquire(shutdown_event)
+        return slots.release
+    
+    def record_batch(self, table_name: str, latency_s: float, error: bool = False):
+        """
+        Record one write. Every `decision_window` writes, the batch size and
+        concurrency for the table are adjusted
+
+        This is AIMD (like TCP congestion control):
+        - errors or RSS over the limit: halve the batch size and the concurrency
+        - p90 latency over the SLO: halve the batch size
+        - p90 latency under half of the SLO: grow the batch size by a fixed
+          step. once it is at the max, add a worker
+        """
+        if not self.adaptive:
+            return
+        
+        control = self._table_control(table_name)
+        
+        with self._lock:
+            control.latencies.append(latency_s)
+            if error:
+                control.errors += 1
             
-            if recent_avg > 3.0 and memory_check['should_pause']:
-                self.current_batch_size = max(
-                    self.batch_size_limits[0],
-                    int(self.current_batch_size * 0.8)  # 20% reduction
-                )
-                logger.info(f"Reduced batch size to {self.current_batch_size} due to performance")
+            if len(control.latencies) < self.decision_window and not error:
+                return
+            
+            latencies = sorted(control.latencies)
+            errors = control.errors
+            control.latencies = []
+            control.errors = 0
+        
+        p90_latency_s = latencies[max(0, math.ceil(len(latencies) * 0.9) - 1)]
         
-        return self.current_batch_size
+        self._decide(table_name, control, p90_latency_s, errors)
+
+    def _decide(
+        self,
+        table_name: str,
+        control: TableControl,
+        p90_latency_s: float,
+        errors: int,
+    ):
+        min_batch_size, max_batch_size = self.batch_size_limits
+        slo = self.latency_slo(table_name)
+        rss_mb = self._get_memory_usage()['rss_mb']
+        
+        with self._lock:
+            if errors:
+                decision = "errors"
+            elif rss_mb > self.max_memory_mb:
+                decision = "memory"
+            elif p90_latency_s > slo:
+                decision = "latency"
+            elif p90_latency_s < slo / 2:
+                decision = "increase"
+            else:
+                decision = "hold"
+            
+            if decision in ("errors", "memory"):
+                control.batch_size = max(min_batch_size, control.batch_size // 2)
+                control.concurrency = max(1, control.concurrency // 2)
+            elif decision == "latency":
+                control.batch_size = max(min_batch_size, control.batch_size // 2)
+            elif decision == "increase":
+                if control.batch_size < max_batch_size:
+                    step = max(1, (max_batch_size - min_batch_size) // 20)
+                    control.batch_size = min(max_batch_size, control.batch_size + step)
+                else:
+                    control.concurrency = min(
+                        self.max_concurrency,
+                        control.concurrency + 1,
+                    )
+
+            batch_size = control.batch_size
+            concurrency = control.concurrency
+        
+        control.slots.set_limit(concurrency)
+        
+        tags = [f"backend:{self.backend_type}", f"table:{table_name}"]
+        meter = get_meter()
+        meter.gauge("adaptive_batch_size", batch_size, tags)
+        meter.gauge("adaptive_row_group_concurrency", concurrency, tags)
+        meter.gauge("adaptive_p90_latency_s", p90_latency_s, tags)
+        meter.increment("adaptive_decisions", 1, tags + [f"decision:{decision}"])
+        
+        if decision not in ("hold", "increase"):
+            logger.info(
+                f"Adaptive control for {table_name}: {decision}. "
+                f"batch size {batch_size}, concurrency {concurrency}, "
+                f"p90 latency {p90_latency_s:.2f}s, rss {rss_mb:.0f}MB",
+            )
     
     def get_current_metrics(self) -> UnifiedMetrics:
         """Get current performance metrics"""
@@ -230,11 +450,31 @@ def create_performance_manager(backend_type: str, settings: Optional['Settings']
     else:
         monitoring_level = MonitoringLevel.DISABLED
     
-    # Allow override via settings
+    # Allow override via settings. "auto" keeps the backend default
     if settings and hasattr(settings, 'performance_monitoring_level'):
         try:
             monitoring_level = MonitoringLevel(settings.performance_monitoring_level)
         except ValueError:
             pass  # Keep default
     
-    return UnifiedPerformanceManager(backend_type, monitoring_level)
+    return UnifiedPerformanceManager(backend_type, monitoring_level, settings)
+
+
+_managers: Dict[str, UnifiedPerformanceManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_performance_manager(
+    backend_type: str,
+    settings: "Settings",
+) -> UnifiedPerformanceManager:
+    """
+    The shared performance manager for a backend. Every row group worker in the
+    process feeds the same controller
+    """
+    with _managers_lock:
+        manager = _managers.get(backend_type)
+        if manager is None:
+            manager = create_performance_manager(backend_type, settings)
+            _managers[backend_type] = manager
+        return manager
@@ -1,17 +1,17 @@
-import ast
 import atexit
 from datetime import UTC, datetime
 import inspect
 import logging
 from pathlib import Path
 from concurrent import futures
-from datadog import statsd
+from cachetools import LRUCache
 import glob
-import orjson
 from os import path
 from os import PathLike
 import re
+import threading
 from time import time
+import pyarrow as pa
 import pyarrow.parquet as pq
 from sqlalchemy import (
     MetaData,
@@ -23,7 +23,6 @@ from sqlalchemy import (
     text,
     update,
 )
-from sqlalchemy.dialects.postgresql.json import JSONB
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from tenacity import (
     after_log,
@@ -33,22 +32,13 @@ from tenacity import (
     wait_exponential_jitter,
 )
 
-from neynar_parquet_importer.row_filters import include_row
-
 from .logger import LOGGER
-from .s3 import parse_parquet_filename
-from .settings import SHUTDOWN_EVENT, Settings, ShuttingDown
-
-# TODO: detect this from the table
-# TODO: this should be a dict of table names to column names
-# arrays and json columns are stored as json in parquet because that was easier than dealing with the schema
-JSON_COLUMNS = [
-    "embeds",
-    "mentions",
-    "mentions_positions",
-    "moderator_fids",
-    "verified_addresses",
-]
+from .metering import get_meter
+from .row_codecs import clean_jsonb_data, get_row_codec  # noqa: F401
+from .row_filters import compile_row_filter, filter_batch, row_filter_columns
+from .s3 import parse_parquet_filename, read_sparse_sidecar
+from .database.unified_performance import get_performance_manager
+from .settings import SHUTDOWN_EVENT, Settings, ShuttingDown, drain_time_left
 
 
 def sleep_or_raise_shutdown(t):
@@ -104,13 +94,38 @@ def init_db(uri, parquet_tables, settings: Settings):
 
     LOGGER.info("migrating...")
 
-    pattern = r"schema/(?P<num>\d+)_(?P<sub_num>\d+)_(?P<parquet_db_name>[a-zA-Z0-9-]+)_(?P<parquet_schema_name>[a-zA-Z0-9-]+)_(?P<parquet_table_name>[a-zA-Z0-9_]+)\.sql"
+    pattern = (
+        r"schema/(?:(?P<partitioned>partitioned)/)?"
+        r"(?P<num>\d+)_(?P<sub_num>\d+)_"
+        r"(?P<parquet_db_name>[a-zA-Z0-9-]+)_"
+        r"(?P<parquet_schema_name>[a-zA-Z0-9-]+)_"
+        r"(?P<parquet_table_name>[a-zA-Z0-9_]+)\.sql"
+    )
 
     migrations = []
 
     parquet_tables_and_views = parquet_tables + settings.views.split(",")
 
-    for filename in sorted(glob.glob("schema/*.sql")):
+    partitioned_tables = settings.partitioned_tables()
+
+    migration_files = glob.glob("schema/*.sql")
+    if partitioned_tables:
+        migration_files += glob.glob("schema/partitioned/*.sql")
+
+        missing = partitioned_tables - {
+            m["parquet_table_name"]
+            for m in (re.match(pattern, f) for f in migration_files)
+            if m
+            and m["partitioned"]
+            and m["parquet_db_name"] == settings.parquet_s3_database
+            and m["parquet_schema_name"] == settings.parquet_s3_schema
+        }
+        if missing:
+            raise ValueError(f"no partitioned schema for tables: {sorted(missing)}")
+
+    # sort by the basename so that the partitioned files run in the same order as the
+    # regular ones
+    for filename in sorted(migration_files, key=lambda f: (path.basename(f), f)):
         m = re.match(pattern, filename)
 
         if m:
@@ -124,6 +139,8 @@ def init_db(uri, parquet_tables, settings: Settings):
                 parts["parquet_db_name"] == settings.parquet_s3_database
                 and parts["parquet_schema_name"] == settings.parquet_s3_schema
                 and parts["parquet_table_name"] in parquet_tables_and_views
+                and bool(parts["partitioned"])
+                == (parts["parquet_table_name"] in partitioned_tables)
             ):
                 pass
             else:
@@ -162,6 +179,67 @@ def init_db(uri, parquet_tables, settings: Settings):
     return engine
 
 
+def create_upcoming_partitions(engine, table_names: list[str], settings: Settings):
+    """
+    Create the next POSTGRES_PARTITION_MONTHS_AHEAD monthly partitions of the
+    partitioned tables in table_names
+    """
+    with engine.begin() as conn:
+        for table_name in sorted(settings.partitioned_tables() & set(table_names)):
+            conn.execute(
+                text(
+                    f"SELECT {settings.postgres_schema}.create_monthly_partitions("
+                    ":table_name, now()::date, "
+                    "(now() + make_interval(months => :months))::date)",
+                ),
+                {
+                    "table_name": table_name,
+                    "months": settings.postgres_partition_months_ahead,
+                },
+            )
+
+
+def partition_maintenance_loop(engine, table_names: list[str], settings: Settings):
+    """
+    Keep creating monthly partitions while the importer runs. Otherwise a
+    long-running importer writes into the DEFAULT partition
+    """
+    while not SHUTDOWN_EVENT.wait(settings.postgres_partition_check_s):
+        try:
+            create_upcoming_partitions(engine, table_names, settings)
+        except Exception:
+            # the next check tries again. until then, rows land in the DEFAULT partition
+            # and are moved later
+            LOGGER.exception("failed to create upcoming partitions")
+
+
+def _tracking_backend(settings: Settings | None):
+    """
+    The backend that stores import tracking. None means the postgres
+    parquet_import_tracking table.
+    """
+    if settings is None or not settings.non_postgres_backend():
+        return None
+
+    from .database.factory import DatabaseFactory
+
+    return DatabaseFactory.get_backend(settings, [])
+
+
+def get_non_postgres_tables(table_names: list[str]) -> dict[str, Table]:
+    """
+    Placeholder tables for when postgres isn't used at all
+    (IMPORT_TRACKING_BACKEND=neo4j or duckdb).
+    Only the names are used by the import paths for those backends.
+    """
+    meta = MetaData()
+
+    return {
+        table_name: Table(table_name, meta)
+        for table_name in table_names + ["parquet_import_tracking"]
+    }
+
+
 def check_for_past_incremental_import(
     engine,
     parquet_import_tracking: Table,
@@ -173,24 +251,36 @@ def check_for_past_incremental_import(
     Returns the filename for the newest completed incremental.
     There may be some partially imported files after this.
     """
-
-    stmt = (
-        select(
-            parquet_import_tracking.c.file_name,
+    tracking_backend = _tracking_backend(settings)
+
+    if tracking_backend is not None:
+        latest = tracking_backend.get_latest_import(
+            table.name,
+            "incremental",
+            backfill,
+            completed_only=True,
+            settings=settings,
         )
-        .where(parquet_import_tracking.c.file_type == "incremental")
-        .where(parquet_import_tracking.c.table_name == table.name)
-        .where(parquet_import_tracking.c.file_version == settings.npe_version)
-        .where(
-            parquet_import_tracking.c.file_duration_s == settings.incremental_duration
+        result = None if latest is None else (latest["file_name"],)
+    else:
+        stmt = (
+            select(
+                parquet_import_tracking.c.file_name,
+            )
+            .where(parquet_import_tracking.c.file_type == "incremental")
+            .where(parquet_import_tracking.c.table_name == table.name)
+            .where(parquet_import_tracking.c.file_version == settings.npe_version)
+            .where(
+                parquet_import_tracking.c.file_duration_s
+                == settings.incremental_duration,
+            )
+            .where(parquet_import_tracking.c.completed.is_(True))
+            .where(parquet_import_tracking.c.backfill.is_(backfill))
+            .order_by(parquet_import_tracking.c.end_timestamp.desc())
+            .limit(1)
         )
-        .where(parquet_import_tracking.c.completed.is_(True))
-        .where(parquet_import_tracking.c.backfill.is_(backfill))
-        .order_by(parquet_import_tracking.c.end_timestamp.desc())
-        .limit(1)
-    )
 
-    result = fetchone_with_retry(engine, stmt)
+        result = fetchone_with_retry(engine, stmt)
 
     if result is None:
         LOGGER.info(
@@ -216,26 +306,46 @@ def check_for_past_full_import(
     backfill: bool,
 ):
     """Returns the filename of the newest full import (there should really only be one). This may only be partially imported."""
-
-    stmt = (
-        select(
-            parquet_import_tracking.c.file_name,
-            parquet_import_tracking.c.completed,
-            parquet_import_tracking.c.last_row_group_imported,
-            parquet_import_tracking.c.total_row_groups,
+    tracking_backend = _tracking_backend(settings)
+
+    if tracking_backend is not None:
+        latest = tracking_backend.get_latest_import(
+            table.name,
+            "full",
+            backfill,
+            completed_only=False,
+            settings=settings,
         )
-        .where(parquet_import_tracking.c.file_type == "full")
-        .where(parquet_import_tracking.c.table_name == table.name)
-        .where(parquet_import_tracking.c.file_version == settings.npe_version)
-        .where(
-            parquet_import_tracking.c.file_duration_s == settings.incremental_duration
+        if latest is None:
+            result = None
+        else:
+            result = (
+                latest["file_name"],
+                latest["completed"],
+                latest["last_row_group_imported"],
+                latest["total_row_groups"],
+            )
+    else:
+        stmt = (
+            select(
+                parquet_import_tracking.c.file_name,
+                parquet_import_tracking.c.completed,
+                parquet_import_tracking.c.last_row_group_imported,
+                parquet_import_tracking.c.total_row_groups,
+            )
+            .where(parquet_import_tracking.c.file_type == "full")
+            .where(parquet_import_tracking.c.table_name == table.name)
+            .where(parquet_import_tracking.c.file_version == settings.npe_version)
+            .where(
+                parquet_import_tracking.c.file_duration_s
+                == settings.incremental_duration,
+            )
+            .where(parquet_import_tracking.c.backfill.is_(backfill))
+            .order_by(parquet_import_tracking.c.end_timestamp.desc())
+            .limit(1)
         )
-        .where(parquet_import_tracking.c.backfill.is_(backfill))
-        .order_by(parquet_import_tracking.c.end_timestamp.desc())
-        .limit(1)
-    )
 
-    result = fetchone_with_retry(engine, stmt)
+        result = fetchone_with_retry(engine, stmt)
 
     if result is None:
         return None
@@ -253,33 +363,150 @@ def check_for_past_full_import(
 
     # if not completed but all the rows are done, we should mark it as completed now since it actually is done!
     if not completed and actually_completed:
-        mark_completed(engine, parquet_import_tracking, [latest_filename])
+        mark_completed(
+            engine,
+            parquet_import_tracking,
+            [latest_filename],
+            settings=settings,
+        )
 
     return (latest_filename, actually_completed)
 
 
-def clean_jsonb_data(col_name, value):
-    if value is None:
-        return None
+# footers of recently opened files. resuming an import doesn't decode the footer again
+_PARQUET_METADATA_CACHE = LRUCache(maxsize=64)
+_PARQUET_METADATA_LOCK = threading.Lock()
 
-    # the parquet has the json as a string
-    # i thought v3 tables were using the json extension, but that doesn't work how i thought
-    try:
-        if isinstance(value, str):
-            if value.startswith("[{'") or value.startswith("{'"):
-                return ast.literal_eval(value)
-            else:
-                return orjson.loads(value)
-        elif isinstance(value, bytes):
-            if value.startswith(b"[{'") or value.startswith(b"{'"):
-                return ast.literal_eval(str(value))
-            else:
-                return orjson.loads(value)
-    except Exception as exc:
-        raise ValueError("failed to parse jsonb column", col_name, value, exc)
 
-    # TODO: if this is a datetime column, it is from parquet in milliseconds, not seconds!
-    return value
+def read_parquet_metadata(local_file: Path) -> pq.FileMetaData:
+    """
+    Read (or reuse) the footer of a parquet file. The cache key includes the size
+    and mtime in case the file is replaced
+    """
+    stat = local_file.stat()
+    key = (str(local_file), stat.st_size, stat.st_mtime_ns)
+
+    with _PARQUET_METADATA_LOCK:
+        metadata = _PARQUET_METADATA_CACHE.get(key)
+
+    if metadata is None:
+        metadata = pq.read_metadata(local_file)
+
+        with _PARQUET_METADATA_LOCK:
+            _PARQUET_METADATA_CACHE[key] = metadata
+
+    return metadata
+
+
+# (table, dropped columns) that were already logged. every incremental would log the
+# same thing again
+_LOGGED_DROPPED_COLUMNS = set()
+_LOGGED_DROPPED_COLUMNS_LOCK = threading.Lock()
+
+
+def log_dropped_columns(table: Table, dropped: tuple[str, ...]):
+    key = (table.fullname, dropped)
+
+    with _LOGGED_DROPPED_COLUMNS_LOCK:
+        if key in _LOGGED_DROPPED_COLUMNS:
+            return
+        _LOGGED_DROPPED_COLUMNS.add(key)
+
+    LOGGER.info(
+        "skipping parquet columns that are not in the table",
+        extra={"table": table.fullname, "columns": list(dropped)},
+    )
+
+
+class ParquetReader:
+    """
+    One parquet file shared by every row group worker of an import.
+
+    With PARQUET_MEMORY_MAP, the workers read straight out of the page cache instead
+    of each copying through buffered reads.
+    After `project`, only the columns that the table has are decoded.
+    """
+
+    def __init__(self, local_file: Path, settings: Settings):
+        self.parquet_file = pq.ParquetFile(
+            local_file,
+            metadata=read_parquet_metadata(local_file),
+            memory_map=settings.parquet_memory_map,
+            pre_buffer=settings.parquet_pre_buffer,
+        )
+        self.columns = None
+        # the columns that the file's row filter reads
+        self.filter_columns = set()
+
+    @property
+    def metadata(self) -> pq.FileMetaData:
+        return self.parquet_file.metadata
+
+    @property
+    def num_row_groups(self) -> int:
+        return self.parquet_file.num_row_groups
+
+    @property
+    def schema_arrow(self) -> pa.Schema:
+        return self.parquet_file.schema_arrow
+
+    def project(self, table: Table, extra_columns: set[str] | None = None):
+        """
+        Only read the columns that exist in the table. Placeholder tables
+        (deployments without postgres) have no columns and read everything.
+
+        extra_columns (the columns that filters look at) are read too. The row
+        codec removes them after filtering.
+        """
+        if not len(table.c):
+            self.columns = None
+            return
+
+        extra_columns = extra_columns or set()
+
+        names = self.schema_arrow.names
+        columns = [name for name in names if name in table.c or name in extra_columns]
+
+        # filter-only columns are still read. they are dropped after filtering
+        dropped = tuple(name for name in names if name not in columns)
+        if dropped:
+            log_dropped_columns(table, dropped)
+
+        self.columns = None if len(columns) == len(names) else columns
+
+    def read_row_group(self, i: int) -> pa.Table:
+        return self.parquet_file.read_row_group(i, columns=self.columns)
+
+    def row_groups_outside(self, column: str, start, end) -> set[int]:
+        """
+        Row groups whose min/max statistics for `column` are entirely outside
+        [start, end]. None of their rows can pass the backfill window.
+
+        Statistics are compared the same way `include_row` compares rows. Row
+        groups without usable statistics are never skipped.
+        """
+        names = self.metadata.schema.names
+        if column not in names or (start is None and end is None):
+            return set()
+
+        column_index = names.index(column)
+
+        outside = set()
+        for i in range(self.num_row_groups):
+            statistics = self.metadata.row_group(i).column(column_index).statistics
+            if statistics is None or not statistics.has_min_max:
+                continue
+
+            try:
+                if (start is not None and statistics.max < start) or (
+                    end is not None and statistics.min > end
+                ):
+                    outside.add(i)
+            except TypeError:
+                # naive vs aware timestamps. let the row filter decide
+                continue
+
+        return outside
 
 
 def get_tables(
@@ -328,6 +555,7 @@ def import_parquet(
     backfill_start_timestamp: datetime | None,
     backfill_end_timestamp: datetime | None,
     backfill: bool = False,
+    write_buffer=None,
 ):
     if isinstance(local_file, str):
         local_file = Path(local_file)
@@ -342,6 +570,10 @@ def import_parquet(
         f"path:parquet-importer/{schema_name}.{table.name}",
     ]
 
+    # metrics are summed in process and sent on an interval. the row group workers use
+    # it too
+    meter = get_meter(settings)
+
     is_empty = local_file.suffix == ".empty"
 
     if is_empty:
@@ -349,47 +581,99 @@ def import_parquet(
         # TODO: maybe have an option to return here instead of saving the ".empty" into the database
     else:
         try:
-            parquet_file = pq.ParquetFile(local_file)
+            parquet_file = ParquetReader(local_file, settings)
         except Exception as e:
             raise ValueError("Failed to read parquet file", local_file, e)
 
+        # the only columns that are converted to python before filtering
+        parquet_file.filter_columns = row_filter_columns(
+            row_filters, backfill_start_timestamp, backfill_end_timestamp,
+        )
+
+        # columns that aren't in the table are never decoded. filters still need theirs
+        # graph transformers read parquet columns by name, so other backends always read
+        # everything
+        if settings.database_backend == "postgresql":
+            parquet_file.project(table, parquet_file.filter_columns)
+
         num_row_groups = parquet_file.num_row_groups
 
+    if is_empty:
+        skipped_row_groups = set()
+    else:
+        skipped_row_groups = parquet_file.row_groups_outside(
+            "updated_at",
+            backfill_start_timestamp,
+            backfill_end_timestamp,
+        )
+
+        sparse = read_sparse_sidecar(local_file)
+        if sparse is not None:
+            # a sparse download only has the row groups that can match its filters. the
+            # others are holes
+            skipped_row_groups |= set(range(num_row_groups)) - set(sparse["row_groups"])
+
+            if sparse["filters"] != row_filters:
+                LOGGER.warning(
+                    "sparse file was downloaded with other filters. "
+                    "rows that only the new filters include are missing",
+                    extra={"table": table.name, "file_name": str(local_file)},
+                )
+
     # Do NOT put 0 here. That would mean that we already imported row group 0!
     last_row_group_imported = None
 
     # TODO: rename imported_at to end_timestamp
     end_timestamp_dt = datetime.fromtimestamp(parsed_filename["end_timestamp"], UTC)
 
-    # Prepare the insert statement
-    stmt = pg_insert(parquet_import_tracking).values(
-        table_name=table.name,
-        file_name=str(local_file),
-        file_type=file_type,
-        file_version=settings.npe_version,
-        file_duration_s=settings.incremental_duration,
-        end_timestamp=end_timestamp_dt,
-        is_empty=is_empty,
-        last_row_group_imported=last_row_group_imported,
-        total_row_groups=num_row_groups,
-        backfill=backfill,
-    )
+    tracking_backend = _tracking_backend(settings)
+
+    if tracking_backend is not None:
+        # deployments without postgres track progress in the import backend
+        tracking_id = None
+        last_row_group_imported = tracking_backend.start_file_import(
+            table.name,
+            str(local_file),
+            file_type,
+            parsed_filename["end_timestamp"],
+            is_empty,
+            num_row_groups,
+            backfill,
+            settings,
+        )
+    else:
+        # Prepare the insert statement
+        stmt = pg_insert(parquet_import_tracking).values(
+            table_name=table.name,
+            file_name=str(local_file),
+            file_type=file_type,
+            file_version=settings.npe_version,
+            file_duration_s=settings.incremental_duration,
+            end_timestamp=end_timestamp_dt,
+            is_empty=is_empty,
+            last_row_group_imported=last_row_group_imported,
+            total_row_groups=num_row_groups,
+            backfill=backfill,
+        )
 
-    upsert_stmt = stmt.on_conflict_do_update(
-        index_elements=["file_name"],  # Use the unique constraint columns
-        set_={
-            # No actual data changes; this is a no-op update
-            "last_row_group_imported": parquet_import_tracking.c.last_row_group_imported,
-        },
-    ).returning(
-        parquet_import_tracking.c.id, parquet_import_tracking.c.last_row_group_imported
-    )
+        upsert_stmt = stmt.on_conflict_do_update(
+            index_elements=["file_name"],  # Use the unique constraint columns
+            set_={
+                # No actual data changes; this is a no-op update
+                "last_row_group_imported": (
+                    parquet_import_tracking.c.last_row_group_imported
+                ),
+            },
+        ).returning(
+            parquet_import_tracking.c.id,
+            parquet_import_tracking.c.last_row_group_imported,
+        )
 
-    row = fetchone_with_retry(engine, upsert_stmt)
+        row = fetchone_with_retry(engine, upsert_stmt)
 
-    # Extract the id and last_row_group_imported
-    tracking_id = row.id
-    last_row_group_imported = row.last_row_group_imported
+        # Extract the id and last_row_group_imported
+        tracking_id = row.id
+        last_row_group_imported = row.last_row_group_imported
 
     if is_empty:
         # LOGGER.debug(
@@ -401,10 +685,10 @@ def import_parquet(
 
         file_age_s = time() - parsed_filename["end_timestamp"]
 
-        statsd.gauge("parquet_file_age_s", file_age_s, tags=dd_tags)
+        meter.gauge("parquet_file_age_s", file_age_s, dd_tags)
 
         # there is no row age for an empty file. use the file age instead
-        statsd.gauge("parquet_row_age_s", file_age_s, tags=dd_tags)
+        meter.gauge("parquet_row_age_s", file_age_s, dd_tags)
         return
 
     if last_row_group_imported is None:
@@ -445,13 +729,10 @@ def import_parquet(
         cu_metric = None
 
     if cu_metric:
-        neynar_api_client = settings.neynar_api_client()
-
         pricing_key = f"{schema_name}.{table.name}"
 
-        cu_prices = neynar_api_client.get_portal_pricing("indexer_service")
-
-        row_cu_cost = cu_prices.get(pricing_key)
+        # fetched once and refreshed in the background. not a request per file
+        row_cu_cost = meter.row_cu_cost(settings, pricing_key)
         filtered_row_cu_cost = 0
 
         if row_cu_cost is None:
@@ -478,9 +759,20 @@ def import_parquet(
         row_cu_cost = 0
         filtered_row_cu_cost = 0
 
+    # compiled once per file. the row group workers share it
+    row_filter = compile_row_filter(
+        row_filters,
+        backfill_start_timestamp,
+        backfill_end_timestamp,
+    )
+
+    # limits how many of this table's row groups run at once
+    performance = get_performance_manager(settings.database_backend, settings)
+
     # Read the data in batches
     # the batches are imported in parallel. the tracking table is updated in submit order
     fs = []
+    submitted_all = True
     for i in range(start_row_group, num_row_groups):
         # TODO: larger batches with `pf.iter_batches(batch_size=X)` instead of row groups
 
@@ -493,25 +785,53 @@ def import_parquet(
         #     table_name,
         # )
 
-        f = row_group_executor.submit(
-            process_batch,
-            dd_tags,
-            engine,
-            i,
-            settings.npe_version,
-            parquet_file,
-            parsed_filename,
-            primary_key_columns,
-            progress_callback,
-            row_filters,
-            table,
-            cu_metric,
-            row_cu_cost,
-            filtered_row_cu_cost,
-            backfill_start_timestamp,
-            backfill_end_timestamp,
-            settings,
-        )
+        if i in skipped_row_groups:
+            # nothing in this row group can pass (backfill window or sparse download).
+            # it still goes through fs so that tracking advances in order
+            f = futures.Future()
+            f.set_result((i, None, None, None))
+            fs.append(f)
+            progress_callback(1)
+            continue
+
+        # wait for a slot here instead of in the row group worker. a throttled table
+        # only holds up its own file worker
+        try:
+            release_slot = performance.acquire_row_group_slot(
+                table.name,
+                SHUTDOWN_EVENT,
+            )
+        except ShuttingDown:
+            # the row groups that were already submitted are drained below
+            submitted_all = False
+            break
+
+        try:
+            f = row_group_executor.submit(
+                process_batch,
+                dd_tags,
+                engine,
+                i,
+                settings.npe_version,
+                parquet_file,
+                parsed_filename,
+                primary_key_columns,
+                progress_callback,
+                row_filter,
+                table,
+                cu_metric,
+                row_cu_cost,
+                filtered_row_cu_cost,
+                backfill_start_timestamp,
+                backfill_end_timestamp,
+                settings,
+                write_buffer,
+            )
+        except BaseException:
+            release_slot()
+            raise
+        # cancelled row groups run their callbacks too
+        f.add_done_callback(lambda _, release_slot=release_slot: release_slot())
 
         fs.append(f)
 
@@ -524,9 +844,25 @@ def import_parquet(
     # update our database entry's last_row_group_imported
     # read them in order rather than with as_completed
     # TODO: have all the tables do this in another thread?
-    update_tracking_stmt = parquet_import_tracking.update().where(
-        parquet_import_tracking.c.id == tracking_id
-    )
+    if tracking_backend is None:
+        update_tracking_stmt = parquet_import_tracking.update().where(
+            parquet_import_tracking.c.id == tracking_id,
+        )
+
+    def record_progress(i):
+        if write_buffer is not None:
+            # the rows might not be in the database yet. the buffer updates tracking
+            # after it flushes
+            write_buffer.defer_tracking(tracking_id, i)
+        elif tracking_backend is not None:
+            # this is buffered. it doesn't cost a round trip for every row group
+            tracking_backend.update_import_progress(table.name, str(local_file), i)
+        else:
+            execute_with_retry(
+                engine,
+                update_tracking_stmt.values(last_row_group_imported=i),
+            )
+
     i = file_age_s = row_age_s = None
     while fs:
         f = fs.pop(0)
@@ -536,6 +872,29 @@ def import_parquet(
         )
 
         if f_shutdown in done:
+            drained_i, num_redo = drain_row_groups(
+                [f] + fs,
+                drain_time_left(settings.shutdown_drain_timeout_s),
+            )
+
+            # one tracking update for everything that finished during the drain
+            if drained_i is not None:
+                i = drained_i
+                record_progress(i)
+            if tracking_backend is not None:
+                tracking_backend.flush_import_progress()
+
+            LOGGER.info(
+                "drained import",
+                extra={
+                    "table": table.name,
+                    "file_name": str(local_file),
+                    "last_row_group_imported": i,
+                    "num_row_groups": num_row_groups,
+                    "redo_row_groups": num_redo,
+                },
+            )
+
             raise ShuttingDown("shutting down during import_parquet")
 
         assert f in done
@@ -561,12 +920,15 @@ def import_parquet(
         #     },
         # )
 
-        execute_with_retry(
-            engine, update_tracking_stmt.values(last_row_group_imported=i)
-        )
+        record_progress(i)
 
         # TODO: metric here?
-        if num_row_groups > 1 and i < num_row_groups - 1 and i % log_every_n == 0:
+        if (
+            num_row_groups > 1
+            and i < num_row_groups - 1
+            and i % log_every_n == 0
+            and last_updated_at is not None
+        ):
             LOGGER.info(
                 "Completed upsert #%s/%s for %s",
                 f"{i + 1:_}",
@@ -579,14 +941,16 @@ def import_parquet(
                 },
             )
 
+    if tracking_backend is not None:
+        tracking_backend.flush_import_progress()
+
+    if not submitted_all:
+        raise ShuttingDown("shutting down while waiting for a row group slot")
+
     file_size = path.getsize(local_file)
 
     # TODO: i'd like to emit this metric in the process_batch function, but I'm not sure how to get the size of the batch
-    statsd.increment(
-        "parquet_bytes_imported",
-        value=file_size,
-        tags=dd_tags,
-    )
+    meter.increment("parquet_bytes_imported", file_size, dd_tags)
 
     # TODO: datadog metrics here?
     if i is not None and num_row_groups == i + 1:
@@ -598,6 +962,7 @@ def import_parquet(
                 "table": table.name,
                 "file_name": str(local_file),
                 "num_row_groups": num_row_groups,
+                "skipped_row_groups": len(skipped_row_groups),
                 "num_rows": parquet_file.metadata.num_rows,
                 "file_size": file_size,
             },
@@ -618,12 +983,72 @@ def import_parquet(
         )
 
 
-def mark_completed(db_engine, parquet_import_tracking, completed_filenames):
+def drain_row_groups(
+    fs: list[futures.Future],
+    timeout_s: float,
+) -> tuple[int | None, int]:
+    """
+    Cancel the row groups that haven't started and give the running ones timeout_s
+    to finish.
+
+    Returns the last row group of the in-order prefix that finished (None if nothing
+    did) and how many row groups ran but can't be recorded.
+    Those are imported again after a restart. There are never more of them than row
+    group workers.
+    """
+    for f in fs:
+        f.cancel()
+
+    futures.wait(fs, timeout=timeout_s)
+
+    last_i = None
+    num_recorded = 0
+    for f in fs:
+        if not f.done() or f.cancelled() or f.exception() is not None:
+            break
+        last_i = f.result()[0]
+        num_recorded += 1
+
+    num_redo = sum(1 for f in fs[num_recorded:] if not f.cancelled())
+
+    return last_i, num_redo
+
+
+def row_group_done(progress_callback):
+    """
+    The row group is written. Shutting down must not turn that into a failure or it
+    would be imported again
+    """
+    try:
+        progress_callback(1)
+    except ShuttingDown:
+        pass
+
+
+def mark_completed(
+    db_engine,
+    parquet_import_tracking,
+    completed_filenames,
+    settings: Settings | None = None,
+):
     if not completed_filenames:
         return
 
     completed_filenames = [str(c) for c in completed_filenames]
 
+    tracking_backend = _tracking_backend(settings)
+
+    if tracking_backend is not None:
+        filenames_by_table = {}
+        for filename in completed_filenames:
+            table_name = parse_parquet_filename(filename)["table_name"]
+            filenames_by_table.setdefault(table_name, []).append(filename)
+
+        for table_name, filenames in filenames_by_table.items():
+            tracking_backend.mark_completed(filenames, table_name)
+
+        return
+
     stmt = (
         update(parquet_import_tracking)
         .where(parquet_import_tracking.c.file_name.in_(completed_filenames))
@@ -721,7 +1146,7 @@ def process_batch(
     parsed_filename,
     primary_key_columns,
     progress_callback,
-    row_filters,
+    row_filter,
     table,
     cu_metric: str | None,
     row_cu_cost: int,
@@ -729,8 +1154,57 @@ def process_batch(
     backfill_start_timestamp: int | None,
     backfill_end_timestamp: int | None,
     settings,
+    write_buffer=None,
+):
+    if settings is None:
+        performance = None
+    else:
+        # one controller per backend adapts the write batch size. import_parquet already
+        # waited for this row group's slot
+        performance = get_performance_manager(settings.database_backend, settings)
+
+    return _process_batch_for_backend(
+        dd_tags,
+        engine,
+        i,
+        npe_version,
+        parquet_file,
+        parsed_filename,
+        primary_key_columns,
+        progress_callback,
+        row_filter,
+        table,
+        cu_metric,
+        row_cu_cost,
+        filtered_row_cu_cost,
+        backfill_start_timestamp,
+        backfill_end_timestamp,
+        settings,
+        write_buffer,
+        performance,
+    )
+
+
+def _process_batch_for_backend(
+    dd_tags,
+    engine,
+    i,
+    npe_version,
+    parquet_file,
+    parsed_filename,
+    primary_key_columns,
+    progress_callback,
+    row_filter,
+    table,
+    cu_metric: str | None,
+    row_cu_cost: int,
+    filtered_row_cu_cost: int,
+    backfill_start_timestamp: int | None,
+    backfill_end_timestamp: int | None,
+    settings,
+    write_buffer,
+    performance,
 ):
-    
     # ZERO-COST PATH: If PostgreSQL or no settings, use existing logic directly
     if settings is None or settings.database_backend == "postgresql":
         return _process_batch_postgres(
@@ -742,13 +1216,15 @@ def process_batch(
             parsed_filename,
             primary_key_columns,
             progress_callback,
-            row_filters,
+            row_filter,
             table,
             cu_metric,
             row_cu_cost,
             filtered_row_cu_cost,
             backfill_start_timestamp,
             backfill_end_timestamp,
+            write_buffer,
+            performance,
         )
     
     # NEW PATH: Only for non-PostgreSQL backends
@@ -762,7 +1238,7 @@ def process_batch(
             parsed_filename,
             primary_key_columns,
             progress_callback,
-            row_filters,
+            row_filter,
             table,
             cu_metric,
             row_cu_cost,
@@ -773,6 +1249,127 @@ def process_batch(
         )
 
 
+def dedupe_primary_keys(batch: pa.Table, primary_key_names: list[str]) -> pa.Table:
+    """
+    Drop rows with duplicate primary keys, keeping the row with the newest `updated_at`.
+
+    Ties (and tables without `updated_at`) keep the row that came last in the batch.
+    The surviving rows stay in their original order.
+    Postgres refuses to upsert the same key twice in one statement, so this needs to
+    run on every batch.
+    """
+    num_rows = batch.num_rows
+    if num_rows < 2 or not primary_key_names:
+        return batch
+
+    sort_keys = [("__row_idx", "ascending")]
+    if "updated_at" in batch.column_names:
+        sort_keys.insert(0, ("updated_at", "ascending"))
+
+    columns = {}
+    for name in dict.fromkeys(primary_key_names + [k for k, _ in sort_keys[:-1]]):
+        column = batch.column(name)
+        if isinstance(column.type, pa.BaseExtensionType):
+            # group_by doesn't support extension types like arrow.uuid. their storage
+            # works fine
+            column = pa.chunked_array(
+                [chunk.storage for chunk in column.chunks],
+                column.type.storage_type,
+            )
+        columns[name] = column
+
+    indexed = pa.table(columns).append_column(
+        "__row_idx",
+        pa.array(range(num_rows), pa.int64()),
+    )
+
+    # after sorting, the row we want is the one with the largest position for each key
+    ordered = indexed.sort_by(sort_keys)
+    ordered = ordered.append_column(
+        "__sorted_idx",
+        pa.array(range(num_rows), pa.int64()),
+    )
+
+    keep = ordered.group_by(primary_key_names, use_threads=False).aggregate(
+        [("__sorted_idx", "max")],
+    )
+
+    if keep.num_rows == num_rows:
+        # no duplicates. this is the common case
+        return batch
+
+    keep_idx = ordered["__row_idx"].take(keep["__sorted_idx_max"])
+
+    return batch.take(keep_idx.sort())
+
+
+def group_rows_by_partition(rows, primary_key_columns):
+    """
+    Split rows into one list per monthly partition.
+
+    Partitioned tables (see POSTGRES_PARTITIONED_TABLES) have "timestamp" in their
+    primary key.
+    Sending each month as its own statement lets postgres route the whole insert to
+    a single partition.
+    Unpartitioned tables get all the rows back in one list.
+    """
+    if "timestamp" not in {pk_col.name for pk_col in primary_key_columns}:
+        return [rows]
+
+    partitions = {}
+    for row in rows:
+        ts = row["timestamp"]
+        partitions.setdefault((ts.year, ts.month), []).append(row)
+
+    return list(partitions.values())
+
+
+def upsert_rows(engine, table, primary_key_columns, rows, performance=None):
+    """
+    Insert or update rows. Rows are only updated if `updated_at` is newer than the
+    existing row.
+
+    With a performance manager, statements are sized by its adaptive batch size and
+    their latency is fed back to it.
+    """
+    if not rows:
+        return
+
+    row_keys = rows[0].keys()
+
+    # postgres has a maximum of 65535 parameters per statement
+    chunk_size = max(1, 65535 // len(row_keys))
+
+    if performance is not None:
+        chunk_size = min(chunk_size, performance.batch_size(table.name))
+
+    for partition_rows in group_rows_by_partition(rows, primary_key_columns):
+        for start in range(0, len(partition_rows), chunk_size):
+            # insert or update the rows
+            stmt = pg_insert(table).values(partition_rows[start : start + chunk_size])
+
+            # only upsert where updated_at is newer than the existing row
+            upsert_stmt = stmt.on_conflict_do_update(
+                index_elements=primary_key_columns,
+                set_={col: stmt.excluded[col] for col in row_keys},
+                where=(stmt.excluded["updated_at"] >= table.c.updated_at),
+            )
+
+            if performance is None:
+                execute_with_retry(engine, upsert_stmt)
+                continue
+
+            # the latency includes any retries. slow or flaky statements both shrink the
+            # batch size
+            started_at = time()
+            try:
+                execute_with_retry(engine, upsert_stmt)
+            except Exception:
+                performance.record_batch(table.name, time() - started_at, error=True)
+                raise
+            performance.record_batch(table.name, time() - started_at)
+
+
 def _process_batch_postgres(
     dd_tags,
     engine,
@@ -782,13 +1379,15 @@ def _process_batch_postgres(
     parsed_filename,
     primary_key_columns,
     progress_callback,
-    row_filters,
+    row_filter,
     table,
     cu_metric: str | None,
     row_cu_cost: int,
     filtered_row_cu_cost: int,
     backfill_start_timestamp: int | None,
     backfill_end_timestamp: int | None,
+    write_buffer=None,
+    performance=None,
 ):
     # This is too verbose
     # LOGGER.debug("starting batch #%s", i)
@@ -797,38 +1396,27 @@ def _process_batch_postgres(
     # TODO: postgres has a maximum item count of 65535! need to make sure split up the sql if its too big
     batch = parquet_file.read_row_group(i)
 
-    # TODO: detect tables that need deduping automatically. i think its any that have multiple primary key col
-    if table.name in ["profile_with_addresses"]:
-        # TODO: check that we are in the right schema too. this is only needed for farcaster.profile_with_addresses
-        # this view needs de-duping
-        data = batch.to_pydict()
-
-        # collect into a different dict so that we can remove dupes
-        rows = {
-            tuple(data[pk_col.name][i] for pk_col in primary_key_columns): {
-                col_name: data[col_name][i] for col_name in data
-            }
-            for i in range(len(batch))
-        }
-        # discard the keys
-        rows = list(rows.values())
-
-        # if len(batch) > len(rows):
-        #     LOGGER.debug(
-        #         "Dropped %s rows with duplicate primary keys",
-        #         len(batch) - len(rows),
-        #     )
-    else:
-        # Direct conversion to Python-native types for sqlalchemy
-        # TODO: this is probably making this way slower than necessary. im sure there are libraries to do this faster. df -> postgres
-        rows = batch.to_pylist()
+    # some tables (like farcaster.profile_with_addresses) have the same primary key
+    # multiple times in one row group
+    batch = dedupe_primary_keys(batch, [pk_col.name for pk_col in primary_key_columns])
+
+    # the table's conversion plan was built from its postgres columns the first time
+    # this schema was seen
+    codec = get_row_codec(table, batch.schema)
+
+    meter = get_meter()
 
     # make sure we aren't passing timestamps in for direct_import or main call-ins
-    if row_filters or backfill_start_timestamp is not None or backfill_end_timestamp is not None:
+    needs_filter = row_filter is not None
+
+    # filters see the raw parquet values. only the rows that pass are decoded
+    rows = codec.to_rows(batch, decode=not needs_filter)
+
+    if needs_filter:
         orig_rows_len = len(rows)
 
         # TODO: check versions of the filters. we might want to support graphql or other formats in the near future
-        rows = list(filter(lambda row: include_row(row, row_filters, backfill_start_timestamp, backfill_end_timestamp), rows))
+        rows = list(filter(row_filter, rows))
 
         rows_len = len(rows)
 
@@ -848,49 +1436,28 @@ def _process_batch_postgres(
             extra["cu_cost"] = cu_cost
 
             # TODO: add another tag that shows that this is for filtered data?
-            statsd.increment(
-                cu_metric,
-                value=cu_cost,
-                tags=dd_tags,
-            )
+            meter.increment(cu_metric, cu_cost, dd_tags)
 
         LOGGER.debug("filtered", extra=extra)
 
-        statsd.increment(
-            "num_parquet_rows_filtered",
-            value=filtered_rows,
-            tags=dd_tags,
-        )
+        meter.increment("num_parquet_rows_filtered", filtered_rows, dd_tags)
 
     else:
         rows_len = len(rows)
         filtered_rows = 0
 
     if rows:
-        row_keys = rows[0].keys()
-
-        # TODO: i don't love this. parquet apply things will be much faster. but we already turned it into a python object. will require a larger refactor
-        # loop col_names first and only call clean on ones that need changes
-        for col_name in row_keys:
-            col = table.c[col_name]
-
-            if isinstance(col.type, JSONB):
-                for row in rows:
-                    row[col_name] = clean_jsonb_data(col_name, row[col_name])
+        if needs_filter:
+            codec.decode_rows(rows)
 
         # TODO: use Abstract Base Classes to make this easy to extend/transform
 
-        # insert or update the rows
-        stmt = pg_insert(table).values(rows)
-
-        # only upsert where updated_at is newer than the existing row
-        upsert_stmt = stmt.on_conflict_do_update(
-            index_elements=primary_key_columns,
-            set_={col: stmt.excluded[col] for col in row_keys},
-            where=(stmt.excluded["updated_at"] >= table.c.updated_at),
-        )
-
-        execute_with_retry(engine, upsert_stmt)
+        if write_buffer is None:
+            upsert_rows(engine, table, primary_key_columns, rows, performance)
+        else:
+            # the buffer keeps only the newest version of each row and upserts them
+            # later
+            write_buffer.add(rows)
 
     now = time()
 
@@ -915,13 +1482,9 @@ def _process_batch_postgres(
             },
         )
 
-    statsd.gauge("parquet_file_age_s", file_age_s, tags=dd_tags)
-    statsd.gauge("parquet_row_age_s", row_age_s, tags=dd_tags)
-    statsd.increment(
-        "num_parquet_rows_imported",
-        value=rows_len,
-        tags=dd_tags,
-    )
+    meter.gauge("parquet_file_age_s", file_age_s, dd_tags)
+    meter.gauge("parquet_row_age_s", row_age_s, dd_tags)
+    meter.increment("num_parquet_rows_imported", rows_len, dd_tags)
 
     # we only calculate the cost here if row filtering is not applied
     if cu_metric and row_cu_cost > 0:
@@ -929,13 +1492,9 @@ def _process_batch_postgres(
 
         logging.debug("cu_cost", extra={"cu_cost": cu_cost, "num_rows": rows_len})
 
-        statsd.increment(
-            cu_metric,
-            value=cu_cost,
-            tags=dd_tags,
-        )
+        meter.increment(cu_metric, cu_cost, dd_tags)
 
-    progress_callback(1)
+    row_group_done(progress_callback)
 
     # TODO: better return type for this so we don't mix up values
     # TODO: include the cu cost and filtered rows in this?
@@ -951,7 +1510,7 @@ def _process_batch_with_transformation(
     parsed_filename,
     primary_key_columns,
     progress_callback,
-    row_filters,
+    row_filter,
     table,
     cu_metric: str | None,
     row_cu_cost: int,
@@ -965,22 +1524,19 @@ def _process_batch_with_transformation(
     from time import time
     from datetime import UTC, datetime
     
-    # Get backend and transformer
-    backend = DatabaseFactory.create_backend(settings)
-    transformer = DatabaseFactory.create_transformer(settings)
+    # Get the shared backend and transformer. They are only initialized once per process
+    backend = DatabaseFactory.get_backend(settings, [table.name])
+    transformer = DatabaseFactory.get_transformer(settings)
+    meter = get_meter()
     
-    # Initialize the backend with connection parameters
-    backend.init_db(None, [table.name], settings)  # Neo4j doesn't use the URI parameter, it uses settings
-    
-    # Convert PyArrow batch to rows (existing logic)
     batch = parquet_file.read_row_group(i)
-    rows = batch.to_pylist()
+    batch = dedupe_primary_keys(batch, [pk_col.name for pk_col in primary_key_columns])
     
-    # Apply row filters (existing logic)
-    if row_filters or backfill_start_timestamp is not None or backfill_end_timestamp is not None:
-        orig_rows_len = len(rows)
-        rows = list(filter(lambda row: include_row(row, row_filters, backfill_start_timestamp, backfill_end_timestamp), rows))
-        rows_len = len(rows)
+    # Apply row filters as a mask so the batch stays columnar
+    if row_filter is not None:
+        orig_rows_len = batch.num_rows
+        batch = filter_batch(batch, row_filter, parquet_file.filter_columns)
+        rows_len = batch.num_rows
         filtered_rows = orig_rows_len - rows_len
         
         # Log filtered rows
@@ -993,44 +1549,46 @@ def _process_batch_with_transformation(
         if cu_metric:
             cu_cost = orig_rows_len * filtered_row_cu_cost
             extra["cu_cost"] = cu_cost
-            statsd.increment(cu_metric, value=cu_cost, tags=dd_tags)
+            meter.increment(cu_metric, cu_cost, dd_tags)
         
         LOGGER.debug("filtered", extra=extra)
-        statsd.increment("num_parquet_rows_filtered", value=filtered_rows, tags=dd_tags)
+        meter.increment("num_parquet_rows_filtered", filtered_rows, dd_tags)
     else:
-        rows_len = len(rows)
+        rows_len = batch.num_rows
     
-    # Transform rows to operations
-    operations = transformer.transform_table(table.name, rows)
-    
-    # Execute via backend
-    backend.import_operations(operations)
+    if backend.accepts_arrow:
+        # columnar backends take the batch as it is
+        backend.import_arrow(table.name, batch)
+    else:
+        # Transform the columns straight into operations. No dict or ImportOperation is
+        # created per row
+        operations = transformer.transform_batch(table.name, batch)
+        
+        # Execute via backend
+        backend.import_columnar(operations, table.name)
     
     # Calculate metrics (similar to original)
     now = time()
     file_age_s = now - parsed_filename["end_timestamp"]
     
-    if rows:
+    last_updated_at = None
+    if rows_len and "updated_at" in batch.column_names:
         # Try to get updated_at from the last row, fallback to timestamp
-        last_row = rows[-1]
-        if "updated_at" in last_row and last_row["updated_at"]:
-            last_updated_at = last_row["updated_at"]
-        else:
-            last_updated_at = datetime.fromtimestamp(parsed_filename["end_timestamp"], UTC)
-    else:
+        last_updated_at = batch.column("updated_at")[-1].as_py()
+    if not last_updated_at:
         last_updated_at = datetime.fromtimestamp(parsed_filename["end_timestamp"], UTC)
     
     row_age_s = now - last_updated_at.timestamp()
     
     # Record metrics
-    statsd.gauge("parquet_file_age_s", file_age_s, tags=dd_tags)
-    statsd.gauge("parquet_row_age_s", row_age_s, tags=dd_tags)
-    statsd.increment("num_parquet_rows_imported", value=rows_len, tags=dd_tags)
+    meter.gauge("parquet_file_age_s", file_age_s, dd_tags)
+    meter.gauge("parquet_row_age_s", row_age_s, dd_tags)
+    meter.increment("num_parquet_rows_imported", rows_len, dd_tags)
     
     if cu_metric and row_cu_cost > 0:
         cu_cost = rows_len * row_cu_cost
-        statsd.increment(cu_metric, value=cu_cost, tags=dd_tags)
+        meter.increment(cu_metric, cu_cost, dd_tags)
     
-    progress_callback(1)
+    row_group_done(progress_callback)
     
     return (i, file_age_s, row_age_s, last_updated_at)
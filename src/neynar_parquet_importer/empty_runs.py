@@ -0,0 +1,337 @@
+"""
+Compact runs of `.empty` incrementals into one tracking row.
+
+With 1 second v3 files, most incrementals on quiet tables are empty. A tracking row for
+every one of them adds ~86k rows per table per day.
+Instead, consecutive empty files are recorded as one range row. The row is named like a
+file that covers the whole run: `{schema}-{table}-{start}-{end}.empty`.
+Resuming only needs the end_timestamp of the newest completed row, so ranges work
+without any changes to the queries.
+
+Range rows are only written for files that are completed in order. Files that are still
+in the write buffer always come first.
+"""
+
+from datetime import UTC, datetime
+from pathlib import Path
+from time import time
+
+from sqlalchemy import Table, delete, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .db import (
+    _tracking_backend,
+    execute_with_retry,
+    fetchone_with_retry,
+    mark_completed,
+)
+from .logger import LOGGER
+from .metering import get_meter
+from .s3 import parse_parquet_filename
+from .settings import Settings
+
+
+def is_empty_file(filename) -> bool:
+    return str(filename).endswith(".empty")
+
+
+def empty_range_file_name(
+    settings: Settings,
+    table: Table,
+    start_timestamp: int,
+    end_timestamp: int,
+) -> str:
+    """
+    Range rows are named like the local path of an empty file that covers the whole
+    range
+    """
+    name = (
+        f"{settings.parquet_s3_schema}-{table.name}"
+        f"-{start_timestamp}-{end_timestamp}.empty"
+    )
+    return str(Path(settings.target_dir(), name))
+
+
+class EmptyRun:
+    """The current run of consecutive empty incrementals for one table"""
+
+    def __init__(
+        self,
+        engine,
+        table: Table,
+        parquet_import_tracking: Table,
+        settings: Settings,
+    ):
+        self.engine = engine
+        self.table = table
+        self.parquet_import_tracking = parquet_import_tracking
+        self.settings = settings
+
+        self.dd_tags = [
+            f"parquet_table:{settings.parquet_s3_schema}.{table.name}",
+            f"path:parquet-importer/{settings.parquet_s3_schema}.{table.name}",
+        ]
+
+        self.start_timestamp = None
+        self.end_timestamp = None
+        # the postgres row for this run. it is extended in place
+        self.tracking_id = None
+        self.recorded_end_timestamp = None
+        self.recorded_at = time()
+
+    def file_name(self) -> str:
+        return empty_range_file_name(
+            self.settings,
+            self.table,
+            self.start_timestamp,
+            self.end_timestamp,
+        )
+
+    def add(self, filename) -> bool:
+        """
+        Add a completed file to the run. Returns False for files with rows.
+        Those end the run
+        """
+        if not is_empty_file(filename):
+            self.end()
+            return False
+
+        parsed_filename = parse_parquet_filename(filename)
+
+        if (
+            self.end_timestamp is not None
+            and parsed_filename["start_timestamp"] != self.end_timestamp
+        ):
+            # files are completed in order so this shouldn't happen. but a range must
+            # never cover a file that wasn't imported
+            self.end()
+
+        if self.start_timestamp is None:
+            self.start_timestamp = parsed_filename["start_timestamp"]
+        self.end_timestamp = parsed_filename["end_timestamp"]
+
+        return True
+
+    def record_if_due(self):
+        if time() - self.recorded_at >= self.settings.empty_run_record_s:
+            self.record()
+
+    def end(self):
+        """Record the run and start a new one"""
+        self.record()
+
+        self.start_timestamp = None
+        self.end_timestamp = None
+        self.tracking_id = None
+        self.recorded_end_timestamp = None
+
+    def record(self):
+        """Save the run's progress to the tracking table"""
+        self.recorded_at = time()
+
+        if (
+            self.end_timestamp is None
+            or self.end_timestamp == self.recorded_end_timestamp
+        ):
+            return
+
+        file_name = self.file_name()
+
+        tracking_backend = _tracking_backend(self.settings)
+
+        if tracking_backend is not None:
+            # graph tracking can't rename a node. every record gets its own range and
+            # the next range starts where this one ended
+            tracking_backend.start_file_import(
+                self.table.name,
+                file_name,
+                "incremental",
+                self.end_timestamp,
+                True,
+                0,
+                False,
+                self.settings,
+            )
+            mark_completed(
+                self.engine,
+                self.parquet_import_tracking,
+                [file_name],
+                settings=self.settings,
+            )
+            self.start_timestamp = None
+        elif self.tracking_id is None:
+            stmt = pg_insert(self.parquet_import_tracking).values(
+                table_name=self.table.name,
+                file_name=file_name,
+                file_type="incremental",
+                file_version=self.settings.npe_version,
+                file_duration_s=self.settings.incremental_duration,
+                end_timestamp=self._end_timestamp_dt(),
+                is_empty=True,
+                last_row_group_imported=None,
+                total_row_groups=0,
+                backfill=False,
+                completed=True,
+            )
+
+            row = fetchone_with_retry(
+                self.engine,
+                stmt.on_conflict_do_update(
+                    index_elements=["file_name"],
+                    set_={"completed": True},
+                ).returning(self.parquet_import_tracking.c.id),
+            )
+
+            self.tracking_id = row.id
+        else:
+            execute_with_retry(
+                self.engine,
+                update(self.parquet_import_tracking)
+                .where(self.parquet_import_tracking.c.id == self.tracking_id)
+                .values(file_name=file_name, end_timestamp=self._end_timestamp_dt()),
+            )
+
+        self.recorded_end_timestamp = self.end_timestamp
+
+        # same gauges as importing an empty file. once per record instead of once per
+        # file
+        file_age_s = time() - self.end_timestamp
+        meter = get_meter()
+        meter.gauge("parquet_file_age_s", file_age_s, self.dd_tags)
+        meter.gauge("parquet_row_age_s", file_age_s, self.dd_tags)
+
+    def _end_timestamp_dt(self):
+        return datetime.fromtimestamp(self.end_timestamp, UTC)
+
+
+def compact_empty_tracking(
+    engine,
+    parquet_import_tracking: Table,
+    table: Table,
+    settings: Settings,
+    before_timestamp: int,
+    batch_size: int = 10_000,
+) -> int:
+    """
+    Merge existing runs of completed empty incrementals that end before
+    before_timestamp into range rows.
+
+    Rows are read in end_timestamp order, batch_size at a time. The merges of each
+    batch (insert the ranges, delete the files) are one transaction.
+    Returns how many rows were removed.
+    """
+    t = parquet_import_tracking
+
+    before_dt = datetime.fromtimestamp(before_timestamp, UTC)
+
+    num_removed = 0
+    after_dt = None
+
+    # (id, start, end) of the current run. a run can continue into the next batch
+    run = []
+    # finished runs that haven't been written yet
+    merges = []
+
+    def end_run():
+        nonlocal run
+
+        if len(run) > 1:
+            merges.append(run)
+        run = []
+
+    def write_merges():
+        nonlocal num_removed
+
+        if not merges:
+            return
+
+        ranges = [
+            dict(
+                table_name=table.name,
+                file_name=empty_range_file_name(
+                    settings,
+                    table,
+                    merge[0][1],
+                    merge[-1][2],
+                ),
+                file_type="incremental",
+                file_version=settings.npe_version,
+                file_duration_s=settings.incremental_duration,
+                end_timestamp=datetime.fromtimestamp(merge[-1][2], UTC),
+                is_empty=True,
+                last_row_group_imported=None,
+                total_row_groups=0,
+                backfill=False,
+                completed=True,
+            )
+            for merge in merges
+        ]
+        ids = [row[0] for merge in merges for row in merge]
+
+        with engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.id.in_(ids)))
+            conn.execute(insert(t), ranges)
+
+        num_removed += len(ids) - len(ranges)
+        merges.clear()
+
+    while True:
+        stmt = (
+            select(t.c.id, t.c.file_name, t.c.end_timestamp, t.c.is_empty)
+            .where(t.c.table_name == table.name)
+            .where(t.c.file_type == "incremental")
+            .where(t.c.file_version == settings.npe_version)
+            .where(t.c.file_duration_s == settings.incremental_duration)
+            .where(t.c.backfill.is_(False))
+            # unfinished files leave a gap in the run. that breaks it just like a file
+            # with rows does
+            .where(t.c.completed.is_(True))
+            .where(t.c.end_timestamp < before_dt)
+            .order_by(t.c.end_timestamp)
+            .limit(batch_size)
+        )
+        if after_dt is not None:
+            stmt = stmt.where(t.c.end_timestamp > after_dt)
+
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).fetchall()
+
+        if not rows:
+            break
+
+        for row in rows:
+            parsed_filename = parse_parquet_filename(row.file_name)
+
+            if not row.is_empty:
+                # a file with rows breaks the run
+                end_run()
+                continue
+
+            if run and parsed_filename["start_timestamp"] != run[-1][2]:
+                end_run()
+
+            run.append(
+                (
+                    row.id,
+                    parsed_filename["start_timestamp"],
+                    parsed_filename["end_timestamp"],
+                ),
+            )
+
+        write_merges()
+
+        after_dt = rows[-1].end_timestamp
+
+        if len(rows) < batch_size:
+            break
+
+    end_run()
+    write_merges()
+
+    if num_removed:
+        LOGGER.info(
+            "compacted empty incrementals",
+            extra={"table": table.name, "num_removed": num_removed},
+        )
+
+    return num_removed
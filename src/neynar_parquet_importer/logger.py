@@ -1,7 +1,11 @@
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import PosixPath
-from datetime import datetime, timedelta, UTC
-from pythonjsonlogger import json as jsonlogger
+from datetime import datetime, UTC
+from queue import SimpleQueue
+import orjson
 from rich.logging import RichHandler
 from pprint import pformat
 
@@ -33,21 +37,100 @@ RESERVED_ATTRS = [
 ]
 
 
-class CustomJsonFormatter(jsonlogger.JsonFormatter):
-    """Basic fields from <https://pypi.org/project/python-json-logger/>."""
+# fields of a LogRecord that aren't extras. taskName is new in python 3.12
+RECORD_ATTRS = frozenset(RESERVED_ATTRS) | {"taskName"}
 
-    def add_fields(self, log_record, record, message_dict):
-        super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
-        if not log_record.get("timestamp"):
-            timestamp = datetime.fromtimestamp(record.created, UTC)
-            timestamp = timestamp + timedelta(microseconds=record.msecs)
 
-            # TODO: what format?
-            log_record["timestamp"] = timestamp
-        if log_record.get("level"):
-            log_record["level"] = log_record["level"].upper()
-        else:
-            log_record["level"] = record.levelname
+def json_default(v):
+    if isinstance(v, (set, frozenset)):
+        return list(v)
+
+    return str(v)
+
+
+class CustomJsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. Serialized with orjson instead of building the record
+    field by field
+    """
+
+    def format(self, record):
+        log_record = {
+            "timestamp": datetime.fromtimestamp(record.created, UTC),
+            "level": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+        }
+
+        for k, v in record.__dict__.items():
+            if k not in RECORD_ATTRS:
+                log_record[k] = v
+
+        if record.exc_info:
+            log_record["exc_info"] = self.formatException(record.exc_info)
+
+        if record.stack_info:
+            log_record["stack_info"] = self.formatStack(record.stack_info)
+
+        return orjson.dumps(
+            log_record,
+            default=json_default,
+            option=orjson.OPT_NON_STR_KEYS,
+        ).decode()
+
+
+class DebugRateLimit(logging.Filter):
+    """At most `per_s` DEBUG records per second from each line of code
+
+    Hot loops log at DEBUG for every row group. The records that are dropped are
+    counted and the next one from that line says how many.
+    INFO and above always pass.
+    """
+
+    def __init__(self, per_s: float):
+        super().__init__()
+        self.per_s = per_s
+        # (pathname, lineno) -> [second, passed, suppressed]. a lost update only
+        # miscounts one record
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+
+        site = self._sites.get(key)
+        if site is None or site[0] != second:
+            if site is not None and site[2]:
+                record.suppressed = site[2]
+            self._sites[key] = [second, 1, 0]
+            return True
+
+        if site[1] < self.per_s:
+            site[1] += 1
+            return True
+
+        site[2] += 1
+        return False
+
+
+class ImporterQueueHandler(QueueHandler):
+    """
+    Put records on a queue. The listener's thread formats and writes them so
+    importer threads never wait on the terminal
+    """
+
+    def prepare(self, record):
+        # the message is rendered now because args might change before the listener gets
+        # to it
+        # the handler on the other side does all the formatting, so unlike QueueHandler
+        # this keeps exc_info and the extras as they are
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
 
 def format_field(v):
@@ -82,28 +165,55 @@ class CustomRichHandler(RichHandler):
         super().emit(record)
 
 
-def setup_logging(level: str, log_format: str):
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def stop_logging():
+    """Write everything that is still queued and stop the listener's thread"""
+    global _listener
+
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def setup_logging(level: str, log_format: str, debug_per_s: float = 0):
+    global _listener
+
     level_value = getattr(logging, level.upper(), None)
 
     assert level_value is not None, f"Invalid log level: {level}"
 
     if log_format == "json":
-        format = "%(message)s"
-        formatter = CustomJsonFormatter("%(timestamp)s %(level)s %(name)s %(message)s")
-
         logHandler = logging.StreamHandler()
-        logHandler.setFormatter(formatter)
+        logHandler.setFormatter(CustomJsonFormatter())
     elif log_format == "rich":
-        format = "%(name)s - %(message)s"
         logHandler = CustomRichHandler(rich_tracebacks=True)
+        logHandler.setFormatter(
+            logging.Formatter("%(name)s - %(message)s", datefmt="%X"),
+        )
     else:
         raise ValueError(f"Invalid log format: {log_format}")
 
+    # setting up again replaces the old listener. anything it had queued is written
+    # first
+    stop_logging()
+
+    queue = SimpleQueue()
+
+    queueHandler = ImporterQueueHandler(queue)
+    if debug_per_s > 0:
+        queueHandler.addFilter(DebugRateLimit(debug_per_s))
+
+    with _listener_lock:
+        _listener = QueueListener(queue, logHandler, respect_handler_level=True)
+        _listener.start()
+
     logging.basicConfig(
-        datefmt="%X",
         force=True,
-        format=format,
-        handlers=[logHandler],
+        handlers=[queueHandler],
         level=level_value,
     )
 
@@ -113,3 +223,6 @@ def setup_logging(level: str, log_format: str):
 
     # # TODO: make this configurable
     # logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
+
+atexit.register(stop_logging)
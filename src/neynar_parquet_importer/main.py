@@ -1,11 +1,10 @@
-import orjson
 import logging
 import os
 import signal
 import sys
 import threading
 import time
-from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed, wait
 from contextlib import ExitStack
 import traceback
 import dotenv
@@ -20,23 +19,33 @@ from rich.progress import (
 )
 from rich.table import Table
 
+from .backfill import backfill_file, plan_backfill
+from .database.factory import DatabaseFactory
+from .empty_runs import EmptyRun, compact_empty_tracking, is_empty_file
+from .metering import get_meter
 from .progress import ProgressCallback
+from .row_filters import FilterWatcher
 from .db import (
     check_for_past_full_import,
     check_for_past_incremental_import,
+    create_upcoming_partitions,
+    get_non_postgres_tables,
     get_tables,
     import_parquet,
     init_db,
     mark_completed,
     maximum_parquet_age,
+    partition_maintenance_loop,
 )
 from .s3 import (
     download_incremental,
     download_latest_full,
     get_s3_client,
+    list_incrementals,
     parse_parquet_filename,
 )
-from .settings import SHUTDOWN_EVENT, Settings, ShuttingDown
+from .settings import SHUTDOWN_EVENT, Settings, ShuttingDown, drain_time_left
+from .write_buffer import WriteCombiningBuffer
 
 LOGGER = logging.getLogger("app")
 
@@ -110,6 +119,7 @@ def sync_parquet_to_db(
     row_filters,
     settings: Settings,
     f_shutdown,
+    filter_watcher: FilterWatcher | None = None,
 ):
     """Function that runs forever (barring exceptions) to download and import parquet files for a table.
 
@@ -124,6 +134,30 @@ def sync_parquet_to_db(
     )
 
     completed_filenames = []
+
+    # incremental imports that are running. in order of their timestamps
+    fs = []
+
+    # incrementals that are imported into the write buffer but might not be flushed yet
+    buffered_filenames = []
+    if (
+        settings.write_combine_max_rows > 0
+        and settings.database_backend == "postgresql"
+    ):
+        write_buffer = WriteCombiningBuffer(
+            db_engine,
+            table,
+            parquet_import_tracking,
+            settings,
+        )
+    else:
+        write_buffer = None
+
+    if settings.empty_run_compaction:
+        empty_run = EmptyRun(db_engine, table, parquet_import_tracking, settings)
+    else:
+        empty_run = None
+
     try:
         last_import_filename = None
 
@@ -196,7 +230,10 @@ def sync_parquet_to_db(
                 backfill=False,
             )
 
-            if incremental_filename:
+            if incremental_filename and is_empty_file(incremental_filename):
+                # empty files (and ranges of them) have nothing to resume
+                last_import_filename = incremental_filename
+            elif incremental_filename:
                 # if we have imported an incremental. we should start there instead of at the full
                 if not os.path.exists(incremental_filename):
                     last_start_timestamp = parse_parquet_filename(incremental_filename)[
@@ -211,6 +248,7 @@ def sync_parquet_to_db(
                         last_start_timestamp,
                         progress_callbacks["incremental_bytes"],
                         progress_callbacks["empty_steps"],
+                        row_filters=row_filters,
                     )
 
                 if incremental_filename:
@@ -233,7 +271,10 @@ def sync_parquet_to_db(
                     last_import_filename = incremental_filename
 
                     mark_completed(
-                        db_engine, parquet_import_tracking, [incremental_filename]
+                        db_engine,
+                        parquet_import_tracking,
+                        [incremental_filename],
+                        settings=settings,
                     )
                 else:
                     # TODO: need an option to force a new full
@@ -260,6 +301,7 @@ def sync_parquet_to_db(
                     settings,
                     table,
                     progress_callbacks["full_bytes"],
+                    row_filters=row_filters,
                 )
 
             import_parquet(
@@ -278,7 +320,12 @@ def sync_parquet_to_db(
                 backfill_end_timestamp=None,
             )
 
-            mark_completed(db_engine, parquet_import_tracking, [full_filename])
+            mark_completed(
+                db_engine,
+                parquet_import_tracking,
+                [full_filename],
+                settings=settings,
+            )
             full_completed = True
             last_import_filename = full_filename
 
@@ -298,8 +345,36 @@ def sync_parquet_to_db(
 
         max_wait_duration = max(90, 4 * settings.incremental_duration)
 
+        if (
+            empty_run is not None
+            and last_import_filename is not None
+            and db_engine is not None
+        ):
+            # merge the rows that older versions wrote for every empty file. new runs
+            # are already compacted
+            threading.Thread(
+                target=compact_empty_tracking_job,
+                args=(
+                    db_engine,
+                    parquet_import_tracking,
+                    table,
+                    settings,
+                    next_start_timestamp,
+                ),
+                name=f"{table.name}Compact",
+                daemon=True,
+            ).start()
+
+        # while behind, the catch-up planner lists the backlog in bulk instead of
+        # probing for one file at a time
+        # start timestamp -> s3 object. planned_until is the end of the listed range
+        planned_objects = {}
+        planned_until = next_start_timestamp
+
+        # a new version of the filters applies to the next file that starts
+        filters_version = filter_watcher.version if filter_watcher is not None else None
+
         # download all the incrementals. loops forever
-        fs = []
         while not SHUTDOWN_EVENT.is_set():
             # mark files completed in order. this keeps us from skipping items if we have to restart
             while fs:
@@ -311,7 +386,12 @@ def sync_parquet_to_db(
                     if incremental_filename is None:
                         raise ShuttingDown("incremental_filename is None")
 
-                    completed_filenames.append(incremental_filename)
+                    if write_buffer is None:
+                        completed_filenames.append(incremental_filename)
+                    else:
+                        buffered_filenames.append(
+                            (write_buffer.sequence(), incremental_filename),
+                        )
 
                     # LOGGER.debug(
                     #     "queued completion",
@@ -334,9 +414,33 @@ def sync_parquet_to_db(
                     #         extra={"f": fs[0]},
                     #     )
 
-            mark_completed(db_engine, parquet_import_tracking, completed_filenames)
+            if write_buffer is not None:
+                write_buffer.flush_if_due()
+
+                # files are only complete once all of their rows are flushed
+                while (
+                    buffered_filenames
+                    and buffered_filenames[0][0] <= write_buffer.flushed_sequence
+                ):
+                    completed_filenames.append(buffered_filenames.pop(0)[1])
+
+            if empty_run is not None:
+                # empty files extend the current run instead of getting their own rows
+                completed_filenames = [
+                    f for f in completed_filenames if not empty_run.add(f)
+                ]
+
+            mark_completed(
+                db_engine,
+                parquet_import_tracking,
+                completed_filenames,
+                settings=settings,
+            )
             completed_filenames.clear()
 
+            if empty_run is not None:
+                empty_run.record_if_due()
+
             # sleep until the next file is ready. plus a 1 second buffer
             sleep_amount = max(
                 0,
@@ -347,9 +451,82 @@ def sync_parquet_to_db(
                 # sleep a maximum of one second since we should loop to see if tasks are done
                 sleep_amount = min(1, sleep_amount)
 
+            if write_buffer is not None:
+                sleep_amount = min(settings.write_combine_window_s, sleep_amount)
+
             if SHUTDOWN_EVENT.wait(sleep_amount):
                 raise ShuttingDown("shutting down sync_parquet_to_db", table.name)
 
+            if (
+                settings.catch_up_max_files > 0
+                and not settings.local_input_only
+                and next_start_timestamp >= planned_until
+                and next_start_timestamp + 2 * settings.incremental_duration
+                < time.time()
+            ):
+                # more than one file behind. list everything that should exist by now
+                planned_objects = list_incrementals(
+                    s3_client,
+                    settings,
+                    table,
+                    next_start_timestamp,
+                    int(time.time()) - settings.incremental_duration,
+                    settings.catch_up_max_files,
+                )
+
+                if len(planned_objects) >= settings.catch_up_max_files:
+                    planned_until = max(planned_objects) + settings.incremental_duration
+                else:
+                    planned_until = int(time.time()) - settings.incremental_duration
+
+                LOGGER.info(
+                    "catching up",
+                    extra={
+                        "table": table.name,
+                        "start_timestamp": next_start_timestamp,
+                        "planned_until": planned_until,
+                        "num_files": len(planned_objects),
+                    },
+                )
+
+            if filter_watcher is not None and filter_watcher.version != filters_version:
+                filters_version = filter_watcher.version
+                new_row_filters = filter_watcher.get(table.name)
+
+                if new_row_filters != row_filters:
+                    row_filters = new_row_filters
+
+                    LOGGER.info(
+                        "filters changed",
+                        extra={
+                            "table": table.name,
+                            "version": filters_version,
+                            "next_start_timestamp": next_start_timestamp,
+                        },
+                    )
+
+                    if settings.filter_reload_backfill_s > 0:
+                        # rows that the old filters skipped. the live import continues
+                        # meanwhile
+                        threading.Thread(
+                            target=backfill_filters_job,
+                            args=(
+                                db_engine,
+                                download_threadpool,
+                                s3_client,
+                                table,
+                                parquet_import_tracking,
+                                row_group_executor,
+                                row_filters,
+                                settings,
+                                f_shutdown,
+                                progress_callbacks,
+                                next_start_timestamp,
+                            ),
+                            name=f"{table.name}FilterBackfill",
+                            daemon=True,
+                        ).start()
+
             # spawn a task on file_executor here
             f = file_executor.submit(
                 download_and_import_incremental_parquet,
@@ -365,6 +542,9 @@ def sync_parquet_to_db(
                 row_filters,
                 settings,
                 f_shutdown,
+                write_buffer,
+                # files that the planner didn't find fall back to polling
+                planned_objects.pop(next_start_timestamp, None),
             )
             fs.append(f)
 
@@ -387,6 +567,54 @@ def sync_parquet_to_db(
         SHUTDOWN_EVENT.set()
         raise
     finally:
+        if fs:
+            # give the running imports a chance to finish. the file workers stop between
+            # row groups
+            wait(fs, timeout=drain_time_left(settings.shutdown_drain_timeout_s))
+
+            # only the in-order prefix can be marked completed. anything after a gap is
+            # imported again
+            for f in fs:
+                if not f.done() or f.cancelled() or f.exception() is not None:
+                    break
+
+                incremental_filename = f.result()
+                if incremental_filename is None:
+                    break
+
+                if write_buffer is None:
+                    completed_filenames.append(incremental_filename)
+                else:
+                    buffered_filenames.append(
+                        (write_buffer.sequence(), incremental_filename),
+                    )
+
+        if write_buffer is not None:
+            try:
+                write_buffer.flush()
+            except Exception:
+                LOGGER.exception(
+                    "failed to flush the write buffer",
+                    extra={"table": table.name},
+                )
+
+            for sequence, buffered_filename in buffered_filenames:
+                if sequence <= write_buffer.flushed_sequence:
+                    completed_filenames.append(buffered_filename)
+
+        if empty_run is not None:
+            completed_filenames = [
+                f for f in completed_filenames if not empty_run.add(f)
+            ]
+
+            try:
+                empty_run.record()
+            except Exception:
+                LOGGER.exception(
+                    "failed to record the empty run",
+                    extra={"table": table.name},
+                )
+
         # don't lose any progress
         if completed_filenames:
             LOGGER.info(
@@ -397,13 +625,119 @@ def sync_parquet_to_db(
                     "num_files": len(completed_filenames),
                 },
             )
-            mark_completed(db_engine, parquet_import_tracking, completed_filenames)
+            mark_completed(
+                db_engine,
+                parquet_import_tracking,
+                completed_filenames,
+                settings=settings,
+            )
             completed_filenames.clear()
 
         # this should run forever. any exit here means we should shut down the whole app
         SHUTDOWN_EVENT.set()
 
 
+def compact_empty_tracking_job(
+    db_engine,
+    parquet_import_tracking,
+    table,
+    settings: Settings,
+    before_timestamp,
+):
+    try:
+        compact_empty_tracking(
+            db_engine,
+            parquet_import_tracking,
+            table,
+            settings,
+            before_timestamp,
+        )
+    except Exception:
+        # the rows are only bigger than they need to be. this isn't worth stopping the
+        # import for
+        LOGGER.exception(
+            "failed to compact empty incrementals",
+            extra={"table": table.name},
+        )
+
+
+def backfill_filters_job(
+    db_engine,
+    download_threadpool,
+    s3_client,
+    table,
+    parquet_import_tracking,
+    row_group_executor,
+    row_filters,
+    settings: Settings,
+    f_shutdown,
+    progress_callbacks,
+    end_timestamp: int,
+):
+    """
+    Re-import the last FILTER_RELOAD_BACKFILL_S seconds of a table's incrementals
+    with its new filters
+    """
+    start_timestamp = end_timestamp - settings.filter_reload_backfill_s
+
+    # a separate directory means separate tracking rows. the live importer's rows for
+    # the same files aren't touched
+    settings = settings.model_copy(
+        update={
+            "local_input_dir": settings.local_input_dir
+            / "backfill"
+            / f"filters-{start_timestamp}-{end_timestamp}",
+        },
+    )
+
+    backfill_callbacks = {
+        **progress_callbacks,
+        "steps": progress_callbacks["incremental_steps"],
+    }
+
+    try:
+        plan = plan_backfill(s3_client, settings, table, start_timestamp, end_timestamp)
+
+        num_rows = 0
+        for file_type, s3_object, window_start, window_end in plan:
+            if SHUTDOWN_EVENT.is_set():
+                return
+
+            stats = backfill_file(
+                db_engine,
+                download_threadpool,
+                s3_client,
+                table,
+                parquet_import_tracking,
+                row_group_executor,
+                row_filters,
+                settings,
+                f_shutdown,
+                backfill_callbacks,
+                file_type,
+                s3_object,
+                window_start,
+                window_end,
+            )
+            num_rows += stats["num_rows"]
+
+        LOGGER.info(
+            "backfilled new filters",
+            extra={
+                "table": table.name,
+                "start_timestamp": start_timestamp,
+                "end_timestamp": end_timestamp,
+                "num_files": len(plan),
+                "num_rows": num_rows,
+            },
+        )
+    except ShuttingDown:
+        return
+    except Exception:
+        # the live import already uses the new filters. this only misses older rows
+        LOGGER.exception("failed to backfill new filters", extra={"table": table.name})
+
+
 def download_and_import_incremental_parquet(
     db_engine,
     download_threadpool: ThreadPoolExecutor,
@@ -417,6 +751,8 @@ def download_and_import_incremental_parquet(
     row_filters,
     settings: Settings,
     f_shutdown,
+    write_buffer: WriteCombiningBuffer | None = None,
+    s3_object: dict | None = None,
 ):
     # as long as at least one file on this table is progressing, we are okay and shouldn't exit/warn
     # TODO: use a shared watchdog for this table instead of having every import track its own age.
@@ -456,6 +792,8 @@ def download_and_import_incremental_parquet(
                 next_start_timestamp,
                 progress_callbacks["incremental_bytes"],
                 progress_callbacks["empty_steps"],
+                s3_object,
+                row_filters=row_filters,
             )
 
             if incremental_filename is None:
@@ -500,21 +838,27 @@ def download_and_import_incremental_parquet(
                         extra,
                     )
 
-        import_parquet(
-            db_engine,
-            table,
-            incremental_filename,
-            "incremental",
-            progress_callbacks["incremental_steps"],
-            progress_callbacks["empty_steps"],
-            parquet_import_tracking,
-            row_group_executor,
-            row_filters,
-            settings,
-            f_shutdown,
-            backfill_start_timestamp=None,
-            backfill_end_timestamp=None,
-        )
+        if settings.empty_run_compaction and is_empty_file(incremental_filename):
+            # sync_parquet_to_db records it as part of a range once everything before it
+            # is completed
+            progress_callbacks["empty_steps"](1)
+        else:
+            import_parquet(
+                db_engine,
+                table,
+                incremental_filename,
+                "incremental",
+                progress_callbacks["incremental_steps"],
+                progress_callbacks["empty_steps"],
+                parquet_import_tracking,
+                row_group_executor,
+                row_filters,
+                settings,
+                f_shutdown,
+                backfill_start_timestamp=None,
+                backfill_end_timestamp=None,
+                write_buffer=write_buffer,
+            )
 
         # we got a file. reset max wait
         if max_wait_duration:
@@ -532,9 +876,13 @@ def download_and_import_incremental_parquet(
     return incremental_filename
 
 
-def queue_hard_shutdown():
+_SHUTDOWN_STARTED = threading.Lock()
+
+
+def queue_hard_shutdown(timeout_s: float = 10):
     # TODO: use a threading.Timer and have a watchdog thread that checks for no progress
-    for _ in range(10):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
         if len(threading.enumerate()) == 2:
             LOGGER.info("no threads left. shutting down cleanly")
             for thread in threading.enumerate():
@@ -554,20 +902,46 @@ def queue_hard_shutdown():
     os.kill(0, signal.SIGKILL)
 
 
-def start_shutdown():
-    LOGGER.info("starting to shut down")
+def start_shutdown(settings: Settings):
+    """
+    Stop starting new work and give in-flight row groups SHUTDOWN_DRAIN_TIMEOUT_S to
+    finish. Safe to call more than once
+    """
+    if not _SHUTDOWN_STARTED.acquire(blocking=False):
+        return
+
+    LOGGER.info(
+        "starting to shut down",
+        extra={"drain_timeout_s": settings.shutdown_drain_timeout_s},
+    )
 
     SHUTDOWN_EVENT.set()
 
+    # every drain shares one deadline. start it now
+    drain_s = drain_time_left(settings.shutdown_drain_timeout_s)
+
     # TODO: if unix, use SIGALARM?
     if threading.current_thread() == threading.main_thread():
-        threading.Thread(target=queue_hard_shutdown).start()
+        # after the drain, flushing buffers and marking files completed needs a little
+        # more time
+        threading.Thread(
+            target=queue_hard_shutdown,
+            args=(drain_s + 10,),
+            daemon=True,
+        ).start()
 
 
 def main(settings: Settings):
     with ExitStack() as stack:
-        db_engine = table_executor = file_executor = row_group_executors = None
+        db_engine = table_executor = file_executors = row_group_executors = None
         try:
+            # orchestrators stop their containers with SIGTERM. drain instead of dying
+            # mid-write
+            signal.signal(
+                signal.SIGTERM,
+                lambda signum, frame: start_shutdown(settings),
+            )
+
             if settings.tables:
                 table_names = settings.tables.split(",")
             else:
@@ -605,9 +979,45 @@ def main(settings: Settings):
                         "file": settings.file_workers,
                     },
                 )
-            db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+            # graph backends are shared by all the row group workers. close them after
+            # the executors finish
+            stack.callback(DatabaseFactory.close_all)
+
+            # send the last row counts and CU after the row group workers are done
+            meter = get_meter(settings)
+            stack.callback(meter.flush)
+
+            if settings.datadog_enabled and settings.cu_mode.metric():
+                # imports never wait for the pricing API
+                meter.start_pricing_refresh(settings)
+
+            if settings.database_backend != "postgresql":
+                # connect and create the schema once instead of for every row group
+                DatabaseFactory.get_backend(settings, table_names)
+
+            if settings.non_postgres_backend():
+                # import tracking is stored in the graph. postgres isn't needed at all
+                db_engine = None
+                tables = get_non_postgres_tables(table_names)
+            else:
+                db_engine = init_db(str(settings.postgres_dsn), table_names, settings)
+
+                # the executors exit first, so nothing is using a connection by then
+                stack.callback(db_engine.dispose)
+
+                tables = get_tables(settings.postgres_schema, db_engine, table_names)
 
-            tables = get_tables(settings.postgres_schema, db_engine, table_names)
+                if settings.partitioned_tables() & set(table_names):
+                    create_upcoming_partitions(db_engine, table_names, settings)
+
+                    # a long-running importer needs next month's partition before next
+                    # month starts
+                    threading.Thread(
+                        target=partition_maintenance_loop,
+                        args=(db_engine, table_names, settings),
+                        name="PartitionMaintenance",
+                        daemon=True,
+                    ).start()
 
             # TODO: test the s3 client here?
 
@@ -715,14 +1125,19 @@ def main(settings: Settings):
 
             f_shutdown = shutdown_executor.submit(SHUTDOWN_EVENT.wait)
 
-            filter_file = settings.filter_file
-            if filter_file:
-                with filter_file.open("r") as f:
-                    row_filters = orjson.loads(f.read())
-            else:
-                row_filters = {}
+            filter_watcher = FilterWatcher(
+                settings.filter_file,
+                settings.parquet_s3_schema,
+            )
 
-            # LOGGER.debug("all row_filters: %s", row_filters)
+            if settings.filter_file and settings.filter_reload_s > 0:
+                # edits to FILTER_FILE apply between files without a restart
+                threading.Thread(
+                    target=filter_watcher.watch,
+                    args=(settings.filter_reload_s,),
+                    name="FilterWatcher",
+                    daemon=True,
+                ).start()
 
             futures = {
                 table_executor.submit(
@@ -734,9 +1149,10 @@ def main(settings: Settings):
                     tables[table_name],
                     tables["parquet_import_tracking"],
                     progress_callbacks,
-                    row_filters.get(f"{settings.parquet_s3_schema}.{table_name}", None),
+                    filter_watcher.get(table_name),
                     settings,
                     f_shutdown,
+                    filter_watcher,
                 ): table_name
                 for table_name in table_names
             }
@@ -749,6 +1165,11 @@ def main(settings: Settings):
                 # will raise an exception if the future ended with one
                 f.result()
 
+                if SHUTDOWN_EVENT.is_set():
+                    # this table drained. wait for the others
+                    LOGGER.info("table stopped", extra={"table": table_name})
+                    continue
+
                 # all these futures should run forever
                 # any completions are unexpected
                 raise RuntimeError("table completed. this is unexpected", table_name)
@@ -761,7 +1182,7 @@ def main(settings: Settings):
             # TODO: i don't love this. but it seems like we need it
             sys.exit(1)
         finally:
-            start_shutdown()
+            start_shutdown(settings)
 
             LOGGER.info("waiting for all table_executors to complete")
 
@@ -770,7 +1191,7 @@ def main(settings: Settings):
 
             LOGGER.info("waiting for all downloads to complete")
 
-            if file_executor is not None:
+            if file_executors is not None:
                 for file_executor in file_executors.values():
                     file_executor.shutdown(wait=False, cancel_futures=True)
 
@@ -0,0 +1,179 @@
+"""
+Usage metering without a statsd packet (or a lock) for every row group.
+
+Row group workers add to counters that belong to their own thread. A background thread
+sums them and sends one increment per metric and table every METERING_FLUSH_S seconds.
+Entry points flush once more after their executors finish. Gauges only keep their newest
+value.
+
+CU pricing is fetched once at startup and refreshed in the background, so imports never
+wait for the API.
+"""
+
+import threading
+
+from datadog import statsd
+
+from .logger import LOGGER
+from .settings import SHUTDOWN_EVENT, Settings
+
+
+class Meter:
+    def __init__(self):
+        # every thread's counters. {(metric, tags): total}. only the owning thread
+        # writes to them
+        self._local = threading.local()
+        self._counters = []
+        self._counters_lock = threading.Lock()
+
+        # totals that were already sent
+        self._flushed = {}
+        self._flush_lock = threading.Lock()
+
+        # gauges are set by every worker. flush swaps the dict out under the lock
+        self._gauges = {}
+        self._gauges_lock = threading.Lock()
+
+        self._prices = None
+        self._prices_lock = threading.Lock()
+
+        self.settings = None
+        # without an interval, everything is sent right away like before
+        self.direct = True
+
+    @property
+    def started(self) -> bool:
+        return self.settings is not None
+
+    def start(self, settings: Settings):
+        self.settings = settings
+
+        if settings.metering_flush_s <= 0:
+            return
+
+        self.direct = False
+
+        threading.Thread(target=self._flush_loop, name="Metering", daemon=True).start()
+
+    def _thread_counters(self) -> dict:
+        counters = getattr(self._local, "counters", None)
+        if counters is None:
+            counters = self._local.counters = {}
+            with self._counters_lock:
+                self._counters.append(counters)
+        return counters
+
+    def increment(self, metric: str, value, tags: list[str]):
+        if self.direct:
+            statsd.increment(metric, value=value, tags=tags)
+            return
+
+        key = (metric, tuple(tags))
+        counters = self._thread_counters()
+        counters[key] = counters.get(key, 0) + value
+
+    def gauge(self, metric: str, value, tags: list[str]):
+        if self.direct:
+            statsd.gauge(metric, value, tags=tags)
+            return
+
+        with self._gauges_lock:
+            self._gauges[(metric, tuple(tags))] = value
+
+    def flush(self):
+        """Send everything counted since the last flush"""
+        with self._flush_lock:
+            with self._counters_lock:
+                all_counters = list(self._counters)
+
+            totals = {}
+            for counters in all_counters:
+                # copying is atomic. the owning thread can keep adding keys
+                for key, value in counters.copy().items():
+                    totals[key] = totals.get(key, 0) + value
+
+            for key, total in totals.items():
+                value = total - self._flushed.get(key, 0)
+                if value:
+                    metric, tags = key
+                    statsd.increment(metric, value=value, tags=list(tags))
+
+            self._flushed = totals
+
+            with self._gauges_lock:
+                gauges, self._gauges = self._gauges, {}
+            for (metric, tags), value in gauges.items():
+                statsd.gauge(metric, value, tags=list(tags))
+
+    def _flush_loop(self):
+        while not SHUTDOWN_EVENT.wait(self.settings.metering_flush_s):
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("failed to flush metering")
+
+    def row_cu_cost(self, settings: Settings, pricing_key: str) -> int | None:
+        """The CU price of one row of a table. None if the table has no price"""
+        if self._prices is None:
+            with self._prices_lock:
+                # another file might have fetched them while this one waited
+                if self._prices is None:
+                    self._prices = settings.neynar_api_client().get_portal_pricing(
+                        "indexer_service",
+                    )
+
+        return self._prices.get(pricing_key)
+
+    def refresh_prices(self, settings: Settings):
+        """
+        Fetch the CU prices. The first fetch raises. Later failures keep the old
+        prices
+        """
+        with self._prices_lock:
+            neynar_api_client = settings.neynar_api_client()
+
+            # the client caches for 8 hours. this is the refresh
+            neynar_api_client.cache.clear()
+
+            try:
+                self._prices = neynar_api_client.get_portal_pricing("indexer_service")
+            except Exception:
+                if self._prices is None:
+                    raise
+                LOGGER.exception("failed to refresh cu pricing. keeping the old prices")
+
+    def start_pricing_refresh(self, settings: Settings):
+        """Fetch the prices now and again every CU_PRICING_REFRESH_S seconds"""
+        self.refresh_prices(settings)
+
+        def refresh_loop():
+            while not SHUTDOWN_EVENT.wait(settings.cu_pricing_refresh_s):
+                self.refresh_prices(settings)
+
+        threading.Thread(target=refresh_loop, name="CuPricing", daemon=True).start()
+
+
+_meter = None
+_meter_lock = threading.Lock()
+
+
+def get_meter(settings: Settings | None = None) -> Meter:
+    """The process's meter. The first call with settings starts flushing"""
+    meter = _meter
+    if meter is not None and (settings is None or meter.started):
+        return meter
+
+    return _create_meter(settings)
+
+
+def _create_meter(settings: Settings | None) -> Meter:
+    global _meter
+
+    with _meter_lock:
+        if _meter is None:
+            _meter = Meter()
+
+        if settings is not None and not _meter.started:
+            _meter.start(settings)
+
+        return _meter
@@ -0,0 +1,167 @@
+"""
+Per-table conversion plans for turning parquet batches into rows for postgres.
+
+A plan is built once for every (table, parquet schema) pair from the reflected postgres
+columns.
+After that, converting a batch doesn't need to look at any types. Every column already
+knows what to do with its values.
+"""
+
+import ast
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+import orjson
+import pyarrow as pa
+from sqlalchemy import ARRAY, Table
+from sqlalchemy.dialects.postgresql.json import JSONB
+
+
+def clean_jsonb_data(col_name, value):
+    if value is None:
+        return None
+
+    # the parquet has the json as a string
+    # i thought v3 tables were using the json extension, but that doesn't work how i
+    # thought
+    try:
+        if isinstance(value, str):
+            if value.startswith("[{'") or value.startswith("{'"):
+                return ast.literal_eval(value)
+            else:
+                return orjson.loads(value)
+        elif isinstance(value, bytes):
+            if value.startswith(b"[{'") or value.startswith(b"{'"):
+                return ast.literal_eval(str(value))
+            else:
+                return orjson.loads(value)
+    except Exception as exc:
+        raise ValueError("failed to parse jsonb column", col_name, value, exc)
+
+    # TODO: if this is a datetime column, it is from parquet in milliseconds, not
+    # seconds!
+    return value
+
+
+def _is_text(arrow_type: pa.DataType) -> bool:
+    return (
+        pa.types.is_string(arrow_type)
+        or pa.types.is_large_string(arrow_type)
+        or pa.types.is_binary(arrow_type)
+        or pa.types.is_large_binary(arrow_type)
+    )
+
+
+def _decode_text_array(col_name, value):
+    """
+    Arrays exported as json text. Anything else (like a postgres array literal) is
+    passed through for postgres to parse
+    """
+    if isinstance(value, (str, bytes)) and value[:1] in ("[", b"["):
+        return clean_jsonb_data(col_name, value)
+    return value
+
+
+def _column_decoder(col_name, pg_type, arrow_type) -> Callable | None:
+    """
+    How to turn the python values of one parquet column into what postgres expects.
+    None means use them as they are
+    """
+    # native arrow lists and structs are already python lists and dicts. only text needs
+    # parsing
+    if isinstance(pg_type, JSONB) and _is_text(arrow_type):
+        return lambda value: clean_jsonb_data(col_name, value)
+
+    if isinstance(pg_type, ARRAY) and _is_text(arrow_type):
+        return lambda value: _decode_text_array(col_name, value)
+
+    # everything else (bytea, uuid, timestamps, numbers, native arrays) already has the
+    # right python type
+    return None
+
+
+@dataclass
+class RowCodec:
+    """The conversion plan for one table and one parquet schema"""
+
+    table_name: str
+    # parquet column order. this is also the order of the keys in every row
+    column_names: list[str]
+    # (column name, decoder) for the columns that need their values changed
+    decoders: list[tuple[str, Callable]]
+    # parquet columns that the table doesn't have (only read because a filter needs
+    # them). removed when decoding
+    extra_columns: list[str]
+
+    @classmethod
+    def build(cls, table: Table, schema: pa.Schema) -> "RowCodec":
+        decoders = []
+        extra_columns = []
+        for field in schema:
+            if field.name not in table.c:
+                extra_columns.append(field.name)
+                continue
+
+            decoder = _column_decoder(field.name, table.c[field.name].type, field.type)
+            if decoder is not None:
+                decoders.append((field.name, decoder))
+
+        return cls(
+            table_name=table.name,
+            column_names=list(schema.names),
+            decoders=decoders,
+            extra_columns=extra_columns,
+        )
+
+    def to_rows(self, batch: pa.Table, decode: bool = True) -> list[dict]:
+        """Convert a batch into row dicts and apply the plan.
+
+        With decode=False, the raw parquet values are kept so that filters see
+        the same values as before.
+        Call decode_rows on whatever is left after filtering.
+        """
+        # arrow builds the dicts faster than zipping the columns in python
+        rows = batch.to_pylist()
+
+        if decode:
+            self.decode_rows(rows)
+
+        return rows
+
+    def decode_rows(self, rows: list[dict]) -> list[dict]:
+        """
+        Apply the plan to rows. Only the columns that need it are touched. The
+        rows are changed in place
+        """
+        for col_name, decoder in self.decoders:
+            for row in rows:
+                row[col_name] = decoder(row[col_name])
+
+        for col_name in self.extra_columns:
+            for row in rows:
+                del row[col_name]
+
+        return rows
+
+
+_codecs: dict[tuple[str, pa.Schema], RowCodec] = {}
+_codecs_lock = threading.Lock()
+
+
+def get_row_codec(table: Table, schema: pa.Schema) -> RowCodec:
+    """
+    The conversion plan for a table. Plans are cached, so every file with the same
+    schema shares one
+    """
+    key = (table.fullname, schema)
+
+    codec = _codecs.get(key)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(key)
+            if codec is None:
+                codec = RowCodec.build(table, schema)
+                _codecs[key] = codec
+
+    return codec
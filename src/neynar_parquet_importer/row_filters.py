@@ -1,3 +1,13 @@
+from bisect import bisect_left
+from pathlib import Path
+
+import orjson
+import pyarrow as pa
+
+from .logger import LOGGER
+from .settings import SHUTDOWN_EVENT
+
+
 def include_by_col_data(col_data, filters: dict) -> bool:
     # this returns after the first key. multiple keys will not work right!
     for key, value in filters.items():
@@ -82,3 +92,484 @@ def include_row(row: dict, filters: dict | None, backfill_start_timestamp: int |
             raise ValueError(f"Unknown filter key: {key}")
 
     return True
+
+
+def filter_columns(filters: dict | None) -> set[str]:
+    """
+    The columns that a filter looks at. They have to be read even if the table
+    doesn't have them
+    """
+    columns = set()
+
+    if not filters:
+        return columns
+
+    for key, value in filters.items():
+        if key in ("$and", "$or"):
+            for v in value:
+                columns |= filter_columns(v)
+        elif key.startswith("data."):
+            columns.add(key[5:])
+
+    return columns
+
+
+def row_filter_columns(
+    filters: dict | None,
+    backfill_start_timestamp=None,
+    backfill_end_timestamp=None,
+) -> set[str]:
+    """The columns that compile_row_filter's function reads"""
+    columns = filter_columns(filters)
+
+    if backfill_start_timestamp is not None or backfill_end_timestamp is not None:
+        columns.add("updated_at")
+
+    return columns
+
+
+def filter_batch(batch: pa.Table, row_filter, columns: set[str]) -> pa.Table:
+    """
+    Keep the rows of an Arrow batch that pass a compiled filter. Only the columns
+    that the filter reads are converted to python
+    """
+    names = [name for name in batch.column_names if name in columns]
+
+    mask = [row_filter(row) for row in batch.select(names).to_pylist()]
+
+    return batch.filter(pa.array(mask, pa.bool_()))
+
+
+# how likely a row is to pass each kind of check. $and tries the least likely first and
+# $or the most likely
+_EQUALITY = 0
+_RANGE = 1
+_NEGATION = 2
+
+
+def _membership_set(values):
+    try:
+        return frozenset(values)
+    except TypeError:
+        # unhashable values (lists) can only be compared one at a time
+        return tuple(values)
+
+
+def _membership_check(values):
+    """
+    `x in values` for a $in/$nin list. Hashable values are looked up in a frozenset.
+    Array columns are lists, so those rows are compared one at a time like include_row
+    """
+    members = _membership_set(values)
+    if isinstance(members, tuple):
+        return members.__contains__
+
+    items = tuple(values)
+
+    def contains(x):
+        try:
+            return x in members
+        except TypeError:
+            return x in items
+
+    return contains
+
+
+def _compile_bounds(ops: dict):
+    """Fold $gt/$gte/$lt/$lte into the tightest lower and upper bound"""
+    lower = upper = None
+
+    for op in ("$gt", "$gte"):
+        if op in ops and (
+            lower is None or ops[op] > lower[0] or (ops[op] == lower[0] and op == "$gt")
+        ):
+            lower = (ops[op], op == "$gte")
+    for op in ("$lt", "$lte"):
+        if op in ops and (
+            upper is None or ops[op] < upper[0] or (ops[op] == upper[0] and op == "$lt")
+        ):
+            upper = (ops[op], op == "$lte")
+
+    if lower is not None and upper is not None:
+        (lo, lo_inclusive), (hi, hi_inclusive) = lower, upper
+        if lo_inclusive and hi_inclusive:
+            return lambda x: lo <= x <= hi
+        if lo_inclusive:
+            return lambda x: lo <= x < hi
+        if hi_inclusive:
+            return lambda x: lo < x <= hi
+        return lambda x: lo < x < hi
+
+    if lower is not None:
+        lo, lo_inclusive = lower
+        return (lambda x: x >= lo) if lo_inclusive else (lambda x: x > lo)
+
+    hi, hi_inclusive = upper
+    return (lambda x: x <= hi) if hi_inclusive else (lambda x: x < hi)
+
+
+def _compile_column(column: str, ops: dict):
+    """
+    One closure per check. Returns (predicate on the column's value, selectivity
+    rank) pairs
+    """
+    checks = []
+
+    if "$eq" in ops:
+        checks.append(((lambda value: lambda x: x == value)(ops["$eq"]), _EQUALITY))
+    if "$in" in ops:
+        checks.append((_membership_check(ops["$in"]), _EQUALITY))
+    if any(op in ops for op in ("$gt", "$gte", "$lt", "$lte")):
+        checks.append((_compile_bounds(ops), _RANGE))
+    if "$ne" in ops:
+        checks.append(((lambda value: lambda x: x != value)(ops["$ne"]), _NEGATION))
+    if "$nin" in ops:
+        checks.append(
+            (
+                (lambda contains: lambda x: not contains(x))(
+                    _membership_check(ops["$nin"]),
+                ),
+                _NEGATION,
+            ),
+        )
+
+    return checks
+
+
+def _all_of(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+    if len(predicates) == 2:
+        a, b = predicates
+        return lambda row: a(row) and b(row)
+    predicates = tuple(predicates)
+    return lambda row: all(p(row) for p in predicates)
+
+
+def _any_of(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+    if len(predicates) == 2:
+        a, b = predicates
+        return lambda row: a(row) or b(row)
+    predicates = tuple(predicates)
+    return lambda row: any(p(row) for p in predicates)
+
+
+def _compile(filters: dict):
+    """
+    Compile a filter dict into (predicate on a row, selectivity rank). Keys are
+    ANDed like in include_row
+    """
+    parts = []
+
+    for key, value in filters.items():
+        if key == "$and":
+            compiled = [_compile(v) for v in value]
+            if not compiled:
+                continue
+            compiled.sort(key=lambda c: c[1])
+            parts.append((_all_of([p for p, _ in compiled]), compiled[0][1]))
+        elif key == "$or":
+            compiled = [_compile(v) for v in value]
+            if not compiled:
+                # any() of nothing is false
+                parts.append((lambda row: False, _EQUALITY))
+                continue
+            compiled.sort(key=lambda c: c[1], reverse=True)
+            parts.append((_any_of([p for p, _ in compiled]), compiled[0][1]))
+        elif key.startswith("data."):
+            column = key[5:]
+            for check, rank in _compile_column(column, value):
+                parts.append(
+                    (
+                        (lambda check, column: lambda row: check(row[column]))(
+                            check,
+                            column,
+                        ),
+                        rank,
+                    ),
+                )
+        else:
+            raise ValueError(f"Unknown filter key: {key}")
+
+    if not parts:
+        return (lambda row: True), _NEGATION
+
+    parts.sort(key=lambda c: c[1])
+
+    return _all_of([p for p, _ in parts]), parts[0][1]
+
+
+def compile_row_filter(
+    filters: dict | None,
+    backfill_start_timestamp=None,
+    backfill_end_timestamp=None,
+):
+    """
+    Compile filters (and the backfill window) into one function with the same result
+    as include_row.
+
+    Membership lists become frozensets, ranges on a column become one comparison,
+    and $and/$or try their cheapest exits first.
+    Returns None if every row is included.
+    """
+    parts = []
+
+    if backfill_start_timestamp is not None:
+        parts.append(lambda row: row["updated_at"] >= backfill_start_timestamp)
+    if backfill_end_timestamp is not None:
+        parts.append(lambda row: row["updated_at"] <= backfill_end_timestamp)
+
+    if filters:
+        parts.append(_compile(filters)[0])
+
+    if not parts:
+        return None
+
+    return _all_of(parts)
+
+
+COLUMN_OPERATORS = ("$in", "$nin", "$lt", "$lte", "$gt", "$gte", "$eq", "$ne")
+
+
+def validate_filters(filters: dict | None) -> None:
+    """
+    Raise ValueError for keys that include_row doesn't know. Checked when the file
+    is loaded instead of on the first row.
+
+    include_row ignores unknown operators, so those are only logged
+    """
+    if not filters:
+        return
+
+    for key, value in filters.items():
+        if key in ("$and", "$or"):
+            for v in value:
+                validate_filters(v)
+        elif key.startswith("data."):
+            for op in value:
+                if op not in COLUMN_OPERATORS:
+                    LOGGER.warning(
+                        "ignoring unknown filter operator",
+                        extra={"key": key, "operator": op},
+                    )
+        else:
+            raise ValueError(f"Unknown filter key: {key}")
+
+
+class FilterWatcher:
+    """
+    The filters in FILTER_FILE. The file is checked for changes and reloaded without
+    a restart.
+
+    Every reload replaces the whole dict, so readers always see one consistent version.
+    Files that are already importing keep the filters they started with. A file that
+    fails to parse or validate is logged and ignored.
+    """
+
+    def __init__(self, filter_file: Path | None, schema_name: str):
+        self.filter_file = filter_file
+        self.schema_name = schema_name
+
+        self.filters = {}
+        # bumped on every reload that changed something
+        self.version = 0
+        self._stat = None
+
+        if filter_file:
+            with filter_file.open("rb") as f:
+                filters = orjson.loads(f.read())
+            for v in filters.values():
+                validate_filters(v)
+
+            self.filters = filters
+            self._stat = self._file_stat()
+
+    def _file_stat(self):
+        stat = self.filter_file.stat()
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, table_name: str) -> dict | None:
+        return self.filters.get(f"{self.schema_name}.{table_name}")
+
+    def reload(self) -> set[str]:
+        """
+        Load the file again if it changed. Returns the tables whose filters
+        changed
+        """
+        if not self.filter_file:
+            return set()
+
+        stat = self._stat
+        try:
+            stat = self._file_stat()
+            if stat == self._stat:
+                return set()
+
+            with self.filter_file.open("rb") as f:
+                filters = orjson.loads(f.read())
+            for v in filters.values():
+                validate_filters(v)
+        except Exception:
+            LOGGER.exception(
+                "failed to reload filters. keeping the old ones",
+                extra={"filter_file": str(self.filter_file)},
+            )
+            return set()
+        finally:
+            # don't retry a broken file until it changes again
+            self._stat = stat
+
+        changed = {
+            key
+            for key in self.filters.keys() | filters.keys()
+            if self.filters.get(key) != filters.get(key)
+        }
+
+        if changed:
+            self.filters = filters
+            self.version += 1
+
+            LOGGER.info(
+                "reloaded filters",
+                extra={"version": self.version, "changed": sorted(changed)},
+            )
+
+        return changed
+
+    def watch(self, interval_s: float) -> None:
+        while not SHUTDOWN_EVENT.wait(interval_s):
+            self.reload()
+
+
+def _statistics_column(ops: dict):
+    """
+    Checks on a column's (min, max). Each is False only if no value in that range
+    can pass
+    """
+    checks = []
+
+    if "$eq" in ops:
+        checks.append(lambda lo, hi, value=ops["$eq"]: lo <= value <= hi)
+    if "$in" in ops:
+        try:
+            values = sorted(set(ops["$in"]) - {None})
+        except TypeError:
+            values = None
+        if values is not None:
+            def check_in(lo, hi, values=values):
+                # the smallest value that isn't below the range has to be inside it
+                j = bisect_left(values, lo)
+                return j < len(values) and values[j] <= hi
+
+            checks.append(check_in)
+    if "$gt" in ops:
+        checks.append(lambda lo, hi, value=ops["$gt"]: hi > value)
+    if "$gte" in ops:
+        checks.append(lambda lo, hi, value=ops["$gte"]: hi >= value)
+    if "$lt" in ops:
+        checks.append(lambda lo, hi, value=ops["$lt"]: lo < value)
+    if "$lte" in ops:
+        checks.append(lambda lo, hi, value=ops["$lte"]: lo <= value)
+    if "$ne" in ops:
+        checks.append(lambda lo, hi, value=ops["$ne"]: not (lo == hi == value))
+    if "$nin" in ops:
+        checks.append(
+            lambda lo, hi, values=_membership_set(ops["$nin"]): (
+                not (lo == hi and lo in values)
+            ),
+        )
+
+    # nulls aren't part of min and max. they pass these operators the same way they pass
+    # include_row
+    accepts_null = (
+        ("$eq" not in ops or ops["$eq"] is None)
+        and ("$in" not in ops or None in ops["$in"])
+        and ("$ne" not in ops or ops["$ne"] is not None)
+        and ("$nin" not in ops or None not in ops["$nin"])
+        and not any(op in ops for op in ("$gt", "$gte", "$lt", "$lte"))
+    )
+
+    return checks, accepts_null
+
+
+def compile_statistics_filter(filters: dict | None):
+    """
+    Like compile_row_filter, but for a row group's statistics ({column name:
+    pyarrow.parquet.Statistics or None}).
+
+    Returns False only if no row in the row group can pass the filters. Columns
+    without statistics might always match.
+    """
+    if not filters:
+        return lambda statistics: True
+
+    parts = []
+
+    for key, value in filters.items():
+        if key == "$and":
+            compiled = [compile_statistics_filter(v) for v in value]
+            parts.append(
+                lambda statistics, compiled=compiled: all(
+                    p(statistics) for p in compiled
+                ),
+            )
+        elif key == "$or":
+            compiled = [compile_statistics_filter(v) for v in value]
+            parts.append(
+                lambda statistics, compiled=compiled: any(
+                    p(statistics) for p in compiled
+                ),
+            )
+        elif key.startswith("data."):
+            column = key[5:]
+            checks, accepts_null = _statistics_column(value)
+
+            def might_match(
+                statistics,
+                column=column,
+                checks=checks,
+                accepts_null=accepts_null,
+            ):
+                stats = statistics.get(column)
+                if stats is None or not stats.has_min_max:
+                    return True
+
+                if accepts_null and (not stats.has_null_count or stats.null_count > 0):
+                    return True
+
+                try:
+                    return all(check(stats.min, stats.max) for check in checks)
+                except TypeError:
+                    # the filter's values and the column's type don't compare. let the
+                    # row filter decide
+                    return True
+
+            parts.append(might_match)
+        else:
+            raise ValueError(f"Unknown filter key: {key}")
+
+    return lambda statistics: all(p(statistics) for p in parts)
+
+
+def row_groups_matching(metadata, filters: dict | None) -> list[int]:
+    """
+    The row groups of a parquet file (its pyarrow FileMetaData) that might have rows
+    that pass the filters
+    """
+    might_match = compile_statistics_filter(filters)
+
+    matching = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+
+        statistics = {}
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            statistics[column.path_in_schema] = column.statistics
+
+        if might_match(statistics):
+            matching.append(i)
+
+    return matching
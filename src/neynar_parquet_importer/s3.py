@@ -1,3 +1,4 @@
+from concurrent import futures
 from concurrent.futures import ThreadPoolExecutor
 from functools import cache
 import math
@@ -8,14 +9,25 @@ import re
 import shutil
 import boto3
 from botocore.config import Config
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sqlalchemy import Table
 
 from neynar_parquet_importer.progress import ProgressCallback
 
 from .logger import LOGGER
+from .row_filters import row_groups_matching
 from .settings import Settings
 
 
+# written next to a sparse download. lists the row groups that are in the local file
+SPARSE_SIDECAR_SUFFIX = ".rowgroups.json"
+
+# most footers fit in one request
+FOOTER_GUESS_BYTES = 64 * 1024
+
+
 # TODO: stricter type on this. use named groups and just return those
 def parse_parquet_filename(filename: os.PathLike) -> dict[str, int]:
     basename = path_basename(filename)
@@ -39,6 +51,7 @@ def download_known_full(
     settings: Settings,
     file_name: os.PathLike[str],
     progress_callback,
+    row_filters: dict | None = None,
 ) -> Path:
     """Downloads a known full export file from S3."""
     s3_prefix = settings.parquet_s3_prefix() + "full/"
@@ -77,7 +90,7 @@ def download_known_full(
 
     incoming_path = settings.incoming_dir() / file_name
 
-    resumable_download(
+    download_object(
         s3_client,
         full_file_key,
         incoming_path,
@@ -86,18 +99,14 @@ def download_known_full(
         file_size,  # get size after verifying the shape of return
         settings,
         download_threadpool,
+        row_filters,
     )
 
     return Path(local_file_path)
 
 
-def download_latest_full(
-    download_threadpool: ThreadPoolExecutor,
-    s3_client,
-    settings: Settings,
-    table: Table,
-    progress_callback,
-) -> Path:
+def list_full_exports(s3_client, settings: Settings, table: Table) -> list[dict]:
+    """Every full export of a table in s3, oldest first"""
     s3_prefix = settings.parquet_s3_prefix() + "full/"
 
     full_export_prefix = s3_prefix + f"{settings.parquet_s3_schema}-{table.name}-0-"
@@ -108,23 +117,36 @@ def download_latest_full(
         "Prefix": full_export_prefix,
     }
     page_iterator = paginator.paginate(**operation_parameters)
-    latest_file = None
+    full_exports = []
     for response in page_iterator:
         contents = response.get("Contents", [])
 
         if not contents:
             break
 
-        response_latest_file = max(contents, key=lambda x: x["Key"])
+        full_exports.extend(contents)
 
-        if latest_file is None:
-            latest_file = response_latest_file
-        else:
-            if response_latest_file["Key"] > latest_file["Key"]:
-                latest_file = response_latest_file
+    return sorted(full_exports, key=lambda x: x["Key"])
+
+
+def download_latest_full(
+    download_threadpool: ThreadPoolExecutor,
+    s3_client,
+    settings: Settings,
+    table: Table,
+    progress_callback,
+    row_filters: dict | None = None,
+) -> Path:
+    full_exports = list_full_exports(s3_client, settings, table)
 
-    if latest_file is None:
-        raise ValueError("No full exports found", full_export_prefix)
+    if not full_exports:
+        raise ValueError(
+            "No full exports found",
+            settings.parquet_s3_prefix()
+            + f"full/{settings.parquet_s3_schema}-{table.name}-0-",
+        )
+
+    latest_file = full_exports[-1]
 
     LOGGER.debug("Latest full backup: %s", latest_file)
 
@@ -146,7 +168,7 @@ def download_latest_full(
 
     incoming_path = settings.incoming_dir() / full_name
 
-    resumable_download(
+    download_object(
         s3_client,
         latest_file["Key"],
         incoming_path,
@@ -155,11 +177,63 @@ def download_latest_full(
         latest_size_bytes,
         settings,
         download_threadpool,
+        row_filters,
     )
 
     return Path(local_file_path)
 
 
+def list_incrementals(
+    s3_client,
+    settings: Settings,
+    table: Table,
+    start_timestamp: int,
+    end_timestamp: int,
+    max_files: int,
+) -> dict[int, dict]:
+    """
+    List the incrementals that start in [start_timestamp, end_timestamp) with
+    paginated prefix listing.
+
+    One page covers up to 1000 files. Probing for every file one at a time takes one
+    request per file.
+    Returns the s3 objects by their start timestamp.
+    """
+    incremental_s3_prefix = settings.parquet_s3_prefix() + "incremental/"
+    table_prefix = f"{incremental_s3_prefix}{settings.parquet_s3_schema}-{table.name}-"
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+    page_iterator = paginator.paginate(
+        Bucket=settings.parquet_s3_bucket,
+        Prefix=table_prefix,
+        # keys sort by their start timestamp (they all have the same number of digits)
+        StartAfter=f"{table_prefix}{start_timestamp - 1}.",
+    )
+
+    found = {}
+    for response in page_iterator:
+        for s3_object in response.get("Contents", []):
+            parsed_filename = parse_parquet_filename(s3_object["Key"])
+
+            if parsed_filename["start_timestamp"] >= end_timestamp:
+                return found
+
+            if (
+                parsed_filename["end_timestamp"] - parsed_filename["start_timestamp"]
+                != settings.incremental_duration
+            ):
+                # some other duration's file. those live under different prefixes, but
+                # be safe
+                continue
+
+            found[parsed_filename["start_timestamp"]] = s3_object
+
+            if len(found) >= max_files:
+                return found
+
+    return found
+
+
 def download_incremental(
     download_threadpool: ThreadPoolExecutor,
     s3_client,
@@ -168,8 +242,14 @@ def download_incremental(
     start_timestamp,
     bytes_downloaded_progress: ProgressCallback,
     empty_steps_progress: ProgressCallback,
+    s3_object: dict | None = None,
+    row_filters: dict | None = None,
 ):
-    """Returns None if the file doesn't exist"""
+    """Returns None if the file doesn't exist
+
+    s3_object skips the LIST when the catch-up planner already found the file.
+    With SPARSE_DOWNLOAD, row_filters decide which row groups are downloaded.
+    """
     end_timestamp = start_timestamp + settings.incremental_duration
 
     incremental_name = (
@@ -203,26 +283,29 @@ def download_incremental(
         LOGGER.debug("No local files found: %s", local_parquet_path)
         return None
 
-    incremental_s3_prefix = settings.parquet_s3_prefix() + "incremental/"
+    if s3_object is not None:
+        head_object = s3_object
+    else:
+        incremental_s3_prefix = settings.parquet_s3_prefix() + "incremental/"
 
-    # Try downloading with ".parquet" extension first
+        # Try downloading with ".parquet" extension first
 
-    # get filesize before downloading for the progress bar
-    response = s3_client.list_objects_v2(
-        Bucket=settings.parquet_s3_bucket,
-        Prefix=incremental_s3_prefix + prefix_name,
-    )
+        # get filesize before downloading for the progress bar
+        response = s3_client.list_objects_v2(
+            Bucket=settings.parquet_s3_bucket,
+            Prefix=incremental_s3_prefix + prefix_name,
+        )
 
-    contents = response.get("Contents", [])
+        contents = response.get("Contents", [])
 
-    if not contents:
-        LOGGER.debug("No s3 files found: %s", incremental_s3_prefix + prefix_name)
-        return None
+        if not contents:
+            LOGGER.debug("No s3 files found: %s", incremental_s3_prefix + prefix_name)
+            return None
 
-    if len(contents) > 1:
-        raise ValueError("Multiple s3 files found", contents)
+        if len(contents) > 1:
+            raise ValueError("Multiple s3 files found", contents)
 
-    head_object = contents[0]
+        head_object = contents[0]
 
     final_size_bytes = head_object["Size"]
 
@@ -231,7 +314,7 @@ def download_incremental(
         empty_steps_progress.more_steps(1)
         return local_empty_path
 
-    resumable_download(
+    download_object(
         s3_client,
         head_object["Key"],
         local_incoming_path,
@@ -240,6 +323,7 @@ def download_incremental(
         final_size_bytes,
         settings,
         download_threadpool,
+        row_filters,
     )
 
     return local_parquet_path
@@ -272,6 +356,257 @@ def get_chunk_ranges(
     return ranges
 
 
+def download_object(
+    s3_client,
+    s3_key,
+    local_incoming_path,
+    local_file_path,
+    progress_callback,
+    final_size_bytes,
+    settings: Settings,
+    threadpool: ThreadPoolExecutor,
+    row_filters: dict | None = None,
+):
+    """
+    Download the whole file, or only the row groups that can match row_filters (see
+    sparse_download)
+    """
+    if (
+        settings.sparse_download
+        and row_filters
+        and final_size_bytes >= settings.sparse_download_min_bytes
+    ):
+        sparse_download(
+            s3_client,
+            s3_key,
+            local_incoming_path,
+            local_file_path,
+            progress_callback,
+            final_size_bytes,
+            settings,
+            threadpool,
+            row_filters,
+        )
+        return
+
+    # an earlier sparse download of this file must not hide row groups of the complete
+    # one
+    sparse_sidecar_path(local_file_path).unlink(missing_ok=True)
+
+    resumable_download(
+        s3_client,
+        s3_key,
+        local_incoming_path,
+        local_file_path,
+        progress_callback,
+        final_size_bytes,
+        settings,
+        threadpool,
+    )
+
+
+def sparse_sidecar_path(local_file) -> Path:
+    return Path(str(local_file) + SPARSE_SIDECAR_SUFFIX)
+
+
+def read_sparse_sidecar(local_file) -> dict | None:
+    """The row groups that a sparse download fetched. None if the file is complete"""
+    try:
+        with open(sparse_sidecar_path(local_file), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def _get_range(s3_client, s3_key, settings: Settings, range_header: str) -> bytes:
+    response = s3_client.get_object(
+        Bucket=settings.parquet_s3_bucket,
+        Key=s3_key,
+        Range=range_header,
+    )
+    return response["Body"].read()
+
+
+def fetch_parquet_footer(
+    s3_client,
+    s3_key,
+    settings: Settings,
+    final_size_bytes: int,
+) -> tuple[bytes, pq.FileMetaData]:
+    """Range GET the end of the file. Returns those bytes and the parsed metadata"""
+    tail = _get_range(
+        s3_client,
+        s3_key,
+        settings,
+        f"bytes={max(0, final_size_bytes - FOOTER_GUESS_BYTES)}-{final_size_bytes - 1}",
+    )
+
+    if tail[-4:] != b"PAR1":
+        raise ValueError("Not a parquet file", s3_key)
+
+    footer_size = int.from_bytes(tail[-8:-4], "little") + 8
+    if footer_size > len(tail):
+        # a big footer (lots of row groups). get all of it
+        tail = _get_range(
+            s3_client,
+            s3_key,
+            settings,
+            f"bytes={final_size_bytes - footer_size}-{final_size_bytes - 1}",
+        )
+
+    return tail, pq.read_metadata(pa.BufferReader(tail))
+
+
+def row_group_byte_ranges(
+    metadata: pq.FileMetaData,
+    row_groups: list[int],
+    max_gap: int = 64 * 1024,
+) -> list[tuple[int, int]]:
+    """
+    The [start, end) byte ranges of the row groups' column chunks. Ranges closer
+    than max_gap are merged into one request
+    """
+    chunks = []
+    for i in row_groups:
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+
+            start = column.data_page_offset
+            if column.has_dictionary_page and column.dictionary_page_offset:
+                start = min(start, column.dictionary_page_offset)
+
+            chunks.append((start, start + column.total_compressed_size))
+
+    ranges = []
+    for start, end in sorted(chunks):
+        if ranges and start - ranges[-1][1] <= max_gap:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+
+    return ranges
+
+
+def _sparse_download_range(
+    s3_client,
+    s3_key,
+    fd: int,
+    start: int,
+    end: int,
+    progress_callback,
+    settings: Settings,
+):
+    response = s3_client.get_object(
+        Bucket=settings.parquet_s3_bucket,
+        Key=s3_key,
+        Range=f"bytes={start}-{end - 1}",
+    )
+
+    offset = start
+    for chunk in response["Body"].iter_chunks(256 * 1024):
+        os.pwrite(fd, chunk, offset)
+        offset += len(chunk)
+        progress_callback(len(chunk))
+
+    if offset != end:
+        raise ValueError(
+            "Downloaded range is not the expected size",
+            s3_key,
+            start,
+            end,
+        )
+
+
+def sparse_download(
+    s3_client,
+    s3_key,
+    local_incoming_path,
+    local_file_path,
+    progress_callback,
+    final_size_bytes,
+    settings: Settings,
+    threadpool: ThreadPoolExecutor,
+    row_filters: dict,
+):
+    """
+    Download only the row groups whose statistics can match row_filters.
+
+    The local file has the same size and layout as the one in s3. The footer and the
+    matching column chunks are written at their offsets and everything else is a
+    hole.
+    A sidecar next to it lists the row groups that were downloaded. import_parquet
+    skips the others.
+    """
+    tail, metadata = fetch_parquet_footer(s3_client, s3_key, settings, final_size_bytes)
+
+    row_groups = row_groups_matching(metadata, row_filters)
+    ranges = row_group_byte_ranges(metadata, row_groups)
+
+    num_bytes = len(tail) + sum(end - start for start, end in ranges)
+    progress_callback.more_steps(num_bytes)
+
+    with open(local_incoming_path, "wb") as f:
+        # on most filesystems this doesn't use any disk until something is written
+        f.truncate(final_size_bytes)
+
+    fs = []
+    fd = os.open(local_incoming_path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, tail, final_size_bytes - len(tail))
+        progress_callback(len(tail))
+
+        for start, end in ranges:
+            fs.append(
+                threadpool.submit(
+                    _sparse_download_range,
+                    s3_client,
+                    s3_key,
+                    fd,
+                    start,
+                    end,
+                    progress_callback,
+                    settings,
+                ),
+            )
+        for f in fs:
+            f.result()
+    finally:
+        # the fd number can be reused as soon as it is closed. no range can still be
+        # writing to it
+        for f in fs:
+            f.cancel()
+        futures.wait(fs)
+
+        os.close(fd)
+
+    # the sidecar goes first. a complete-looking file without one would be imported as
+    # if it had every row group
+    with open(sparse_sidecar_path(local_file_path), "wb") as f:
+        f.write(
+            orjson.dumps(
+                {
+                    "row_groups": row_groups,
+                    "num_row_groups": metadata.num_row_groups,
+                    "filters": row_filters,
+                },
+            ),
+        )
+
+    os.rename(local_incoming_path, local_file_path)
+
+    LOGGER.info(
+        "sparse download",
+        extra={
+            "key": s3_key,
+            "row_groups": len(row_groups),
+            "num_row_groups": metadata.num_row_groups,
+            "bytes": num_bytes,
+            "size": final_size_bytes,
+        },
+    )
+
+
 def resumable_download(
     s3_client,
     s3_key,
@@ -0,0 +1,218 @@
+"""
+Keep parquet_import_tracking small on long-running installs.
+
+Only the newest completed incremental of a table is needed to resume. Older rows are
+only useful for debugging.
+Once there are more than TRACKING_RETENTION_FILES completed incrementals for a table,
+the oldest ones are deleted.
+They are counted in parquet_import_tracking_summary so that the totals aren't lost.
+
+Incomplete files and full exports are never removed.
+"""
+
+from time import time
+
+from sqlalchemy import Table, delete, func, literal, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .db import fetchone_with_retry
+from .empty_runs import compact_empty_tracking
+from .logger import LOGGER
+from .settings import Settings
+
+
+def prune_completed_incrementals(
+    engine,
+    parquet_import_tracking: Table,
+    parquet_import_tracking_summary: Table,
+    table_name: str,
+    keep: int,
+    batch_size: int = 50_000,
+) -> int:
+    """
+    Delete all but the newest `keep` completed incrementals of a table (for every
+    version and duration).
+
+    Each batch is deleted and added to the summary in one statement. Returns how
+    many rows were removed.
+    """
+    t = parquet_import_tracking
+    s = parquet_import_tracking_summary
+
+    groups = (
+        select(t.c.file_version, t.c.file_duration_s, t.c.backfill)
+        .where(t.c.table_name == table_name)
+        .where(t.c.file_type == "incremental")
+        .where(t.c.completed.is_(True))
+        .distinct()
+    )
+
+    with engine.connect() as conn:
+        groups = conn.execute(groups).fetchall()
+
+    num_removed = 0
+
+    for file_version, file_duration_s, backfill in groups:
+        completed = (
+            select(t.c.id, t.c.end_timestamp)
+            .where(t.c.table_name == table_name)
+            .where(t.c.file_type == "incremental")
+            .where(t.c.file_version == file_version)
+            .where(t.c.file_duration_s == file_duration_s)
+            .where(t.c.backfill.is_(backfill))
+            .where(t.c.completed.is_(True))
+        )
+
+        # the oldest row that is kept
+        cutoff = fetchone_with_retry(
+            engine,
+            completed.order_by(t.c.end_timestamp.desc()).offset(keep - 1).limit(1),
+        )
+        if cutoff is None:
+            continue
+
+        while True:
+            batch = (
+                completed.with_only_columns(t.c.id)
+                .where(t.c.end_timestamp < cutoff.end_timestamp)
+                .order_by(t.c.end_timestamp)
+                .limit(batch_size)
+            )
+
+            deleted = (
+                delete(t)
+                .where(t.c.id.in_(batch.scalar_subquery()))
+                .returning(t.c.end_timestamp, t.c.is_empty)
+                .cte("deleted")
+            )
+
+            summary = (
+                select(
+                    func.count().label("num_files"),
+                    func.count().filter(deleted.c.is_empty.is_(True)).label("num_empty"),
+                    func.min(deleted.c.end_timestamp).label("first_end_timestamp"),
+                    func.max(deleted.c.end_timestamp).label("last_end_timestamp"),
+                )
+                .select_from(deleted)
+                .cte("summary")
+            )
+
+            stmt = pg_insert(s).from_select(
+                [
+                    "table_name",
+                    "file_type",
+                    "file_version",
+                    "file_duration_s",
+                    "backfill",
+                    "num_files",
+                    "num_empty",
+                    "first_end_timestamp",
+                    "last_end_timestamp",
+                ],
+                select(
+                    literal(table_name, s.c.table_name.type),
+                    literal("incremental", s.c.file_type.type),
+                    literal(file_version, s.c.file_version.type),
+                    literal(file_duration_s, s.c.file_duration_s.type),
+                    literal(backfill, s.c.backfill.type),
+                    summary.c.num_files,
+                    summary.c.num_empty,
+                    summary.c.first_end_timestamp,
+                    summary.c.last_end_timestamp,
+                ).where(summary.c.num_files > 0),
+            )
+            upsert = stmt.on_conflict_do_update(
+                index_elements=[
+                    "table_name",
+                    "file_type",
+                    "file_version",
+                    "file_duration_s",
+                    "backfill",
+                ],
+                set_={
+                    "num_files": s.c.num_files + stmt.excluded.num_files,
+                    "num_empty": s.c.num_empty + stmt.excluded.num_empty,
+                    "first_end_timestamp": func.least(
+                        s.c.first_end_timestamp,
+                        stmt.excluded.first_end_timestamp,
+                    ),
+                    "last_end_timestamp": func.greatest(
+                        s.c.last_end_timestamp,
+                        stmt.excluded.last_end_timestamp,
+                    ),
+                    "updated_at": func.now(),
+                },
+            ).cte("upsert")
+
+            # delete, summarize and upsert in one statement. it returns how many rows
+            # this batch removed
+            row = fetchone_with_retry(
+                engine,
+                select(summary.c.num_files).add_cte(upsert),
+            )
+
+            num_removed += row.num_files
+
+            if row.num_files < batch_size:
+                break
+
+        LOGGER.info(
+            "pruned tracking",
+            extra={
+                "table": table_name,
+                "file_version": file_version,
+                "file_duration_s": file_duration_s,
+                "backfill": backfill,
+                "kept_after": cutoff.end_timestamp.isoformat(),
+            },
+        )
+
+    return num_removed
+
+
+def run_tracking_maintenance(
+    engine,
+    tables: dict[str, Table],
+    table_names: list[str],
+    settings: Settings,
+):
+    """
+    Compact empty runs, prune old incrementals and refresh the planner's statistics
+    """
+    parquet_import_tracking = tables["parquet_import_tracking"]
+    parquet_import_tracking_summary = tables["parquet_import_tracking_summary"]
+
+    # rows that a running importer might still be extending are left alone
+    before_timestamp = int(time()) - settings.tracking_maintenance_min_age_s
+
+    for table_name in table_names:
+        num_compacted = compact_empty_tracking(
+            engine,
+            parquet_import_tracking,
+            tables[table_name],
+            settings,
+            before_timestamp,
+        )
+
+        if settings.tracking_retention_files > 0:
+            num_pruned = prune_completed_incrementals(
+                engine,
+                parquet_import_tracking,
+                parquet_import_tracking_summary,
+                table_name,
+                settings.tracking_retention_files,
+            )
+        else:
+            num_pruned = 0
+
+        LOGGER.info(
+            "tracking maintenance",
+            extra={
+                "table": table_name,
+                "num_compacted": num_compacted,
+                "num_pruned": num_pruned,
+            },
+        )
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ANALYZE {parquet_import_tracking.fullname}"))
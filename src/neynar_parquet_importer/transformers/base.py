@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List
-from ..database.base import ImportOperation
+import pyarrow as pa
+from ..database.base import ColumnarOperation, ImportOperation
+from .columnar import rows_to_columns
 
 
 class DataTransformer(ABC):
@@ -24,6 +26,29 @@ class ParquetTableTransformer(ABC):
     def transform_rows(self, rows: List[Dict]) -> List[ImportOperation]:
         """Transform rows from THIS table type into operations"""
         pass
+    
+    def transform_batch(self, batch: pa.Table) -> List[ColumnarOperation]:
+        """Transform an Arrow batch into columnar operations
+
+        This default goes through transform_rows. Override it to build the
+        columns straight from Arrow.
+        """
+        grouped = {}
+        for op in self.transform_rows(batch.to_pylist()):
+            key = (op.operation_type, op.entity_type)
+            if key not in grouped:
+                grouped[key] = ([], op.metadata)
+            grouped[key][0].append(op.properties)
+        
+        return [
+            ColumnarOperation(
+                operation_type=operation_type,
+                entity_type=entity_type,
+                columns=rows_to_columns(rows),
+                metadata=metadata,
+            )
+            for (operation_type, entity_type), (rows, metadata) in grouped.items()
+        ]
 
 
 class PassthroughTransformer(DataTransformer):
@@ -56,6 +81,34 @@ class GraphTransformer(DataTransformer):
         else:
             # Default: create nodes with table name as label
             return self._default_node_creation(table_name, rows)
+
+    def transform_batch(
+        self,
+        table_name: str,
+        batch: pa.Table,
+    ) -> List[ColumnarOperation]:
+        """
+        Route an Arrow batch to the table-specific transformer without creating
+        an object per row
+        """
+        if batch.num_rows == 0:
+            return []
+        
+        transformer = self.table_transformers.get(table_name)
+        if transformer:
+            return transformer.transform_batch(batch)
+        else:
+            # Default: create nodes with table name as label
+            return [
+                ColumnarOperation(
+                    operation_type="create_node",
+                    entity_type=table_name.title(),
+                    columns={
+                        name: batch.column(name).to_pylist()
+                        for name in batch.column_names
+                    },
+                ),
+            ]
     
     def _register_table_transformers(self):
         """Register table-specific transformers dynamically based on available tables"""
@@ -0,0 +1,123 @@
+"""
+Helpers for transforming Arrow batches column by column instead of row by row.
+
+Graph databases take parallel lists as query parameters (`UNWIND range(0, size($fid) -
+1) AS i`).
+Building those lists straight from Arrow columns skips the per-row dicts and
+ImportOperation objects.
+"""
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# every byte value -> its two lowercase hex characters
+_HEX_TABLE = np.frombuffer(
+    b"".join(f"{i:02x}".encode() for i in range(256)),
+    dtype=np.uint8,
+).reshape(256, 2)
+
+
+def column_values(batch: pa.Table, name: str) -> list:
+    """
+    Python values for a column. Missing columns are all None (like `row.get(name)`)
+    """
+    if name in batch.column_names:
+        return batch.column(name).to_pylist()
+    return [None] * batch.num_rows
+
+
+def hex_encode(column) -> pa.StringArray:
+    """
+    Encode a binary column as "0x" prefixed hex strings without going through python
+    bytes.
+
+    String columns (some exports already have hex) only get the "0x" prefix added
+    where it is missing.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pc.if_else(
+            pc.starts_with(column, "0x"),
+            column,
+            pc.binary_join_element_wise("0x", column, ""),
+        )
+
+    if pa.types.is_fixed_size_binary(column.type):
+        column = column.cast(pa.binary())
+    elif pa.types.is_large_binary(column.type):
+        column = column.cast(pa.binary())
+
+    num_rows = len(column)
+    if num_rows == 0:
+        return pa.array([], pa.string())
+
+    _, offsets_buffer, data_buffer = column.buffers()
+
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int32)[
+        column.offset : column.offset + num_rows + 1
+    ]
+    lengths = np.diff(offsets)
+
+    if data_buffer is None:
+        raw = np.empty(0, dtype=np.uint8)
+    else:
+        raw = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0] : offsets[-1]]
+
+    # every value becomes "0x" + 2 characters per byte
+    out_offsets = np.zeros(num_rows + 1, dtype=np.int32)
+    np.cumsum(2 * lengths + 2, out=out_offsets[1:])
+
+    width = int(lengths[0])
+    if (lengths == width).all():
+        # every value is the same size (addresses usually are). one lookup and a reshape
+        # builds every row
+        out = np.empty((num_rows, 2 * width + 2), dtype=np.uint8)
+        out[:, 0] = ord("0")
+        out[:, 1] = ord("x")
+        out[:, 2:] = _HEX_TABLE[raw.reshape(num_rows, width)].reshape(
+            num_rows,
+            2 * width,
+        )
+        out = out.reshape(-1)
+    else:
+        out = np.empty(out_offsets[-1], dtype=np.uint8)
+        out[out_offsets[:-1]] = ord("0")
+        out[out_offsets[:-1] + 1] = ord("x")
+
+        if len(raw):
+            row_of_byte = np.repeat(np.arange(num_rows), lengths)
+            byte_in_row = np.arange(len(raw)) - (offsets[row_of_byte] - offsets[0])
+            positions = out_offsets[row_of_byte] + 2 + 2 * byte_in_row
+
+            out[positions] = _HEX_TABLE[raw, 0]
+            out[positions + 1] = _HEX_TABLE[raw, 1]
+
+    if column.null_count:
+        validity = pa.array(column.is_valid()).buffers()[1]
+    else:
+        validity = None
+
+    return pa.StringArray.from_buffers(
+        num_rows,
+        pa.py_buffer(out_offsets),
+        pa.py_buffer(out),
+        validity,
+        column.null_count,
+    )
+
+
+def rows_to_columns(rows: List[dict]) -> dict:
+    """
+    Pivot row dicts into parallel lists. Used to support transformers that only
+    implement transform_rows
+    """
+    columns = {}
+    for row in rows:
+        for name in row:
+            columns.setdefault(name, None)
+
+    return {name: [row.get(name) for row in rows] for name in columns}
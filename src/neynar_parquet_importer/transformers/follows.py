@@ -1,6 +1,8 @@
 from typing import Dict, List
-from ..database.base import ImportOperation
+import pyarrow as pa
+from ..database.base import ColumnarOperation, ImportOperation
 from .base import ParquetTableTransformer
+from .columnar import column_values
 
 
 class FollowsGraphTransformer(ParquetTableTransformer):
@@ -32,3 +34,25 @@ class FollowsGraphTransformer(ParquetTableTransformer):
                 }
             ))
         return operations
+    
+    def transform_batch(self, batch: pa.Table) -> List[ColumnarOperation]:
+        return [
+            ColumnarOperation(
+                operation_type="create_relationship",
+                entity_type="FOLLOWS",
+                columns={
+                    "source_fid": column_values(batch, "fid"),
+                    "target_fid": column_values(batch, "target_fid"),
+                    "timestamp": column_values(batch, "timestamp"),
+                    "created_at": column_values(batch, "created_at"),
+                    "updated_at": column_values(batch, "updated_at"),
+                    "deleted_at": column_values(batch, "deleted_at"),
+                },
+                metadata={
+                    "source_node_type": "User",
+                    "target_node_type": "User",
+                    "source_key": "fid",
+                    "target_key": "fid",
+                },
+            ),
+        ]
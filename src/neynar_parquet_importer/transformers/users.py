@@ -1,6 +1,18 @@
 from typing import Dict, List
-from ..database.base import ImportOperation
+import pyarrow as pa
+from ..database.base import ColumnarOperation, ImportOperation
 from .base import ParquetTableTransformer
+from .columnar import column_values
+
+# optional columns that are copied onto the User node when the table has them
+OPTIONAL_USER_COLUMNS = [
+    "username",
+    "display_name",
+    "pfp_url",
+    "bio",
+    "follower_count",
+    "following_count",
+]
 
 
 class UsersGraphTransformer(ParquetTableTransformer):
@@ -41,3 +53,25 @@ class UsersGraphTransformer(ParquetTableTransformer):
                 }
             ))
         return operations
+    
+    def transform_batch(self, batch: pa.Table) -> List[ColumnarOperation]:
+        columns = {
+            "fid": column_values(batch, "fid"),
+            "updated_at": column_values(batch, "updated_at"),
+        }
+        
+        # Add additional properties based on table type
+        for name in OPTIONAL_USER_COLUMNS:
+            if name in batch.column_names:
+                columns[name] = column_values(batch, name)
+        
+        return [
+            ColumnarOperation(
+                operation_type="create_node",
+                entity_type="User",
+                columns=columns,
+                metadata={
+                    "primary_key": "fid",
+                },
+            ),
+        ]
@@ -1,6 +1,8 @@
 from typing import Dict, List
-from ..database.base import ImportOperation
+import pyarrow as pa
+from ..database.base import ColumnarOperation, ImportOperation
 from .base import ParquetTableTransformer
+from .columnar import column_values, hex_encode
 
 
 class VerificationsGraphTransformer(ParquetTableTransformer):
@@ -56,3 +58,48 @@ class VerificationsGraphTransformer(ParquetTableTransformer):
                 }
             ))
         return operations
+    
+    def transform_batch(self, batch: pa.Table) -> List[ColumnarOperation]:
+        # Convert bytea to hex strings for the whole column at once
+        if "address" in batch.column_names:
+            address_hex = hex_encode(batch.column("address")).to_pylist()
+        else:
+            address_hex = [None] * batch.num_rows
+        
+        protocol = column_values(batch, "protocol")
+        updated_at = column_values(batch, "updated_at")
+        
+        return [
+            ColumnarOperation(
+                operation_type="create_node",
+                entity_type="Address",
+                columns={
+                    "address": address_hex,
+                    "protocol": protocol,
+                    "updated_at": updated_at,
+                },
+                metadata={
+                    "primary_key": "address",
+                },
+            ),
+            # Create HOLDS relationship: fid holds address
+            ColumnarOperation(
+                operation_type="create_relationship",
+                entity_type="HOLDS",
+                columns={
+                    "source_fid": column_values(batch, "fid"),
+                    "target_address": address_hex,
+                    "timestamp": column_values(batch, "timestamp"),
+                    "created_at": column_values(batch, "created_at"),
+                    "updated_at": updated_at,
+                    "deleted_at": column_values(batch, "deleted_at"),
+                    "protocol": protocol,
+                },
+                metadata={
+                    "source_node_type": "User",
+                    "target_node_type": "Address",
+                    "source_key": "fid",
+                    "target_key": "address",
+                },
+            ),
+        ]
@@ -0,0 +1,205 @@
+"""
+Write-combining buffer for incremental imports.
+
+While catching up, consecutive incrementals often contain several versions of the same
+hot rows (follow_counts, profiles, neynar_user_scores, etc.).
+Upserting every version just to overwrite it a moment later is wasted work for postgres.
+This buffer keeps only the newest version of each primary key and writes them all at
+once.
+
+The tracking table is only advanced after the rows it covers are flushed. This keeps
+restarts safe.
+"""
+
+import threading
+from time import time
+
+from sqlalchemy import Table, update
+
+from .db import execute_with_retry, upsert_rows
+from .logger import LOGGER
+from .metering import get_meter
+from .settings import Settings
+
+
+class WriteCombiningBuffer:
+    """Keeps the newest version of each row for one table until it is flushed."""
+
+    def __init__(
+        self,
+        engine,
+        table: Table,
+        parquet_import_tracking: Table,
+        settings: Settings,
+    ):
+        self.engine = engine
+        self.table = table
+        self.parquet_import_tracking = parquet_import_tracking
+        self.max_rows = settings.write_combine_max_rows
+        self.window_s = settings.write_combine_window_s
+
+        self.primary_key_columns = table.primary_key.columns.values()
+        self.primary_key_names = [pk_col.name for pk_col in self.primary_key_columns]
+
+        self.dd_tags = [
+            f"parquet_table:{settings.parquet_s3_schema}.{table.name}",
+            f"path:parquet-importer/{settings.parquet_s3_schema}.{table.name}",
+        ]
+
+        # protects rows, tracking, sequence, and first_add_at
+        self._lock = threading.Lock()
+        # only one flush at a time so that older rows never land after newer rows
+        self._flush_lock = threading.Lock()
+
+        self._rows = {}
+        self._tracking = {}
+        self._first_add_at = None
+
+        # every add/defer_tracking increments the sequence
+        # anything at or below flushed_sequence is safely in the database
+        self._sequence = 0
+        self.flushed_sequence = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def sequence(self) -> int:
+        with self._lock:
+            return self._sequence
+
+    def add(self, rows):
+        """
+        Add rows to the buffer. Older versions of a row are replaced. This may
+        flush if the buffer is full.
+        """
+        num_combined = 0
+
+        with self._lock:
+            if self._first_add_at is None:
+                self._first_add_at = time()
+
+            for row in rows:
+                key = tuple(row[pk_name] for pk_name in self.primary_key_names)
+
+                existing = self._rows.get(key)
+                if existing is not None:
+                    num_combined += 1
+
+                    if existing["updated_at"] > row["updated_at"]:
+                        continue
+
+                self._rows[key] = row
+
+            self._sequence += 1
+
+            full = len(self._rows) >= self.max_rows
+
+        if num_combined:
+            get_meter().increment(
+                "num_parquet_rows_combined",
+                num_combined,
+                self.dd_tags,
+            )
+
+        if full:
+            # flushing in the row group worker applies backpressure to the import
+            self.flush()
+
+    def defer_tracking(self, tracking_id, last_row_group_imported):
+        """Queue a tracking table update for after the next flush."""
+        with self._lock:
+            self._tracking[tracking_id] = last_row_group_imported
+            self._sequence += 1
+
+            if self._first_add_at is None:
+                self._first_add_at = time()
+
+    def flush_if_due(self) -> bool:
+        """Flush if the oldest buffered row has waited longer than the window."""
+        with self._lock:
+            due = (
+                self._first_add_at is None
+                or len(self._rows) >= self.max_rows
+                or time() - self._first_add_at >= self.window_s
+            )
+
+        if due:
+            self.flush()
+
+        return due
+
+    def flush(self):
+        """Upsert all the buffered rows and then advance the tracking table."""
+        with self._flush_lock:
+            with self._lock:
+                rows = self._rows
+                tracking = self._tracking
+                sequence = self._sequence
+                first_add_at = self._first_add_at
+
+                self._rows = {}
+                self._tracking = {}
+                self._first_add_at = None
+
+            try:
+                self._write(rows, tracking)
+            except BaseException:
+                # nothing was lost. the next flush tries again and flushed_sequence
+                # doesn't move until it succeeds
+                self._restore(rows, tracking, first_add_at)
+                raise
+
+            self.flushed_sequence = sequence
+
+        if rows or tracking:
+            get_meter().increment("num_parquet_rows_flushed", len(rows), self.dd_tags)
+
+            LOGGER.debug(
+                "flushed write buffer",
+                extra={
+                    "table": self.table.name,
+                    "rows": len(rows),
+                    "files": len(tracking),
+                    "buffered_s": time() - first_add_at,
+                },
+            )
+
+    def _write(self, rows, tracking):
+        if rows:
+            # schemas can change between files. rows need the same columns to be in the
+            # same statement
+            rows_by_keys = {}
+            for row in rows.values():
+                rows_by_keys.setdefault(tuple(row.keys()), []).append(row)
+
+            for keyed_rows in rows_by_keys.values():
+                upsert_rows(
+                    self.engine, self.table, self.primary_key_columns, keyed_rows,
+                )
+
+        for tracking_id, last_row_group_imported in tracking.items():
+            execute_with_retry(
+                self.engine,
+                update(self.parquet_import_tracking)
+                .where(self.parquet_import_tracking.c.id == tracking_id)
+                .values(last_row_group_imported=last_row_group_imported),
+            )
+
+    def _restore(self, rows, tracking, first_add_at):
+        """
+        Put rows and tracking from a failed flush back. Anything added since
+        then is newer and wins
+        """
+        with self._lock:
+            for key, row in rows.items():
+                existing = self._rows.get(key)
+                if existing is None or existing["updated_at"] < row["updated_at"]:
+                    self._rows[key] = row
+
+            for tracking_id, last_row_group_imported in tracking.items():
+                self._tracking.setdefault(tracking_id, last_row_group_imported)
+
+            if first_add_at is not None and (
+                self._first_add_at is None or first_add_at < self._first_add_at
+            ):
+                self._first_add_at = first_add_at
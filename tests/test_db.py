@@ -10,3 +10,446 @@ def test_clean_embeds():
         data_out[0]["url"]
         == "https://www.fxhash.xyz/article/interview-2023-johnwowkavic-n'-elout-de-kok"
     )
+
+
+def test_group_rows_by_partition():
+    from datetime import datetime
+
+    from sqlalchemy import Column, DateTime, MetaData, Table
+    from sqlalchemy.dialects.postgresql import UUID
+
+    from neynar_parquet_importer.db import group_rows_by_partition
+
+    table = Table(
+        "casts",
+        MetaData(),
+        Column("id", UUID, primary_key=True),
+        Column("timestamp", DateTime, primary_key=True),
+    )
+    rows = [
+        {"id": 1, "timestamp": datetime(2024, 1, 31)},
+        {"id": 2, "timestamp": datetime(2024, 2, 1)},
+        {"id": 3, "timestamp": datetime(2024, 1, 1)},
+    ]
+
+    groups = group_rows_by_partition(rows, table.primary_key.columns.values())
+
+    assert [[row["id"] for row in group] for group in groups] == [[1, 3], [2]]
+
+    unpartitioned = Table("casts", MetaData(), Column("id", UUID, primary_key=True))
+
+    assert group_rows_by_partition(
+        rows,
+        unpartitioned.primary_key.columns.values(),
+    ) == [rows]
+
+
+def test_dedupe_primary_keys():
+    from datetime import datetime
+
+    import pyarrow as pa
+
+    from neynar_parquet_importer.db import dedupe_primary_keys
+
+    batch = pa.table(
+        {
+            "fid": [1, 2, 1, 3, 2, 1],
+            "updated_at": [
+                datetime(2024, 1, 3),
+                datetime(2024, 1, 1),
+                datetime(2024, 1, 2),
+                datetime(2024, 1, 1),
+                datetime(2024, 1, 1),
+                datetime(2024, 1, 3),
+            ],
+            "value": ["a", "b", "c", "d", "e", "f"],
+        },
+    )
+
+    deduped = dedupe_primary_keys(batch, ["fid"])
+
+    # newest updated_at wins. ties go to the last row. original order is kept
+    assert deduped.column("value").to_pylist() == ["d", "e", "f"]
+
+    # no duplicates returns the batch untouched
+    assert dedupe_primary_keys(deduped, ["fid"]) is deduped
+
+
+def test_write_combining_buffer(monkeypatch):
+    from datetime import datetime
+
+    from sqlalchemy import BigInteger, Column, DateTime, Integer, MetaData, Table
+
+    from neynar_parquet_importer import write_buffer
+    from neynar_parquet_importer.settings import Settings
+
+    meta = MetaData()
+    table = Table(
+        "follow_counts",
+        meta,
+        Column("fid", BigInteger, primary_key=True),
+        Column("updated_at", DateTime),
+    )
+    tracking = Table("parquet_import_tracking", meta, Column("id", Integer))
+
+    upserted = []
+    monkeypatch.setattr(
+        write_buffer,
+        "upsert_rows",
+        lambda engine, table, pks, rows: upserted.extend(rows),
+    )
+    monkeypatch.setattr(write_buffer, "execute_with_retry", lambda engine, stmt: None)
+
+    settings = Settings(write_combine_max_rows=100, write_combine_window_s=60)
+    buffer = write_buffer.WriteCombiningBuffer(None, table, tracking, settings)
+
+    buffer.add([{"fid": 1, "updated_at": datetime(2024, 1, 2)}])
+    buffer.add(
+        [
+            {"fid": 1, "updated_at": datetime(2024, 1, 1)},
+            {"fid": 2, "updated_at": datetime(2024, 1, 1)},
+        ],
+    )
+    buffer.defer_tracking(1, 0)
+    buffer.add([{"fid": 2, "updated_at": datetime(2024, 1, 3)}])
+
+    sequence = buffer.sequence()
+
+    # not due yet
+    assert not buffer.flush_if_due()
+    assert buffer.flushed_sequence < sequence
+
+    buffer.flush()
+
+    assert buffer.flushed_sequence == sequence
+    assert len(buffer) == 0
+    assert sorted((row["fid"], row["updated_at"].day) for row in upserted) == [
+        (1, 2),
+        (2, 3),
+    ]
+
+
+def test_write_combining_buffer_failed_flush(monkeypatch):
+    from datetime import datetime
+
+    import pytest
+    from sqlalchemy import BigInteger, Column, DateTime, Integer, MetaData, Table
+
+    from neynar_parquet_importer import write_buffer
+    from neynar_parquet_importer.settings import Settings
+
+    meta = MetaData()
+    table = Table(
+        "follow_counts",
+        meta,
+        Column("fid", BigInteger, primary_key=True),
+        Column("updated_at", DateTime),
+    )
+    tracking = Table("parquet_import_tracking", meta, Column("id", Integer))
+
+    upserted = []
+    failures = [ConnectionError("postgres went away")]
+
+    def upsert_rows(engine, table, pks, rows):
+        if failures:
+            raise failures.pop()
+        upserted.extend(rows)
+
+    monkeypatch.setattr(write_buffer, "upsert_rows", upsert_rows)
+    monkeypatch.setattr(write_buffer, "execute_with_retry", lambda engine, stmt: None)
+
+    settings = Settings(write_combine_max_rows=100, write_combine_window_s=60)
+    buffer = write_buffer.WriteCombiningBuffer(None, table, tracking, settings)
+
+    buffer.add([{"fid": 1, "updated_at": datetime(2024, 1, 1)}])
+    buffer.defer_tracking(1, 0)
+
+    # the file that sync_parquet_to_db would mark completed after this sequence is
+    # flushed
+    file_sequence = buffer.sequence()
+
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+
+    assert buffer.flushed_sequence < file_sequence
+    assert len(buffer) == 1
+
+    # a newer version that arrives before the retry wins over the restored row
+    buffer.add([{"fid": 1, "updated_at": datetime(2024, 1, 2)}])
+
+    buffer.flush()
+
+    assert buffer.flushed_sequence >= file_sequence
+    assert [(row["fid"], row["updated_at"].day) for row in upserted] == [(1, 2)]
+
+
+def test_row_codec():
+    import pyarrow as pa
+    from sqlalchemy import ARRAY, BigInteger, Column, LargeBinary, MetaData, Table
+    from sqlalchemy.dialects.postgresql import JSONB
+
+    from neynar_parquet_importer.row_codecs import get_row_codec
+
+    table = Table(
+        "casts",
+        MetaData(),
+        Column("fid", BigInteger, primary_key=True),
+        Column("hash", LargeBinary),
+        Column("embeds", JSONB),
+        Column("mentions", ARRAY(BigInteger)),
+        Column("embedded_casts_fids", ARRAY(BigInteger)),
+    )
+    batch = pa.table(
+        {
+            "fid": [1, 2],
+            "hash": [b"\x01", b"\x02"],
+            "embeds": ['[{"url": "a"}]', None],
+            # exported as json text
+            "mentions": ["[3, 4]", "{5}"],
+            # a native list
+            "embedded_casts_fids": [[6], []],
+        },
+    )
+
+    codec = get_row_codec(table, batch.schema)
+
+    # the plan is cached and only text jsonb/array columns need decoding
+    assert get_row_codec(table, batch.schema) is codec
+    assert [name for name, _ in codec.decoders] == ["embeds", "mentions"]
+
+    assert codec.to_rows(batch) == [
+        {
+            "fid": 1,
+            "hash": b"\x01",
+            "embeds": [{"url": "a"}],
+            "mentions": [3, 4],
+            "embedded_casts_fids": [6],
+        },
+        {
+            "fid": 2,
+            "hash": b"\x02",
+            "embeds": None,
+            # postgres array literals are left for postgres to parse
+            "mentions": "{5}",
+            "embedded_casts_fids": [],
+        },
+    ]
+
+    raw = codec.to_rows(batch, decode=False)
+    assert raw[0]["embeds"] == '[{"url": "a"}]'
+    assert codec.decode_rows(raw[:1])[0]["embeds"] == [{"url": "a"}]
+
+
+def test_parquet_reader(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from sqlalchemy import BigInteger, Column, MetaData, Table
+
+    from neynar_parquet_importer.db import ParquetReader, read_parquet_metadata
+    from neynar_parquet_importer.row_codecs import get_row_codec
+    from neynar_parquet_importer.row_filters import filter_columns
+    from neynar_parquet_importer.settings import Settings
+
+    local_file = tmp_path / "farcaster-fids-0-1.parquet"
+    pq.write_table(pa.table({"fid": [1, 2], "extra": ["a", "b"]}), local_file)
+
+    table = Table("fids", MetaData(), Column("fid", BigInteger, primary_key=True))
+
+    for memory_map in (False, True):
+        reader = ParquetReader(local_file, Settings(parquet_memory_map=memory_map))
+        reader.project(table)
+
+        # columns that the table doesn't have are never read
+        assert reader.read_row_group(0).column_names == ["fid"]
+
+    # the footer is only decoded once
+    assert read_parquet_metadata(local_file) is read_parquet_metadata(local_file)
+
+    # columns that a filter needs are read, then removed from the rows after filtering
+    reader.project(table, filter_columns({"$or": [{"data.extra": {"$in": ["a"]}}]}))
+    batch = reader.read_row_group(0)
+    assert batch.column_names == ["fid", "extra"]
+
+    codec = get_row_codec(table, batch.schema)
+    rows = codec.to_rows(batch, decode=False)
+    assert rows[0] == {"fid": 1, "extra": "a"}
+    assert codec.decode_rows(rows) == [{"fid": 1}, {"fid": 2}]
+
+    # placeholder tables (no postgres) read everything
+    reader.project(Table("fids", MetaData()))
+    assert reader.read_row_group(0).column_names == ["fid", "extra"]
+
+
+def test_row_groups_outside(tmp_path):
+    from datetime import datetime
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from neynar_parquet_importer.db import ParquetReader
+    from neynar_parquet_importer.settings import Settings
+
+    local_file = tmp_path / "farcaster-fids-0-1.parquet"
+    updated_at = [datetime(2025, 1, day) for day in (1, 2, 3, 4, 5, 6)]
+    pq.write_table(
+        pa.table({"fid": list(range(6)), "updated_at": updated_at}),
+        local_file,
+        row_group_size=2,
+    )
+
+    reader = ParquetReader(local_file, Settings())
+
+    # row group 1 has jan 3 and 4. it overlaps the window
+    assert reader.row_groups_outside(
+        "updated_at",
+        datetime(2025, 1, 4),
+        datetime(2025, 1, 4, 12),
+    ) == {0, 2}
+    assert reader.row_groups_outside("updated_at", None, datetime(2025, 1, 2)) == {1, 2}
+    assert reader.row_groups_outside("updated_at", None, None) == set()
+    assert reader.row_groups_outside("missing", datetime(2025, 1, 4), None) == set()
+
+
+def test_find_parquet_files(tmp_path):
+    from neynar_parquet_importer.cli.direct_import import find_parquet_files
+
+    for name in (
+        "farcaster-casts-20-21.parquet",
+        "farcaster-casts-0-10.parquet",
+        "farcaster-casts-3-4.empty",
+        "farcaster-fids-5-6.parquet",
+    ):
+        (tmp_path / name).touch()
+
+    # full exports come first. each table's files are in timestamp order
+    expected = {
+        "casts": [
+            tmp_path / "farcaster-casts-0-10.parquet",
+            tmp_path / "farcaster-casts-3-4.empty",
+            tmp_path / "farcaster-casts-20-21.parquet",
+        ],
+        "fids": [tmp_path / "farcaster-fids-5-6.parquet"],
+    }
+
+    assert find_parquet_files(tmp_path) == expected
+    assert find_parquet_files(tmp_path / "farcaster-casts-*") == {
+        "casts": expected["casts"],
+    }
+    assert find_parquet_files(tmp_path / "farcaster-fids-5-6.parquet") == {
+        "fids": expected["fids"],
+    }
+    assert find_parquet_files(tmp_path / "missing.parquet") == {}
+
+
+def test_empty_run(monkeypatch):
+    from types import SimpleNamespace
+
+    from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table
+
+    from neynar_parquet_importer import empty_runs
+    from neynar_parquet_importer.settings import Settings
+
+    settings = Settings(
+        npe_version="v3",
+        npe_duration=1,
+        parquet_s3_schema="nindexer",
+        empty_run_compaction=True,
+    )
+    meta = MetaData()
+    table = Table("follows", meta)
+    tracking = Table(
+        "parquet_import_tracking",
+        meta,
+        Column("id", Integer, primary_key=True),
+        *[
+            Column(name, String)
+            for name in ("table_name", "file_name", "file_type", "file_version")
+        ],
+        *[
+            Column(name, Integer)
+            for name in (
+                "file_duration_s",
+                "last_row_group_imported",
+                "total_row_groups",
+            )
+        ],
+        *[Column(name, Boolean) for name in ("is_empty", "backfill", "completed")],
+        Column("end_timestamp", DateTime),
+    )
+
+    statements = []
+    monkeypatch.setattr(
+        empty_runs,
+        "fetchone_with_retry",
+        lambda engine, stmt: statements.append(stmt) or SimpleNamespace(id=1),
+    )
+    monkeypatch.setattr(
+        empty_runs,
+        "execute_with_retry",
+        lambda engine, stmt: statements.append(stmt),
+    )
+
+    run = empty_runs.EmptyRun(None, table, tracking, settings)
+
+    def name(start, suffix="empty"):
+        return f"nindexer-follows-{start}-{start + 1}.{suffix}"
+
+    assert run.add(name(10))
+    assert run.add(name(11))
+    assert run.file_name().endswith("nindexer-follows-10-12.empty")
+
+    # the first record inserts the range. later records extend the same row
+    run.record()
+    assert run.add(name(12))
+    run.record()
+    assert len(statements) == 2
+    assert (
+        statements[1]
+        .compile()
+        .params["file_name"]
+        .endswith("nindexer-follows-10-13.empty")
+    )
+
+    # nothing new to record
+    run.record()
+    assert len(statements) == 2
+
+    # a file with rows ends the run. the next empty file starts a new one
+    assert not run.add(name(13, "parquet"))
+    assert run.add(name(14))
+    assert run.file_name().endswith("nindexer-follows-14-15.empty")
+
+
+def test_drain_row_groups():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from neynar_parquet_importer.db import drain_row_groups
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def row_group(i):
+        if i == 2:
+            started.set()
+            release.wait()
+        return (i, None, None, None)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        fs = [executor.submit(row_group, i) for i in range(5)]
+        started.wait()
+
+        # 0 and 1 finished, 2 is running and 3 and 4 never start
+        threading.Timer(0.05, release.set).start()
+        assert drain_row_groups(fs, 5) == (2, 0)
+        assert fs[3].cancelled() and fs[4].cancelled()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        release.clear()
+        started.clear()
+        fs = [executor.submit(row_group, i) for i in range(2, 4)]
+        started.wait()
+
+        # the timeout runs out while 2 is still writing. it has to be imported again
+        assert drain_row_groups(fs, 0.01) == (None, 1)
+        release.set()
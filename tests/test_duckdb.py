@@ -0,0 +1,108 @@
+import glob
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pyarrow as pa
+import pytest
+
+from neynar_parquet_importer.database.factory import DatabaseFactory
+from neynar_parquet_importer.db import (
+    get_non_postgres_tables,
+    import_parquet,
+    mark_completed,
+)
+from neynar_parquet_importer.settings import Settings
+
+pytest.importorskip("duckdb")
+
+
+class NoProgress:
+    def __call__(self, advance):
+        pass
+
+    def more_steps(self, more_steps):
+        pass
+
+
+def test_duckdb_import(tmp_path):
+    from neynar_parquet_importer.database.duckdb import schema_primary_keys
+
+    settings = Settings(
+        database_backend="duckdb",
+        import_tracking_backend="duckdb",
+        duckdb_path=tmp_path / "mirror.duckdb",
+        parquet_s3_schema="nindexer",
+        npe_version="v3",
+        npe_duration=1,
+    )
+    settings.initialize()
+
+    assert schema_primary_keys("follows", settings) == ["id"]
+    assert schema_primary_keys(
+        "fids",
+        settings.model_copy(update={"parquet_s3_schema": "farcaster"}),
+    ) == ["fid"]
+
+    tables = get_non_postgres_tables(["follows"])
+    files = sorted(glob.glob("tests/data/nindexer-follows-*.parquet"))
+
+    try:
+        with ThreadPoolExecutor(2) as executor:
+            for _ in range(2):
+                # the second pass is a no-op. every file is already tracked as imported
+                for local_file in files:
+                    import_parquet(
+                        None,
+                        tables["follows"],
+                        local_file,
+                        "incremental",
+                        NoProgress(),
+                        NoProgress(),
+                        tables["parquet_import_tracking"],
+                        executor,
+                        None,
+                        settings,
+                        Future(),
+                        backfill_start_timestamp=None,
+                        backfill_end_timestamp=None,
+                    )
+                    mark_completed(
+                        None,
+                        tables["parquet_import_tracking"],
+                        [local_file],
+                        settings=settings,
+                    )
+
+        backend = DatabaseFactory.get_backend(settings, ["follows"])
+        conn = backend.conn
+
+        assert conn.execute("SELECT count(*) FROM follows").fetchone()[0] == 7
+        assert conn.execute(
+            "SELECT count(*) FROM parquet_import_tracking "
+            "WHERE completed AND last_row_group_imported = 0",
+        ).fetchone()[0] == len(files)
+
+        latest = backend.get_latest_import(
+            "follows",
+            "incremental",
+            False,
+            True,
+            settings,
+        )
+        assert latest["file_name"] == files[-1]
+
+        # older versions of a row never replace newer ones
+        row_id, updated_at = conn.execute(
+            "SELECT id, updated_at FROM follows LIMIT 1",
+        ).fetchone()
+        older = conn.execute(
+            "SELECT * REPLACE (updated_at - INTERVAL 1 DAY AS updated_at, 0 AS fid) "
+            "FROM follows WHERE id = ?",
+            [row_id],
+        ).arrow()
+        backend.import_arrow("follows", pa.table(older))
+        assert conn.execute(
+            "SELECT updated_at, fid != 0 FROM follows WHERE id = ?",
+            [row_id],
+        ).fetchone() == (updated_at, True)
+    finally:
+        DatabaseFactory.close_all()
@@ -0,0 +1,82 @@
+import logging
+from pathlib import Path
+
+import orjson
+
+from neynar_parquet_importer.logger import (
+    CustomJsonFormatter,
+    DebugRateLimit,
+    ImporterQueueHandler,
+)
+
+
+def make_record(
+    level=logging.DEBUG,
+    lineno=1,
+    created=1000.0,
+    msg="filtered",
+    args=None,
+    **extra,
+):
+    record = logging.LogRecord("app", level, "db.py", lineno, msg, args, None)
+    record.created = created
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    record = make_record(
+        logging.INFO,
+        msg="imported %s",
+        args=("casts",),
+        table="casts",
+        path=Path("data/casts.parquet"),
+        rows={1},
+    )
+
+    data = orjson.loads(CustomJsonFormatter().format(record))
+
+    assert data["level"] == "INFO"
+    assert data["name"] == "app"
+    assert data["message"] == "imported casts"
+    assert data["timestamp"].startswith("1970-01-01T00:16:40")
+    assert data["table"] == "casts"
+    assert data["path"] == "data/casts.parquet"
+    assert data["rows"] == [1]
+    assert "lineno" not in data
+
+
+def test_debug_rate_limit():
+    rate_limit = DebugRateLimit(2)
+
+    # 5 records from one line in the same second. only 2 pass
+    passed = [rate_limit.filter(make_record(created=1000.1 + i / 10)) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    # another line has its own budget and INFO is never limited
+    assert rate_limit.filter(make_record(lineno=2, created=1000.5))
+    assert rate_limit.filter(make_record(logging.INFO, created=1000.6))
+
+    # the next second's first record says how many were dropped
+    record = make_record(created=1001.0)
+    assert rate_limit.filter(record)
+    assert record.suppressed == 3
+
+    record = make_record(created=1001.1)
+    assert rate_limit.filter(record)
+    assert not hasattr(record, "suppressed")
+
+
+def test_queue_handler_prepare():
+    handler = ImporterQueueHandler(None)
+
+    args = ["casts"]
+    record = make_record(msg="imported %s", args=(args,), table="casts")
+
+    prepared = handler.prepare(record)
+
+    # the message doesn't change if the caller changes its arguments later
+    args.append("reactions")
+    assert prepared.msg == "imported ['casts']"
+    assert prepared.args is None
+    assert prepared.table == "casts"
@@ -0,0 +1,71 @@
+import threading
+
+from neynar_parquet_importer import metering
+from neynar_parquet_importer.metering import Meter
+
+
+class FakeStatsd:
+    def __init__(self):
+        self.increments = []
+        self.gauges = []
+
+    def increment(self, metric, value=1, tags=None):
+        self.increments.append((metric, value, tags))
+
+    def gauge(self, metric, value, tags=None):
+        self.gauges.append((metric, value, tags))
+
+
+def test_meter_flush(monkeypatch):
+    fake = FakeStatsd()
+    monkeypatch.setattr(metering, "statsd", fake)
+
+    meter = Meter()
+    # started without the flush thread. the test flushes by hand
+    meter.direct = False
+
+    tags = ["parquet_table:farcaster.casts"]
+
+    def worker():
+        for _ in range(1000):
+            meter.increment("num_parquet_rows_imported", 2, tags)
+        meter.gauge("parquet_row_age_s", 5, tags)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    meter.increment("usage.cu", 10, ["parquet_table:farcaster.fids"])
+
+    assert fake.increments == []
+
+    meter.flush()
+
+    # one packet per metric and table instead of one per row group
+    assert sorted(fake.increments) == [
+        ("num_parquet_rows_imported", 8000, tags),
+        ("usage.cu", 10, ["parquet_table:farcaster.fids"]),
+    ]
+    assert fake.gauges == [("parquet_row_age_s", 5, tags)]
+
+    # only what was counted since the last flush is sent
+    meter.increment("usage.cu", 5, ["parquet_table:farcaster.fids"])
+    fake.increments.clear()
+    fake.gauges.clear()
+
+    meter.flush()
+
+    assert fake.increments == [("usage.cu", 5, ["parquet_table:farcaster.fids"])]
+    assert fake.gauges == []
+
+
+def test_meter_direct(monkeypatch):
+    fake = FakeStatsd()
+    monkeypatch.setattr(metering, "statsd", fake)
+
+    meter = Meter()
+    meter.increment("usage.cu", 3, ["a"])
+
+    assert fake.increments == [("usage.cu", 3, ["a"])]
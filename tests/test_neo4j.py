@@ -0,0 +1,158 @@
+import csv
+import threading
+from pathlib import Path
+
+from neynar_parquet_importer.database.base import ColumnarOperation
+from neynar_parquet_importer.database.neo4j import KnownNodeCache, Neo4jBackend
+from neynar_parquet_importer.database.neo4j_bulk import Neo4jBulkExporter
+from neynar_parquet_importer.settings import Settings
+
+
+def test_known_node_cache():
+    cache = KnownNodeCache(2)
+
+    assert cache.missing("User", "fid", [3, None, 1, 3]) == [1, 3]
+
+    cache.add("User", "fid", [1, 3])
+    assert cache.missing("User", "fid", [1, 2, 3]) == [2]
+    assert cache.missing("Address", "address", ["0x01"]) == ["0x01"]
+
+    # the least recently used key is evicted
+    cache.add("User", "fid", [2])
+    assert len(cache) == 2
+    assert cache.missing("User", "fid", [1, 2, 3]) == [1]
+
+    disabled = KnownNodeCache(0)
+    disabled.add("User", "fid", [1])
+    assert disabled.missing("User", "fid", [1]) == [1]
+
+
+def test_partition_relationships():
+    backend = Neo4jBackend()
+    backend._edge_locks = [threading.Lock() for _ in range(2)]
+
+    op = ColumnarOperation(
+        operation_type="create_relationship",
+        entity_type="FOLLOWS",
+        columns={
+            "source_fid": [5, 1, 3, 1, None],
+            "target_fid": [2, 3, 2, 2, 4],
+            "timestamp": ["a", "b", "c", "d", "e"],
+        },
+        metadata={"source_key": "fid", "target_key": "fid"},
+    )
+
+    partitions = backend._partition_relationships(op)
+
+    # ints hash to themselves, so even targets go to stripe 0
+    assert [stripe for stripe, _ in partitions] == [0, 1]
+
+    assert partitions[0][1].columns == {
+        "source_fid": [1, 3, 5],
+        "target_fid": [2, 2, 2],
+        "timestamp": ["d", "c", "a"],
+    }
+    assert partitions[1][1].columns == {
+        "source_fid": [1],
+        "target_fid": [3],
+        "timestamp": ["b"],
+    }
+
+
+def test_bulk_export(tmp_path):
+    data_dir = Path(__file__).parent / "data"
+    settings = Settings(npe_version="v3", incremental_duration=1)
+
+    exporter = Neo4jBulkExporter(tmp_path, settings)
+    for parquet_file in sorted(data_dir.glob("*.parquet")):
+        exporter.export_file(parquet_file)
+    args = exporter.finish()
+
+    assert args[:3] == ["database", "import", "full"]
+    assert not (tmp_path / "keys.sqlite").exists()
+
+    def read(name):
+        with open(tmp_path / name, newline="") as f:
+            return list(csv.reader(f))
+
+    assert read("relationships-FOLLOWS-0.header.csv")[0] == [
+        ":START_ID(User)",
+        ":END_ID(User)",
+        "timestamp:datetime",
+        "created_at:datetime",
+        "updated_at:datetime",
+        # always null in the test data. the type comes from the parquet schema
+        "deleted_at:datetime",
+    ]
+    follows = read("relationships-FOLLOWS-0.csv")
+    assert len(follows) == 7
+
+    # every endpoint gets exactly one stub node
+    users = read("nodes-User-0.csv")
+    user_ids = [row[0] for row in users]
+    assert len(user_ids) == len(set(user_ids))
+    endpoints = {row[0] for row in follows} | {row[1] for row in follows}
+    endpoints |= {row[0] for row in read("relationships-HOLDS-0.csv")}
+    assert set(user_ids) == endpoints
+
+    tracking = read("nodes-ImportTracking-0.csv")
+    assert len(tracking) == 5
+    header = read("nodes-ImportTracking-0.header.csv")[0]
+    assert header[0] == ":ID(ImportTracking)"
+    assert "end_timestamp:long" in header
+
+
+def test_bulk_export_merges_nodes(tmp_path):
+    from datetime import datetime
+
+    exporter = Neo4jBulkExporter(tmp_path, Settings())
+
+    def users(columns):
+        return ColumnarOperation(
+            operation_type="create_node",
+            entity_type="User",
+            columns=columns,
+            metadata={"primary_key": "fid"},
+        )
+
+    # like profiles. fid 1 is in the file twice and the newer row comes first
+    exporter.write_operation(
+        users(
+            {
+                "fid": [1, 2, 1],
+                "updated_at": [
+                    datetime(2024, 1, 3),
+                    datetime(2024, 1, 1),
+                    datetime(2024, 1, 2),
+                ],
+                "username": ["new", "two", "old"],
+            },
+        ),
+    )
+    # like fids. a second table for the same label with other properties
+    exporter.write_operation(users({
+        "fid": [1, 3],
+        "updated_at": [datetime(2024, 1, 1), datetime(2024, 1, 5)],
+        "custody_address": ["0x01", "0x03"],
+    }))
+    exporter.finish()
+
+    with open(tmp_path / "nodes-User-0.header.csv", newline="") as f:
+        assert next(csv.reader(f)) == [
+            ":ID(User)",
+            "fid:long",
+            "updated_at:datetime",
+            "username:string",
+            "custody_address:string",
+        ]
+
+    with open(tmp_path / "nodes-User-0.csv", newline="") as f:
+        rows = {row[0]: row for row in csv.reader(f)}
+
+    # one node per key. the newest row's values win and properties from both tables are
+    # kept
+    assert rows == {
+        "1": ["1", "1", "2024-01-03T00:00:00", "new", "0x01"],
+        "2": ["2", "2", "2024-01-01T00:00:00", "two", ""],
+        "3": ["3", "3", "2024-01-05T00:00:00", "", "0x03"],
+    }
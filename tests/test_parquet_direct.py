@@ -361,6 +361,86 @@ def test_postgresql_backend(test_parquet_files):
     assert result in ["already_imported"] or isinstance(result, dict), f"Unexpected result type: {type(result)}"
 
 
+def test_partitions_move_default_rows():
+    """
+    Rows that landed in the DEFAULT partition are moved when their month's partition
+    is created
+    """
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import create_engine, text
+
+    from neynar_parquet_importer.db import create_upcoming_partitions
+
+    settings = create_test_settings("postgresql")
+    settings.postgres_schema = "partition_test"
+    settings.postgres_partitioned_tables = "events"
+    settings.postgres_partition_months_ahead = 1
+
+    engine = create_engine(str(settings.postgres_dsn))
+
+    helpers = (
+        Path(__file__).parent.parent
+        / "schema/partitioned/000_01_all_partition_helpers.sql"
+    ).read_text()
+
+    next_month = (datetime.now().replace(day=1) + timedelta(days=32)).replace(day=1)
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "DROP SCHEMA IF EXISTS partition_test CASCADE; "
+                    "CREATE SCHEMA partition_test",
+                ),
+            )
+            conn.execute(text(helpers.replace("${POSTGRES_SCHEMA}", "partition_test")))
+            conn.execute(
+                text(
+                    "CREATE TABLE partition_test.events ("
+                    'id bigint, "timestamp" timestamp NOT NULL, '
+                    'PRIMARY KEY (id, "timestamp")'
+                    ') PARTITION BY RANGE ("timestamp");'
+                    "CREATE TABLE partition_test.events_default "
+                    "PARTITION OF partition_test.events DEFAULT",
+                ),
+            )
+            # next month's partition doesn't exist yet, so these go to DEFAULT
+            conn.execute(
+                text('INSERT INTO partition_test.events VALUES (1, :ts), (2, :ts)'),
+                {"ts": next_month + timedelta(days=3)},
+            )
+
+        # creating the partition directly would fail because of the rows in DEFAULT
+        create_upcoming_partitions(engine, ["events"], settings)
+        create_upcoming_partitions(engine, ["events"], settings)
+
+        partition_name = f"events_{next_month:%Y_%m}"
+        with engine.connect() as conn:
+            assert (
+                conn.execute(
+                    text(f"SELECT count(*) FROM partition_test.{partition_name}"),
+                ).scalar()
+                == 2
+            )
+            assert (
+                conn.execute(
+                    text("SELECT count(*) FROM partition_test.events_default"),
+                ).scalar()
+                == 0
+            )
+            assert (
+                conn.execute(
+                    text("SELECT count(*) FROM partition_test.events"),
+                ).scalar()
+                == 2
+            )
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DROP SCHEMA IF EXISTS partition_test CASCADE"))
+        engine.dispose()
+
+
 def test_neo4j_backend(test_parquet_files):
     """Test parquet processing specifically with Neo4j backend"""
     settings = create_test_settings("neo4j")
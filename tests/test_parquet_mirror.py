@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from neynar_parquet_importer.database.parquet_mirror import (
+    ParquetMirrorBackend,
+    read_manifest,
+    read_snapshot,
+    split_by_day,
+)
+from neynar_parquet_importer.settings import Settings
+
+
+def test_parquet_mirror(tmp_path):
+    settings = Settings(
+        database_backend="parquet",
+        parquet_mirror_dir=tmp_path,
+        parquet_mirror_compact_s=0,
+        parquet_mirror_compact_min_files=2,
+        parquet_mirror_retain_s=0,
+    )
+
+    backend = ParquetMirrorBackend()
+    backend.init_db(None, ["fids"], settings)
+
+    def batch(fids, day, hour, name):
+        return pa.table(
+            {
+                "fid": fids,
+                "name": [name] * len(fids),
+                "updated_at": [datetime(2025, 1, day, hour)] * len(fids),
+            },
+        )
+
+    backend.import_arrow("fids", batch([3, 1], 1, 2, "new"))
+    # an older version of fid 1 arrives later. it must not win
+    backend.import_arrow("fids", batch([1, 2], 1, 1, "old"))
+    backend.import_arrow("fids", batch([4], 2, 0, "other day"))
+
+    manifest = read_manifest(tmp_path / "fids")
+    assert sorted(entry["day"] for entry in manifest["files"]) == [
+        "2025-01-01",
+        "2025-01-01",
+        "2025-01-02",
+    ]
+
+    # only the day with enough small files is merged
+    assert backend.compact("fids") == 2
+
+    manifest = read_manifest(tmp_path / "fids")
+    assert len(manifest["files"]) == 2
+    assert manifest["removed"] == []
+    assert len(list(tmp_path.glob("fids/day=*/*.parquet"))) == 2
+
+    compacted = pq.read_table(tmp_path / "fids" / manifest["files"][-1]["path"])
+    # deduplicated and sorted by primary key
+    assert compacted.column("fid").to_pylist() == [1, 2, 3]
+    assert compacted.column("name").to_pylist() == ["new", "old", "new"]
+
+    snapshot = read_snapshot(tmp_path, "fids", ["fid"])
+    assert sorted(snapshot.column("fid").to_pylist()) == [1, 2, 3, 4]
+
+    backend.close()
+
+
+def test_split_by_day_keeps_null_updated_at():
+    import time
+
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+
+    batch = pa.table(
+        {
+            "fid": [1, 2, 3],
+            "updated_at": [datetime(2025, 1, 1), None, datetime(2025, 1, 2)],
+        },
+    )
+
+    days = split_by_day(batch)
+
+    # no row is dropped. the null one goes to today's partition
+    assert {day: t.column("fid").to_pylist() for day, t in days.items()} == {
+        "2025-01-01": [1],
+        "2025-01-02": [3],
+        today: [2],
+    }
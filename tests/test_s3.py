@@ -0,0 +1,282 @@
+import boto3
+from botocore.stub import Stubber
+from sqlalchemy import MetaData, Table
+
+from neynar_parquet_importer.s3 import list_incrementals
+from neynar_parquet_importer.settings import Settings
+
+
+def test_list_incrementals():
+    settings = Settings(npe_version="v3", npe_duration=1)
+    table = Table("casts", MetaData())
+
+    prefix = settings.parquet_s3_prefix() + "incremental/farcaster-casts-"
+
+    def s3_object(start, size=10):
+        return {"Key": f"{prefix}{start}-{start + 1}.parquet", "Size": size}
+
+    s3_client = boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id="x",
+        aws_secret_access_key="x",
+    )
+
+    with Stubber(s3_client) as stubber:
+        # two pages. the backlog is listed with a few requests instead of one per file
+        stubber.add_response(
+            "list_objects_v2",
+            {
+                "Contents": [s3_object(100), s3_object(101, 0)],
+                "IsTruncated": True,
+                "NextContinuationToken": "next",
+            },
+            {
+                "Bucket": settings.parquet_s3_bucket,
+                "Prefix": prefix,
+                "StartAfter": f"{prefix}99.",
+            },
+        )
+        stubber.add_response(
+            "list_objects_v2",
+            {
+                # 102 is missing. it is polled for like before
+                "Contents": [s3_object(103), s3_object(104), s3_object(105)],
+                "IsTruncated": False,
+            },
+            {
+                "Bucket": settings.parquet_s3_bucket,
+                "Prefix": prefix,
+                "StartAfter": f"{prefix}99.",
+                "ContinuationToken": "next",
+            },
+        )
+
+        found = list_incrementals(s3_client, settings, table, 100, 105, 100)
+
+    assert sorted(found) == [100, 101, 103, 104]
+    assert found[101]["Size"] == 0
+
+
+def test_plan_backfill():
+    from neynar_parquet_importer.backfill import plan_backfill
+
+    settings = Settings(npe_version="v3", npe_duration=1)
+    table = Table("casts", MetaData())
+
+    incremental_prefix = settings.parquet_s3_prefix() + "incremental/farcaster-casts-"
+    full_prefix = settings.parquet_s3_prefix() + "full/farcaster-casts-0-"
+
+    s3_client = boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id="x",
+        aws_secret_access_key="x",
+    )
+
+    with Stubber(s3_client) as stubber:
+        stubber.add_response(
+            "list_objects_v2",
+            {
+                "Contents": [
+                    {
+                        "Key": f"{incremental_prefix}{start}-{start + 1}.parquet",
+                        "Size": 10,
+                    }
+                    for start in (103, 104)
+                ],
+                "IsTruncated": False,
+            },
+            {
+                "Bucket": settings.parquet_s3_bucket,
+                "Prefix": incremental_prefix,
+                "StartAfter": f"{incremental_prefix}99.",
+            },
+        )
+        # the range starts before the oldest incremental. the oldest full export that
+        # reaches it fills the gap
+        stubber.add_response(
+            "list_objects_v2",
+            {
+                "Contents": [
+                    {"Key": f"{full_prefix}{end}.parquet", "Size": 10}
+                    for end in (90, 110, 105)
+                ],
+                "IsTruncated": False,
+            },
+            {"Bucket": settings.parquet_s3_bucket, "Prefix": full_prefix},
+        )
+
+        plan = plan_backfill(s3_client, settings, table, 100, 105)
+
+    assert [
+        (file_type, s3_object["Key"], window_start, window_end)
+        for file_type, s3_object, window_start, window_end in plan
+    ] == [
+        ("full", f"{full_prefix}105.parquet", 100, 103),
+        ("incremental", f"{incremental_prefix}103-104.parquet", 100, 105),
+        ("incremental", f"{incremental_prefix}104-105.parquet", 100, 105),
+    ]
+
+
+def test_sparse_download(tmp_path):
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from botocore.response import StreamingBody
+    from rich.progress import Progress
+
+    from neynar_parquet_importer.progress import ProgressCallback
+    from neynar_parquet_importer.s3 import (
+        FOOTER_GUESS_BYTES,
+        read_sparse_sidecar,
+        row_group_byte_ranges,
+        sparse_download,
+    )
+    from neynar_parquet_importer.settings import SHUTDOWN_EVENT
+
+    # progress callbacks raise if an earlier test left the importer shutting down
+    SHUTDOWN_EVENT.clear()
+
+    settings = Settings(sparse_download=True, sparse_download_min_bytes=0)
+
+    # 4 row groups with 100 fids each
+    buffer = io.BytesIO()
+    pq.write_table(
+        pa.table({"fid": list(range(400)), "text": [f"cast {i}" for i in range(400)]}),
+        buffer,
+        row_group_size=100,
+    )
+    data = buffer.getvalue()
+    metadata = pq.read_metadata(pa.BufferReader(data))
+
+    row_filters = {"data.fid": {"$in": [150, 320]}}
+
+    def body(start, end):
+        return {"Body": StreamingBody(io.BytesIO(data[start:end]), end - start)}
+
+    s3_client = boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id="x",
+        aws_secret_access_key="x",
+    )
+
+    with Stubber(s3_client) as stubber:
+        tail_start = max(0, len(data) - FOOTER_GUESS_BYTES)
+        stubber.add_response(
+            "get_object",
+            body(tail_start, len(data)),
+            {
+                "Bucket": settings.parquet_s3_bucket,
+                "Key": "key",
+                "Range": f"bytes={tail_start}-{len(data) - 1}",
+            },
+        )
+        # only row groups 1 and 3 can have those fids
+        for start, end in row_group_byte_ranges(metadata, [1, 3], max_gap=64 * 1024):
+            stubber.add_response(
+                "get_object",
+                body(start, end),
+                {
+                    "Bucket": settings.parquet_s3_bucket,
+                    "Key": "key",
+                    "Range": f"bytes={start}-{end - 1}",
+                },
+            )
+
+        local_file = tmp_path / "farcaster-casts-0-1.parquet"
+        progress = ProgressCallback(Progress(), "bytes", 0, enabled=False)
+
+        # one worker keeps the requests in the stubbed order
+        with ThreadPoolExecutor(max_workers=1) as threadpool:
+            sparse_download(
+                s3_client,
+                "key",
+                tmp_path / "incoming.parquet",
+                local_file,
+                progress,
+                len(data),
+                settings,
+                threadpool,
+                row_filters,
+            )
+
+        stubber.assert_no_pending_responses()
+
+    assert read_sparse_sidecar(local_file) == {
+        "row_groups": [1, 3],
+        "num_row_groups": 4,
+        "filters": row_filters,
+    }
+
+    parquet_file = pq.ParquetFile(local_file)
+    for i in (1, 3):
+        assert parquet_file.read_row_group(i) == pq.ParquetFile(
+            pa.BufferReader(data),
+        ).read_row_group(i)
+
+
+def test_sparse_download_failure_waits_for_writers(tmp_path, monkeypatch):
+    import os
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import pytest
+    from rich.progress import Progress
+
+    from neynar_parquet_importer import s3
+    from neynar_parquet_importer.progress import ProgressCallback
+    from neynar_parquet_importer.settings import SHUTDOWN_EVENT
+
+    SHUTDOWN_EVENT.clear()
+
+    monkeypatch.setattr(s3, "fetch_parquet_footer", lambda *args: (b"PAR1", None))
+    monkeypatch.setattr(s3, "row_groups_matching", lambda metadata, row_filters: [0, 1])
+    monkeypatch.setattr(
+        s3,
+        "row_group_byte_ranges",
+        lambda metadata, row_groups: [(0, 4), (4, 8)],
+    )
+
+    slow_started = threading.Event()
+    writes = []
+
+    def sparse_download_range(
+        s3_client,
+        s3_key,
+        fd,
+        start,
+        end,
+        progress_callback,
+        settings,
+    ):
+        if start == 0:
+            slow_started.wait()
+            raise ConnectionError("s3 went away")
+
+        slow_started.set()
+        time.sleep(0.2)
+        writes.append(os.pwrite(fd, b"data", start))
+
+    monkeypatch.setattr(s3, "_sparse_download_range", sparse_download_range)
+
+    with ThreadPoolExecutor(max_workers=2) as threadpool:
+        with pytest.raises(ConnectionError):
+            s3.sparse_download(
+                None,
+                "key",
+                tmp_path / "incoming.parquet",
+                tmp_path / "farcaster-casts-0-1.parquet",
+                ProgressCallback(Progress(), "bytes", 0, enabled=False),
+                16,
+                Settings(),
+                threadpool,
+                {},
+            )
+
+        # the other range finished writing before the fd was closed
+        assert writes == [4]
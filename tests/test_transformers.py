@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pyarrow as pa
+
+from neynar_parquet_importer.transformers.columnar import hex_encode
+from neynar_parquet_importer.transformers.follows import FollowsGraphTransformer
+from neynar_parquet_importer.transformers.verifications import (
+    VerificationsGraphTransformer,
+)
+
+
+def test_hex_encode():
+    column = pa.array([b"\x00\xff", None, b"", b"\xab\xcd\xef"], pa.binary())
+
+    assert hex_encode(column).to_pylist() == ["0x00ff", None, "0x", "0xabcdef"]
+
+    # sliced arrays have an offset into the underlying buffers
+    assert hex_encode(column.slice(2)).to_pylist() == ["0x", "0xabcdef"]
+
+    fixed = pa.array([b"\x01" * 20, None], pa.binary(20))
+    assert hex_encode(fixed).to_pylist() == ["0x" + "01" * 20, None]
+
+    strings = pa.array(["0xabc", "def", None])
+    assert hex_encode(strings).to_pylist() == ["0xabc", "0xdef", None]
+
+
+def _columns_to_rows(op):
+    names = list(op.columns)
+    return [dict(zip(names, values)) for values in zip(*op.columns.values())]
+
+
+def test_transform_batch_matches_transform_rows():
+    now = datetime(2024, 1, 1)
+
+    batch = pa.table(
+        {
+            "fid": [1, 2],
+            "address": pa.array([b"\x12\x34", b"\xab"], pa.binary()),
+            "protocol": [0, 1],
+            "timestamp": [now, now],
+            "created_at": [now, now],
+            "updated_at": [now, now],
+            "deleted_at": pa.array([None, now], pa.timestamp("us")),
+            "target_fid": [3, 4],
+        },
+    )
+
+    for transformer in [VerificationsGraphTransformer(), FollowsGraphTransformer()]:
+        row_ops = transformer.transform_rows(batch.to_pylist())
+        columnar_ops = transformer.transform_batch(batch)
+
+        for columnar in columnar_ops:
+            expected = [
+                op.properties
+                for op in row_ops
+                if op.entity_type == columnar.entity_type
+                and op.operation_type == columnar.operation_type
+            ]
+
+            assert _columns_to_rows(columnar) == expected
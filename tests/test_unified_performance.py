@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from neynar_parquet_importer.database.unified_performance import (
+    AdjustableSemaphore,
+    MonitoringLevel,
+    UnifiedPerformanceManager,
+)
+from neynar_parquet_importer.settings import Settings, ShuttingDown
+
+
+def _manager(**kwargs):
+    kwargs.setdefault("adaptive_control", True)
+    settings = Settings(
+        adaptive_window=2,
+        adaptive_latency_slo_s=1.0,
+        adaptive_latency_slo_overrides="casts=10",
+        adaptive_max_batch_size=2000,
+        row_workers=4,
+        **kwargs,
+    )
+    return UnifiedPerformanceManager("postgresql", MonitoringLevel.MINIMAL, settings)
+
+
+def test_adaptive_batch_size():
+    manager = _manager()
+
+    assert manager.batch_size("follows") == 2000
+
+    # over the SLO. halve the batch size
+    manager.record_batch("follows", 1.5)
+    manager.record_batch("follows", 1.5)
+    assert manager.batch_size("follows") == 1000
+
+    # other tables are independent. casts has a higher SLO
+    manager.record_batch("casts", 1.5)
+    manager.record_batch("casts", 1.5)
+    assert manager.batch_size("casts") == 2000
+
+    # plenty of headroom. grow additively
+    manager.record_batch("follows", 0.1)
+    manager.record_batch("follows", 0.1)
+    assert manager.batch_size("follows") == 1095
+
+    # an error decides right away and also halves the concurrency
+    manager.record_batch("follows", 0.1, error=True)
+    assert manager.batch_size("follows") == 547
+    assert manager._table_control("follows").slots.limit == 2
+
+    disabled = _manager(adaptive_control=False)
+    disabled.record_batch("follows", 100, error=True)
+    assert disabled.batch_size("follows") == 2000
+
+
+def test_adjustable_semaphore():
+    semaphore = AdjustableSemaphore(2)
+    semaphore.acquire()
+    semaphore.acquire()
+
+    # lowering the limit doesn't interrupt the holders
+    semaphore.set_limit(1)
+    assert semaphore.active == 2
+
+    acquired = threading.Event()
+
+    def waiter():
+        semaphore.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+
+    semaphore.release()
+    assert not acquired.wait(0.2)
+
+    semaphore.release()
+    assert acquired.wait(5)
+    thread.join()
+
+    shutdown = threading.Event()
+    shutdown.set()
+    with pytest.raises(ShuttingDown):
+        semaphore.acquire(shutdown)
+
+
+def test_acquire_row_group_slot():
+    manager = _manager()
+    manager._table_control("follows").slots.set_limit(1)
+
+    release = manager.acquire_row_group_slot("follows")
+
+    # follows is at its limit. other tables aren't held up by it
+    manager.acquire_row_group_slot("casts")()
+
+    shutdown = threading.Event()
+    shutdown.set()
+    with pytest.raises(ShuttingDown):
+        manager.acquire_row_group_slot("follows", shutdown)
+
+    release()
+    manager.acquire_row_group_slot("follows", shutdown)()
+
+    # without adaptive control there is no limit
+    disabled = _manager(adaptive_control=False)
+    for _ in range(10):
+        disabled.acquire_row_group_slot("follows", shutdown)